@@ -0,0 +1,111 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+
+
+DEFAULT_SEED = 1312
+
+SUITES = ("queries", "filters", "templates", "requests")
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+async def run(args: argparse.Namespace) -> dict:
+    # imported here so that the environment is set up before the config is read
+    from benchmarks import suites
+    from tests.utils.corpus import make_corpus
+
+    users, posts = make_corpus(args.seed, args.users, args.posts)
+    corpus = suites.Corpus(args.seed, users, posts)
+
+    results: dict = {}
+    if "queries" in args.suites:
+        results.update(suites.query_builders(corpus, args))
+    if "filters" in args.suites:
+        results.update(await suites.filters(corpus, args))
+    if "templates" in args.suites:
+        results.update(await suites.templates(corpus, args))
+    if "requests" in args.suites:
+        if args.mongo_uri is None:
+            print("Skipping requests, no --mongo-uri given", file=sys.stderr)
+        else:
+            results.update(await suites.requests(corpus, args))
+
+    return {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "users": args.users,
+        "posts": args.posts,
+        "indexes": args.build_indexes,
+        "facet_collections": args.facet_collections,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark searches against a synthetic Parler archive."
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed rounds.")
+    parser.add_argument(
+        "--number",
+        type=int,
+        default=1000,
+        help="Calls per round, renders and requests make a hundredth as many.",
+    )
+    parser.add_argument(
+        "--suites", nargs="+", choices=SUITES, default=SUITES, metavar="SUITE"
+    )
+    parser.add_argument(
+        "--mongo-uri", help="Local mongod to load the archive into for requests."
+    )
+    parser.add_argument(
+        "--database",
+        default="parler_benchmark",
+        help="Scratch database, dropped and refilled before requests.",
+    )
+    parser.add_argument(
+        "--build-indexes",
+        action="store_true",
+        help="Build every search index before timing requests.",
+    )
+    parser.add_argument(
+        "--facet-collections",
+        nargs="*",
+        default=[],
+        metavar="COLLECTION",
+        help="Search these collections with a single $facet aggregation.",
+    )
+    parser.add_argument("--output", help="Write results here instead of stdout.")
+    args = parser.parse_args()
+
+    # keep requests away from redis, so only this process's caches are involved
+    os.environ.setdefault("QUART_ENV", "development")
+    os.environ["FACET_COLLECTIONS"] = " ".join(args.facet_collections)
+
+    report = asyncio.get_event_loop().run_until_complete(run(args))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import itertools
+import random
+from typing import Callable, Iterator, TypeVar
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+from quart import render_template
+from quart_rate_limiter.store import MemoryStore
+
+import api
+import cache
+import counts
+import derived
+import manage
+import meta
+import templatefilters
+import warmup
+from api_types import Post, User
+from benchmarks.timing import time_async_calls, time_calls
+from constants import DB_POSTS, DB_USERS
+from enums import SearchBehavior
+from tests.utils.corpus import WORDS
+
+
+T = TypeVar("T")
+
+# number of distinct search terms each benchmark cycles through
+TERM_COUNT = 50
+
+
+class Corpus:
+    def __init__(self, seed: int, users: list[User], posts: list[Post]):
+        rng = random.Random(seed)
+        self.users = users
+        self.posts = posts
+        self.words = rng.sample(WORDS, min(TERM_COUNT, len(WORDS)))
+        self.usernames = [
+            user["username"] for user in rng.sample(users, min(TERM_COUNT, len(users)))
+        ]
+        self.texts = [post["text"] for post in posts if post["text"]]
+
+
+def _cycle(values: list[T]) -> Callable[[], T]:
+    values_iter: Iterator[T] = itertools.cycle(values)
+    return lambda: next(values_iter)
+
+
+def query_builders(corpus: Corpus, args: argparse.Namespace) -> dict:
+    word = _cycle(corpus.words)
+    username = _cycle(corpus.usernames)
+
+    def posts_query():
+        api._search_posts_query(username(), word(), SearchBehavior.MATCH_ALL)
+
+    def mentions_query():
+        api._search_posts_with_mentions_query(
+            username(), word(), SearchBehavior.MATCH_ANY
+        )
+
+    def users_query():
+        api._username_contains_query(username())
+
+    def search_key():
+        api._posts_search_key(username(), word(), SearchBehavior.MATCH_ALL, True)
+
+    return {
+        name: time_calls(f, args.repeat, args.number)
+        for name, f in {
+            "query.posts": posts_query,
+            "query.posts_with_mentions": mentions_query,
+            "query.users": users_query,
+            "query.posts_search_key": search_key,
+        }.items()
+    }
+
+
+async def filters(corpus: Corpus, args: argparse.Namespace) -> dict:
+    from app import app
+
+    text = _cycle(corpus.texts)
+    regex = _cycle([api.get_highlighter_regex(word) for word in corpus.words])
+
+    async with app.test_request_context("/posts"):
+        return {
+            "filter.with_links_and_highlights": time_calls(
+                lambda: templatefilters.with_links_and_highlights(text(), regex()),
+                args.repeat,
+                args.number,
+            ),
+            "filter.with_search_links": time_calls(
+                lambda: templatefilters.with_search_links(text()),
+                args.repeat,
+                args.number,
+            ),
+            "filter.with_highlighted_term": time_calls(
+                lambda: templatefilters.with_highlighted_term(text(), regex()),
+                args.repeat,
+                args.number,
+            ),
+            # what the fused filter replaces
+            "filter.with_search_links+with_highlighted_term": time_calls(
+                lambda: templatefilters.with_highlighted_term(
+                    templatefilters.with_search_links(text()), regex()
+                ),
+                args.repeat,
+                args.number,
+            ),
+        }
+
+
+async def templates(corpus: Corpus, args: argparse.Namespace) -> dict:
+    from app import app
+
+    pages = [
+        corpus.posts[i : i + api.PAGE_LIMIT]
+        for i in range(0, len(corpus.posts), api.PAGE_LIMIT)
+    ]
+    page = _cycle(pages)
+    word = _cycle(corpus.words)
+
+    async def render_posts():
+        search_content = word()
+        await render_template(
+            "posts.html",
+            posts=page(),
+            page=0,
+            page_count=len(pages),
+            page_count_exact=True,
+            search_content=search_content,
+            behavior=SearchBehavior.MATCH_ALL.value,
+            search_type=DB_POSTS,
+            highlighter_regex=api.get_highlighter_regex(search_content),
+        )
+
+    async with app.test_request_context("/posts"):
+        return {
+            "template.posts": await time_async_calls(
+                render_posts, args.repeat, max(1, args.number // 100)
+            ),
+        }
+
+
+def load(corpus: Corpus, args: argparse.Namespace) -> None:
+    """
+    Write the corpus to a scratch database, replacing whatever it held.
+
+    :param corpus: corpus to write
+    :param args: command line arguments
+    """
+    client: MongoClient = MongoClient(args.mongo_uri)
+    client.drop_database(args.database)
+    db = client[args.database]
+    users = [dict(user) for user in corpus.users]
+    posts = [dict(post) for post in corpus.posts]
+    if args.build_indexes:
+        # derived as ingest derives them, so the indexes below cover everything
+        users = [{**user, **derived.user_fields(user)} for user in users]
+        posts = [
+            {**post, **derived.post_fields(post), **derived.hashtag_fields(post)}
+            for post in posts
+        ]
+    db[DB_USERS].insert_many(users)
+    db[DB_POSTS].insert_many(posts)
+
+    if args.build_indexes:
+        manage.index_posts(db)
+        manage.index_users(db)
+
+
+async def requests(corpus: Corpus, args: argparse.Namespace) -> dict:
+    from app import app, limiter, mongo
+
+    load(corpus, args)
+    limiter.store = MemoryStore()
+    mongo.db = AsyncIOMotorClient(args.mongo_uri)[args.database]
+    await meta.refresh(mongo.db)
+
+    client = app.test_client()
+    addresses = itertools.count()
+    word = _cycle(corpus.words)
+    username = _cycle(corpus.usernames)
+
+    def get(path: Callable[[], str], cold: bool):
+        async def request():
+            if cold:
+                cache.result_cache.local.clear()
+                counts.cache.clear()
+            response = await warmup.get_in_process(
+                client, path(), "bench", next(addresses)
+            )
+            await response.get_data()
+
+        return request
+
+    paths = {
+        "posts_content": lambda: f"/posts?search_content={word()}",
+        "posts_username": lambda: f"/posts?username={username()}",
+        "posts_mentions": lambda: f"/posts?username={username()}&mentions=true",
+        "users": lambda: f"/users?username={word()}",
+    }
+    number = max(1, args.number // 100)
+    results = {}
+    for name, path in paths.items():
+        for cold in (True, False):
+            results[
+                f"request.{name}.{'cold' if cold else 'warm'}"
+            ] = await time_async_calls(get(path, cold), args.repeat, number)
+    return results
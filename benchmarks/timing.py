@@ -0,0 +1,52 @@
+import statistics
+import time
+from typing import Awaitable, Callable
+
+
+def _summarize(timings: list[float], number: int) -> dict:
+    per_call = [timing / number * 1e6 for timing in timings]
+    return {
+        "repeat": len(timings),
+        "number": number,
+        "min_us": min(per_call),
+        "median_us": statistics.median(per_call),
+        "mean_us": statistics.mean(per_call),
+    }
+
+
+def time_calls(f: Callable[[], object], repeat: int, number: int) -> dict:
+    """
+    Time a function, reporting microseconds per call.
+
+    :param f: function to call
+    :param repeat: number of timed rounds
+    :param number: calls per round
+    :return: summary of the per call timings across rounds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            f()
+        timings.append(time.perf_counter() - start)
+    return _summarize(timings, number)
+
+
+async def time_async_calls(
+    f: Callable[[], Awaitable[object]], repeat: int, number: int
+) -> dict:
+    """
+    Time a coroutine function, reporting microseconds per call.
+
+    :param f: coroutine function to await
+    :param repeat: number of timed rounds
+    :param number: calls per round
+    :return: summary of the per call timings across rounds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            await f()
+        timings.append(time.perf_counter() - start)
+    return _summarize(timings, number)
@@ -0,0 +1,2 @@
+#! /bin/sh
+PYTHONPATH=src python -m benchmarks "$@"
@@ -1,25 +1,126 @@
 import asyncio
+import binascii
+import inspect
 import logging
 import re
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import partial
 from math import floor
-from typing import Optional, Tuple, TypeVar
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
-from pymongo.errors import OperationFailure
+from bson import SON, ObjectId, json_util
+from bson.codec_options import DEFAULT_CODEC_OPTIONS, CodecOptions
+from bson.errors import BSONError
+from bson.raw_bson import RawBSONDocument
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import ExecutionTimeout, OperationFailure
 from quart_motor import Motor
+from quart_rate_limiter import RateLimitExceeded
 
+import cache
+import counts
+import deadlines
+import derived
+import meta
+import metrics
+import querycost
+import textsearch
+import trigrams
 from api_types import Post, User
-from constants import DB_POSTS, DB_USERS
-from enums import SearchBehavior
+from config import (
+    COMMENT_PAGE_SIZE,
+    COMMENTS_PER_POST,
+    EXPORT_BATCH_SIZE,
+    EXPORT_TIMEOUT_MS,
+    FACET_COLLECTIONS,
+    RAW_BSON_RESULTS,
+    SEARCH_TIMEOUT_MS,
+    STREAM_BATCH_SIZE,
+    TRIGRAM_MAX_CANDIDATES,
+)
+from constants import (
+    DB_HASHTAGS,
+    DB_POST_TRIGRAMS,
+    DB_POSTS,
+    DB_USER_TRIGRAMS,
+    DB_USERS,
+    POST_CONTENT_FIELDS,
+)
+from enums import SearchBehavior, SearchMode
 
 
 T = TypeVar("T", Post, User)
 
+# spends a request's allowance on the estimated cost of its query, or raises
+Charge = Callable[[float], Awaitable[None]]
+
 logger = logging.getLogger(__name__)
 
 PAGE_LIMIT = 20
 
+# only the fields rendered by the templates are fetched, which leaves out
+# counters and everything but the author and text of each comment
+PROJECTIONS = {
+    DB_POSTS: {
+        "username": 1,
+        "text": 1,
+        "image": 1,
+        "video": 1,
+        "media.link": 1,
+        "media.title": 1,
+        "media.image": 1,
+        "media.excerpt": 1,
+        "comments.username": 1,
+        "comments.text": 1,
+        "echo.username": 1,
+        "echo.text": 1,
+        "echo.image": 1,
+        "echo.video": 1,
+        "echo.media.link": 1,
+        "echo.media.title": 1,
+        "echo.media.image": 1,
+        "echo.media.excerpt": 1,
+        "echo.comments.username": 1,
+        "echo.comments.text": 1,
+    },
+    DB_USERS: {
+        "name": 1,
+        "username": 1,
+        "avatar": 1,
+    },
+}
+
+# RawBSONDocuments only decode the fields that are looked up, and keep
+# embedded documents and arrays of them raw until they are
+RESULT_CODEC_OPTIONS = (
+    CodecOptions(document_class=RawBSONDocument)
+    if RAW_BSON_RESULTS
+    else DEFAULT_CODEC_OPTIONS
+)
+
 
-def _normalize_username(username: str):
+class SearchResults(NamedTuple):
+    page_count: int
+    results: list
+    # False when the results were only counted up to a limit, in which case
+    # page_count is a lower bound
+    page_count_exact: bool = True
+    # True when the search ran out of time, results holds what arrived before then
+    partial: bool = False
+
+
+def normalize_username(username: str) -> str:
     return username if username.startswith("@") else f"@{username}"
 
 
@@ -36,6 +137,19 @@ def get_highlighter_regex(search_content: str) -> re.Pattern:
     return re.compile(f"({escape(search_content)})", re.IGNORECASE)
 
 
+def get_highlighter(search_content: str, mode: SearchMode) -> textsearch.Highlighter:
+    """
+    Create whatever highlights the matches of a content search in the results.
+
+    :param search_content: Content searched for.
+    :param mode: How the content was searched for, see `search_mode`.
+    :return: a regex, or something that matches like one
+    """
+    if mode == SearchMode.WORDS:
+        return textsearch.WordHighlighter(search_content)
+    return get_highlighter_regex(search_content)
+
+
 def get_match_any_regex(s: str) -> re.Pattern:
     return re.compile(f".*{escape(s)}.*", re.IGNORECASE)
 
@@ -57,11 +171,78 @@ def _username_contains_query(username: str) -> dict:
     }
 
 
+def _lowercase_field_query(field: str, username: str, anchored: bool) -> dict:
+    # the case-folded copy narrows the search using its index, the original
+    # field is still matched so results are exactly those of the scan
+    lowercase_regex = re.escape(username.casefold())
+    if anchored:
+        lowercase_regex = f"^{lowercase_regex}"
+
+    return {
+        f"{field}_lower": {"$regex": lowercase_regex},
+        field: get_match_any_regex(username),
+    }
+
+
+async def _users_query(mongo: Motor, username: str) -> dict:
+    """
+    Build the cheapest query finding every user whose name or username contains a term.
+
+    :param mongo: Motor instance
+    :param username: Substring being searched for.
+    :return: the query
+    """
+    if not escape(username):
+        return _username_contains_query(username)
+
+    lowercase = meta.has_feature(meta.USER_LOWERCASE_FIELDS)
+    if lowercase and username.startswith("@"):
+        # usernames only ever start with an @, so a handle can only be
+        # matched by its beginning
+        name_query = await _users_by_name_query(mongo, username)
+        return {
+            "$or": [
+                _lowercase_field_query("username", username, anchored=True),
+                name_query,
+            ],
+        }
+
+    candidates = await _trigram_candidates(
+        mongo, DB_USER_TRIGRAMS, meta.USER_TRIGRAMS, username
+    )
+    if candidates is not None:
+        return {
+            "$and": [{"_id": {"$in": candidates}}, _username_contains_query(username)]
+        }
+
+    if lowercase:
+        return {
+            "$or": [
+                _lowercase_field_query("name", username, anchored=False),
+                _lowercase_field_query("username", username, anchored=False),
+            ],
+        }
+
+    return _username_contains_query(username)
+
+
+async def _users_by_name_query(mongo: Motor, username: str) -> dict:
+    candidates = await _trigram_candidates(
+        mongo, DB_USER_TRIGRAMS, meta.USER_TRIGRAMS, username
+    )
+    if candidates is not None:
+        return {"_id": {"$in": candidates}, "name": get_match_any_regex(username)}
+    return _lowercase_field_query("name", username, anchored=False)
+
+
 def _posts_by_user_query(username: str) -> Optional[dict]:
     if not username:  # avoid an empty $or clause which will cause an error
         return None
 
-    formatted_username = _normalize_username(username)
+    formatted_username = normalize_username(username)
+    if meta.has_feature(meta.POST_PARTICIPANTS):
+        return {"participants": formatted_username}
+
     return {
         "$or": [
             {
@@ -77,30 +258,176 @@ def _posts_by_user_query(username: str) -> Optional[dict]:
     }
 
 
-def _posts_by_content_query(search_content: str) -> Optional[dict]:
+def _posts_by_mention_query(
+    username: str, candidates: Optional[list] = None
+) -> Optional[dict]:
+    if not username or not meta.has_feature(meta.POST_PARTICIPANTS):
+        return _posts_by_content_query(username, candidates)
+
+    # handles parsed out of the content, matched whole rather than as a substring
+    return {"mentions": derived.mention_key(normalize_username(username))}
+
+
+def _posts_by_content_query(
+    search_content: str, candidates: Optional[list] = None
+) -> Optional[dict]:
     if not search_content:
         return None
 
     content_regex = get_match_any_regex(search_content)
+    content_query = {"$or": [{field: content_regex} for field in POST_CONTENT_FIELDS]}
+
+    if candidates is None:
+        return content_query
+
+    # the trigram index only narrows the search, each candidate is still
+    # checked against the regex so results are exactly those of the scan
+    return {"$and": [{"_id": {"$in": candidates}}, content_query]}
+
+
+def _posts_by_words_query(search_content: str) -> Optional[dict]:
+    if not search_content:
+        return None
+    return textsearch.text_query(search_content)
+
+
+def search_mode(
+    mode: SearchMode, username: str, behavior: SearchBehavior
+) -> SearchMode:
+    """
+    Decide how post content can actually be searched for.
+
+    Words are only searched for once the `$text` index is built, and MongoDB
+    refuses a `$text` query in a `$or` unless every branch uses an index, which
+    username branches only do once participants are indexed.
+
+    :param mode: Mode asked for.
+    :param username: Username searched for alongside the content.
+    :param behavior: How the username and content are combined.
+    :return: The mode to search with.
+    """
+    if mode != SearchMode.WORDS or not meta.has_feature(meta.POST_TEXT_INDEX):
+        return SearchMode.SUBSTRING
+    if (
+        username
+        and behavior == SearchBehavior.MATCH_ANY
+        and not meta.has_feature(meta.POST_PARTICIPANTS)
+    ):
+        return SearchMode.SUBSTRING
+    return mode
+
+
+def _is_hashtag_search(search_content: str) -> bool:
+    return meta.has_feature(meta.POST_HASHTAGS) and derived.is_hashtag(search_content)
 
+
+def _is_hashtag_query(query: dict) -> bool:
+    return list(query) == ["hashtags"]
+
+
+def _content_query(
+    content: str, mode: SearchMode, content_candidates: Optional[list]
+) -> Optional[dict]:
+    if _is_hashtag_search(content):
+        # hashtag links search for exactly one, which is looked up whole
+        return {"hashtags": derived.hashtag_key(content)}
+    if mode == SearchMode.WORDS:
+        return _posts_by_words_query(content)
+    return _posts_by_content_query(content, content_candidates)
+
+
+def mention_regex(username: str) -> str:
+    # the whole handle, so that @bob is not found in @bobby
+    return rf"(?<![\w@]){re.escape(normalize_username(username))}(?!\w)"
+
+
+def _comment_conditions(
+    username: str, content: str, mode: SearchMode, mentions: bool
+) -> list:
+    def text_matches(regex: str) -> dict:
+        return {
+            "$regexMatch": {"input": "$$comment.text", "regex": regex, "options": "i"}
+        }
+
+    conditions = []
+    if username:
+        conditions.append({"$eq": ["$$comment.username", normalize_username(username)]})
+        if mentions and escape(username):
+            conditions.append(text_matches(mention_regex(username)))
+
+    content_regex = escape(content)
+    if mode == SearchMode.WORDS and not _is_hashtag_search(content):
+        content_regex = textsearch.words_regex(content) or ""
+    if content_regex:
+        conditions.append(text_matches(content_regex))
+    return conditions
+
+
+def _comments_expression(comments: Any, *slice_args: int) -> dict:
+    # only the fields rendered by comments.html
     return {
-        "$or": [
-            {
-                "text": content_regex,
-            },
-            {
-                "media.title": content_regex,
-            },
-            {
-                "comment.text": content_regex,
-            },
-            {
-                "echo.text": content_regex,
-            },
-        ],
+        "$map": {
+            "input": {"$slice": [comments, *slice_args]},
+            "as": "comment",
+            "in": {"username": "$$comment.username", "text": "$$comment.text"},
+        }
     }
 
 
+def _posts_projection(
+    username: str, content: str, mode: SearchMode, mentions: bool
+) -> dict:
+    """
+    Project posts with only the first few of their comments matching the search.
+
+    The rest of the comments are left for `get_comments`.
+
+    :param username: Username searched for.
+    :param content: Content searched for.
+    :param mode: How the content is searched for.
+    :param mentions: Whether mentions of the username are searched for.
+    :return: the projection, with `comments_total` counting every comment, and
+             the echoed post's comments picked the same way
+    """
+    conditions = _comment_conditions(username, content, mode, mentions)
+    projection: dict[str, Any] = {
+        field: include
+        for field, include in PROJECTIONS[DB_POSTS].items()
+        if not field.startswith(("comments.", "echo."))
+    }
+    projection.update(_comments_preview("$comments", conditions))
+    projection["echo"] = _echo_expression(conditions)
+    return projection
+
+
+def _comments_preview(comments_field: str, conditions: list) -> dict:
+    comments: Any = {"$ifNull": [comments_field, []]}
+    if conditions:
+        comments = {
+            "$filter": {"input": comments, "as": "comment", "cond": {"$or": conditions}}
+        }
+    return {
+        "comments": _comments_expression(comments, COMMENTS_PER_POST),
+        "comments_total": {"$size": {"$ifNull": [comments_field, []]}},
+    }
+
+
+def _echo_expression(conditions: list) -> dict:
+    echo: dict[str, Any] = {}
+    for field in PROJECTIONS[DB_POSTS]:
+        if not field.startswith("echo.") or field.startswith("echo.comments."):
+            continue
+        *parents, name = field.split(".")[1:]
+        parent = echo
+        for key in parents:
+            parent = parent.setdefault(key, {})
+        parent[name] = f"${field}"
+    echo.update(_comments_preview("$echo.comments", conditions))
+
+    # posts that are not echoes keep what they hold instead, null or nothing
+    return {"$cond": [{"$eq": [{"$type": "$echo"}, "object"]}, echo, "$echo"]}
+
+
 def _gather_query_parts(*parts: Optional[dict]) -> Optional[list]:
     query_parts = [part for part in parts if part is not None]
     if len(query_parts) == 0:
@@ -123,20 +450,30 @@ def _standard_query_logic(
 
 
 def _search_posts_query(
-    username: str, content: str, behavior: SearchBehavior
+    username: str,
+    content: str,
+    behavior: SearchBehavior,
+    content_candidates: Optional[list] = None,
+    mode: SearchMode = SearchMode.SUBSTRING,
 ) -> Optional[dict]:
     query_parts = _gather_query_parts(
-        _posts_by_user_query(username), _posts_by_content_query(content)
+        _posts_by_user_query(username),
+        _content_query(content, mode, content_candidates),
     )
     return _standard_query_logic(query_parts, behavior)
 
 
 def _search_posts_with_mentions_query(
-    username: str, content: str, behavior: SearchBehavior
+    username: str,
+    content: str,
+    behavior: SearchBehavior,
+    content_candidates: Optional[list] = None,
+    mention_candidates: Optional[list] = None,
+    mode: SearchMode = SearchMode.SUBSTRING,
 ) -> Optional[dict]:
     username_query = _posts_by_user_query(username)
-    mention_query = _posts_by_content_query(username)
-    content_query = _posts_by_content_query(content)
+    mention_query = _posts_by_mention_query(username, mention_candidates)
+    content_query = _content_query(content, mode, content_candidates)
     if behavior == SearchBehavior.MATCH_ALL:
         mention_query_parts = _gather_query_parts(username_query, mention_query)
         subquery = _standard_query_logic(mention_query_parts, SearchBehavior.MATCH_ANY)
@@ -146,49 +483,935 @@ def _search_posts_with_mentions_query(
     return _standard_query_logic(query_parts, behavior)
 
 
+async def _content_candidates(mongo: Motor, search_content: str) -> Optional[list]:
+    return await _trigram_candidates(
+        mongo, DB_POST_TRIGRAMS, meta.POST_TRIGRAMS, search_content
+    )
+
+
+async def _trigram_candidates(
+    mongo: Motor, postings: str, feature: str, term: str
+) -> Optional[list]:
+    if not escape(term) or not meta.has_feature(feature):
+        return None
+
+    try:
+        return await trigrams.find_candidates(
+            mongo.db[postings], term, TRIGRAM_MAX_CANDIDATES
+        )
+    except OperationFailure as err:
+        logger.error(f"Failure retrieving trigram candidates: {err}")
+
+        # fall back to scanning
+        return None
+
+
+def encode_cursor(
+    page: int, after: Optional[Any] = None, before: Optional[Any] = None
+) -> str:
+    """
+    Create an opaque continuation token for a page of results.
+
+    :param page: Page number the token leads to.
+    :param after: `_id` of the last result of the page before it.
+    :param before: `_id` of the first result of the page after it.
+    :return: URL safe token.
+    """
+    position: dict[str, Any] = {"page": page}
+    if after is not None:
+        position["after"] = after
+    if before is not None:
+        position["before"] = before
+    return urlsafe_b64encode(json_util.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, page: int) -> Optional[dict]:
+    """
+    Read a continuation token created by `encode_cursor`.
+
+    :param token: Token from the request.
+    :param page: Page number requested alongside the token.
+    :return: The position to seek to, or None if the token is unusable or was
+             made for a different page.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        position = json_util.loads(urlsafe_b64decode(padded.encode()))
+    except (
+        binascii.Error,
+        BSONError,
+        UnicodeDecodeError,
+        ValueError,
+        TypeError,
+        IndexError,
+        KeyError,
+    ):
+        return None
+
+    if not isinstance(position, dict) or position.get("page") != page:
+        return None
+    if "after" not in position and "before" not in position:
+        return None
+    if not all(
+        _is_document_id(position[key]) for key in ("after", "before") if key in position
+    ):
+        return None
+    return position
+
+
+def _is_document_id(value: Any) -> bool:
+    # ids are ObjectIds in MongoDB and row ids in SQLite
+    return isinstance(value, ObjectId) or (
+        isinstance(value, int) and not isinstance(value, bool)
+    )
+
+
+def _has_text_query(query: dict) -> bool:
+    return "$text" in query or any(
+        _has_text_query(part)
+        for operator in ("$and", "$or")
+        for part in query.get(operator, [])
+    )
+
+
+TEXT_SCORE = {"$meta": "textScore"}
+
+
+class PagePlan(NamedTuple):
+    query: dict
+    sort: list
+    # None when the page is seeked to rather than skipped to
+    skip: Optional[int]
+    projection: Optional[dict]
+
+
+def _page_plan(
+    query: dict, page: int, position: Optional[dict], projection: Optional[dict]
+) -> PagePlan:
+    if _has_text_query(query):
+        # the most relevant results come first, and as relevance is not unique
+        # and pages cannot be seeked to, they are skipped through
+        return PagePlan(
+            query,
+            [("score", TEXT_SCORE), ("_id", ASCENDING)],
+            page * PAGE_LIMIT,
+            {**(projection or {}), "score": TEXT_SCORE},
+        )
+
+    if position is None:
+        # legacy links only carry the page number, so skip through the results
+        return PagePlan(query, [("_id", ASCENDING)], page * PAGE_LIMIT, projection)
+
+    if "after" in position:
+        seek_query = {"$and": [query, {"_id": {"$gt": position["after"]}}]}
+        return PagePlan(seek_query, [("_id", ASCENDING)], None, projection)
+
+    # walking backwards, the results are put back in order once they arrive
+    seek_query = {"$and": [query, {"_id": {"$lt": position["before"]}}]}
+    return PagePlan(seek_query, [("_id", DESCENDING)], None, projection)
+
+
+def _find_command(plan: PagePlan, limit: int = PAGE_LIMIT) -> dict:
+    # the fields of the find command a page plan is run as, to explain it
+    find = {"filter": plan.query, "sort": SON(plan.sort), "limit": limit}
+    if plan.skip:
+        find["skip"] = plan.skip
+    if plan.projection is not None and not _is_computed(plan.projection):
+        find["projection"] = plan.projection
+    return find
+
+
+def _find_page(
+    collection,
+    query: dict,
+    page: int,
+    position: Optional[dict],
+    projection: Optional[dict] = None,
+):
+    plan = _page_plan(query, page, position, projection)
+    cursor = collection.find(plan.query, plan.projection).sort(plan.sort)
+    if plan.skip is not None:
+        cursor = cursor.skip(plan.skip)
+    return cursor.limit(PAGE_LIMIT)
+
+
+def _is_computed(projection: Optional[dict]) -> bool:
+    return projection is not None and any(
+        isinstance(value, dict) for value in projection.values()
+    )
+
+
+def _aggregate_page(
+    collection,
+    query: dict,
+    page: int,
+    position: Optional[dict],
+    projection: Optional[dict],
+    **options: Any,
+):
+    # for projections computing fields, which find only takes from MongoDB 4.4
+    plan = _page_plan(query, page, position, projection)
+    pipeline: list[dict] = [{"$match": plan.query}, {"$sort": dict(plan.sort)}]
+    if plan.skip:
+        pipeline.append({"$skip": plan.skip})
+    pipeline.append({"$limit": PAGE_LIMIT})
+    pipeline.append({"$project": plan.projection})
+    return collection.aggregate(pipeline, **options)
+
+
+def _or_branches(query: dict) -> list:
+    # nested $ors are flattened, anything else is a single branch
+    if list(query) != ["$or"]:
+        return [query]
+    return [branch for part in query["$or"] for branch in _or_branches(part)]
+
+
+def _split_query(query: dict) -> Optional[list]:
+    """
+    Split a $or mixing indexed and scanned branches into queries to run apart.
+
+    MongoDB only answers a $or from indexes when every branch has one, so a
+    single regex branch has the equality branches next to it checked by the
+    same scan.
+
+    :param query: query built by the search functions
+    :return: each indexed branch, then the scanned branches under a single $or,
+             or None if the query is best run whole
+    """
+    if _has_text_query(query):
+        # relevance is only known to MongoDB, so the results cannot be merged
+        return None
+
+    indexed = []
+    scanned = []
+    for branch in _or_branches(query):
+        if querycost.query_cost(branch) < querycost.COLLECTION_SCAN_COST:
+            indexed.append(branch)
+        else:
+            scanned.append(branch)
+    if not indexed or not scanned:
+        return None
+    return indexed + [_standard_query_logic(scanned, SearchBehavior.MATCH_ANY)]
+
+
+async def _branch_ids(
+    collection, branch: dict, page: int, position: Optional[dict], tag: str
+) -> list:
+    plan = _page_plan(branch, page, position, {"_id": True})
+    # the merged page may be made of any branch's results before it
+    limit = (plan.skip or 0) + PAGE_LIMIT
+    cursor = (
+        collection.find(plan.query, plan.projection)
+        .sort(plan.sort)
+        .limit(limit)
+        .max_time_ms(SEARCH_TIMEOUT_MS)
+        .comment(tag)
+    )
+    start = time.perf_counter()
+    documents = await cursor.to_list(length=limit)
+    elapsed = time.perf_counter() - start
+    metrics.check_slow_query(
+        collection, _find_command(plan._replace(skip=None), limit), elapsed
+    )
+    return [document["_id"] for document in documents]
+
+
+async def _branch_ids_in_time(
+    collection, branch: dict, page: int, position: Optional[dict], tag: str
+) -> Optional[list]:
+    try:
+        return await _branch_ids(collection, branch, page, position, tag)
+    except ExecutionTimeout:
+        return None
+
+
+async def _merged_page(
+    collection,
+    branches: list,
+    page: int,
+    position: Optional[dict],
+    projection: Optional[dict],
+    batch_size: int,
+    tag: str,
+) -> AsyncIterator:
+    """
+    Find a page of results by looking for the ids of each branch at once.
+
+    The ids are merged in `_id` order, then the page is fetched by them. Should
+    a branch run out of time, the page is made of the others, after which
+    `ExecutionTimeout` is raised so it is shown as partial results.
+
+    :param collection: collection to search, with the codec options for results
+    :param branches: queries whose results are combined, see `_split_query`
+    :param page: page number
+    :param position: where the page starts, see `decode_cursor`
+    :param projection: fields of the results
+    :param batch_size: documents fetched at a time
+    :param tag: comment to tag the operations with
+    :return: the page, in ascending `_id` order
+    """
+    lookups = [
+        asyncio.ensure_future(
+            _branch_ids_in_time(collection, branch, page, position, tag)
+        )
+        for branch in branches
+    ]
+    try:
+        id_lists = await asyncio.gather(*lookups)
+    except BaseException:
+        # nothing would be left waiting for the other branches
+        for lookup in lookups:
+            lookup.cancel()
+        raise
+
+    answered = [ids for ids in id_lists if ids is not None]
+    before = position is not None and "before" in position
+    ids: list = sorted(set().union(*answered), reverse=before)
+    skip = page * PAGE_LIMIT if position is None else 0
+    ids = ids[skip : skip + PAGE_LIMIT]
+
+    query = {"_id": {"$in": ids}}
+    if _is_computed(projection):
+        documents = _aggregate_page(
+            collection,
+            query,
+            0,
+            None,
+            projection,
+            batchSize=batch_size,
+            maxTimeMS=SEARCH_TIMEOUT_MS,
+            comment=tag,
+        )
+    else:
+        documents = (
+            _find_page(collection, query, 0, None, projection)
+            .batch_size(batch_size)
+            .max_time_ms(SEARCH_TIMEOUT_MS)
+            .comment(tag)
+        )
+    async for document in documents:
+        yield document
+
+    if len(answered) < len(branches):
+        timed_out = len(branches) - len(answered)
+        raise ExecutionTimeout(f"{timed_out} of {len(branches)} branches timed out")
+
+
+def _facet_pipeline(
+    query: dict, page: int, position: Optional[dict], projection: Optional[dict]
+) -> list:
+    # the page is found among the matches in the same way as `_page_plan` does
+    plan = _page_plan({}, page, position, projection)
+    page_stages: list[dict] = []
+    if position is not None:
+        page_stages.append({"$match": plan.query})
+    if plan.skip:
+        page_stages.append({"$skip": plan.skip})
+    page_stages.append({"$limit": PAGE_LIMIT})
+    if plan.projection is not None:
+        page_stages.append({"$project": plan.projection})
+
+    return [
+        {"$match": query},
+        {"$sort": dict(plan.sort)},
+        {"$facet": {"count": [{"$count": "total"}], "page": page_stages}},
+    ]
+
+
+async def _facet_search(
+    collection,
+    query: dict,
+    page: int,
+    position: Optional[dict],
+    projection: Optional[dict],
+    **options: Any,
+) -> Tuple[int, list]:
+    """
+    Count the results of a query and fetch a page of them in one aggregation.
+
+    Each document is matched once, by `$match`, where a count and a find would
+    each match it. As every match then passes through the `$facet`, the count
+    is always exact.
+
+    :param collection: collection to search, with the codec options for results
+    :param query: query built by the search functions
+    :param page: page number
+    :param position: where the page starts, see `decode_cursor`
+    :param projection: fields of the results
+    :param options: passed on to `aggregate`, e.g. `maxTimeMS`
+    :return: the number of results, and the page in ascending `_id` order
+    """
+    pipeline = _facet_pipeline(query, page, position, projection)
+    (facets,) = await collection.aggregate(pipeline, **options).to_list(length=1)
+    total_count = facets["count"][0]["total"] if facets["count"] else 0
+    results = list(facets["page"])
+    if position is not None and "before" in position:
+        results.reverse()
+    return total_count, results
+
+
+async def _facet_count(
+    facet_f: Awaitable[Tuple[int, list]], key: str
+) -> Tuple[int, bool]:
+    total_count, _ = await facet_f
+    counts.cache.set(key, total_count, True)
+    return total_count, True
+
+
+async def _facet_page(facet_f: Awaitable[Tuple[int, list]]) -> list:
+    _, results = await facet_f
+    return results
+
+
+def page_count(total_count: int, page_count_exact: bool, page: int) -> int:
+    if page_count_exact:
+        return floor(total_count / PAGE_LIMIT) + 1
+    return max(total_count // PAGE_LIMIT, page + 1)
+
+
+def _posts_search_key(
+    username: str,
+    content: str,
+    behavior: SearchBehavior,
+    mentions: bool,
+    mode: SearchMode = SearchMode.SUBSTRING,
+) -> str:
+    if not mentions and username:
+        # without mentions usernames are only matched once normalized, with
+        # them the username is also searched for in the content as typed
+        username = normalize_username(username)
+    if not username or not content:
+        # behavior only decides how the username and content are combined
+        behavior = SearchBehavior.MATCH_ALL
+    parts = [username, content, behavior.value, mentions and bool(username)]
+    if content and mode != SearchMode.SUBSTRING:
+        parts.append(mode.value)
+    return counts.query_key(DB_POSTS, parts)
+
+
+async def _cached_results(cache_key: str, count_key: str) -> Optional[SearchResults]:
+    cached = await cache.result_cache.get(cache_key, RESULT_CODEC_OPTIONS)
+    if cached is None:
+        return None
+    return _results_from_cache(cached, count_key)
+
+
+async def _leader_results(cache_key: str, count_key: str) -> Optional[SearchResults]:
+    cached = await cache.result_cache.wait(
+        cache_key, codec_options=RESULT_CODEC_OPTIONS
+    )
+    if cached is None:
+        return None
+    return _results_from_cache(cached, count_key)
+
+
+def _results_from_cache(cached: dict, count_key: str) -> SearchResults:
+    found = SearchResults(**cached)
+    if not found.page_count_exact:
+        # the exact count may have been filled in since the page was cached
+        count = counts.cache.get(count_key)
+        if count is not None and count[1]:
+            found = found._replace(
+                page_count=page_count(count[0], True, 0), page_count_exact=True
+            )
+    return found
+
+
+class ResultStream:
+    """
+    A page of search results, handed out as the cursor yields them.
+
+    Iterate over the stream for the results, then `finish` it for the page
+    count. A page that was read completely is cached.
+    """
+
+    def __init__(
+        self,
+        documents: Any,
+        page: int,
+        collection: str = "",
+        count_f: Optional[Awaitable[Tuple[int, bool]]] = None,
+        cache_key: Optional[str] = None,
+    ):
+        self.results: list = []
+        self._documents = documents
+        self._page = page
+        self._collection = collection
+        self._count_f = count_f
+        self._cache_key = cache_key
+        self._found: Optional[SearchResults] = None
+        self._complete = False
+        self._partial = False
+        self._failed = False
+        # result cache key and token of the lease held for this search,
+        # released once finished
+        self.lease: Optional[Tuple[str, str]] = None
+        # identical searches in this worker wait on it for the results, None
+        # if the search is given up on
+        self.flight: Optional[asyncio.Future] = None
+        # called if the search is given up on before it finishes
+        self.on_abandon: Optional[Callable[[], Awaitable[None]]] = None
+
+    @classmethod
+    def of(cls, found: SearchResults) -> "ResultStream":
+        stream = cls(found.results, 0)
+        stream._found = found
+        return stream
+
+    async def __aiter__(self) -> AsyncIterator:
+        try:
+            async for document in _iterate(self._documents):
+                self.results.append(document)
+                yield document
+            self._complete = True
+        except ExecutionTimeout:
+            logger.info(f"Search of {self._collection} ran out of time")
+            self._partial = True
+        except OperationFailure as err:
+            logger.error(f"Failure retrieving {self._collection}: {err}")
+
+            # probably an invalid regex, just return nothing
+            self._failed = True
+        finally:
+            if not (self._complete or self._partial or self._failed):
+                # cancelled, or the consumer stopped early
+                self._abandon()
+
+    def _abandon(self) -> None:
+        if isinstance(self._count_f, asyncio.Future):
+            self._count_f.cancel()
+        if self.on_abandon is not None:
+            asyncio.ensure_future(self.on_abandon())
+            self.on_abandon = None
+        if self.lease is not None:
+            # other workers would otherwise wait out the lease's whole TTL
+            asyncio.ensure_future(cache.result_cache.release_lease(*self.lease))
+            self.lease = None
+        self._land(None)
+
+    def _land(self, found: Optional[SearchResults]) -> None:
+        if self.flight is not None:
+            if not self.flight.done():
+                self.flight.set_result(found)
+            self.flight = None
+
+    async def finish(self) -> SearchResults:
+        if self._found is not None:
+            self._land(self._found)
+            return self._found
+
+        found = None
+        try:
+            found = await self._finish()
+            return found
+        except asyncio.CancelledError:
+            self._abandon()
+            raise
+        finally:
+            self._land(found)
+            if self.lease is not None:
+                await cache.result_cache.release_lease(*self.lease)
+                self.lease = None
+
+    def _found_so_far(self) -> Tuple[int, bool]:
+        # all that is known is that the results found so far exist
+        return self._page * PAGE_LIMIT + len(self.results), False
+
+    async def _finish(self) -> SearchResults:
+        try:
+            if self._count_f is None:
+                total_count, page_count_exact = self._found_so_far()
+            else:
+                total_count, page_count_exact = await self._count_f
+        except ExecutionTimeout:
+            logger.info(f"Count of {self._collection} ran out of time")
+            total_count, page_count_exact = self._found_so_far()
+        except OperationFailure as err:
+            logger.error(f"Failure counting {self._collection}: {err}")
+            self._failed = True
+
+        if self._failed:
+            return SearchResults(page_count(0, True, self._page), [])
+
+        pages = page_count(total_count, page_count_exact, self._page)
+        self._found = SearchResults(
+            pages, self.results, page_count_exact, self._partial
+        )
+        if self._complete and self._cache_key is not None:
+            await cache.result_cache.set(self._cache_key, self._found._asdict())
+        return self._found
+
+    async def collect(self) -> SearchResults:
+        async for _ in self:
+            pass
+        return await self.finish()
+
+
+async def _iterate(documents: Any) -> AsyncIterator:
+    if inspect.isawaitable(documents):
+        documents = await documents
+    if hasattr(documents, "__aiter__"):
+        async for document in documents:
+            yield document
+    else:
+        for document in documents:
+            yield document
+
+
+async def _timed_find(
+    collection, find: Optional[dict], documents: Any
+) -> AsyncIterator:
+    start = time.perf_counter()
+    async for document in _iterate(documents):
+        yield document
+
+    elapsed = time.perf_counter() - start
+    metrics.search_phase_seconds.labels(collection.name, "find").observe(elapsed)
+    if find is not None:
+        metrics.check_slow_query(collection, find, elapsed)
+
+
+async def _descending_page(cursor) -> list:
+    results = await cursor.to_list(length=PAGE_LIMIT)
+    results.reverse()
+    return results
+
+
 async def _get_entities(
     mongo: Motor,
     collection: str,
     query: Optional[dict],
     page: int,
-) -> Tuple[int, list[T]]:
+    cursor: Optional[str] = None,
+    search_key: Optional[str] = None,
+    batch_size: int = PAGE_LIMIT,
+    projection: Optional[dict] = None,
+) -> ResultStream:
     if query is None:
-        return 0, []
+        return ResultStream.of(SearchResults(0, []))
+
+    position = decode_cursor(cursor, page) if cursor else None
+
+    # tagged so the operations can be found and killed if the search is abandoned
+    tag = deadlines.operation_tag()
+    if projection is None:
+        projection = PROJECTIONS.get(collection)
+    results = mongo.db[collection].with_options(codec_options=RESULT_CODEC_OPTIONS)
+    branches = _split_query(query)
+
+    count_key = search_key or counts.query_key(collection, query)
+    facet_f = None
+    if collection == DB_POSTS and _is_hashtag_query(query):
+        # posts are counted per hashtag when the hashtags are extracted
+        count_aw = counts.stored_count(mongo.db[DB_HASHTAGS], query["hashtags"])
+    elif (
+        collection in FACET_COLLECTIONS
+        and branches is None
+        and not _has_text_query(query)
+        and counts.cache.get(count_key) is None
+    ):
+        # once the count is cached a find only has to match the page
+        facet_f = asyncio.ensure_future(
+            _facet_search(
+                results,
+                query,
+                page,
+                position,
+                projection,
+                batchSize=batch_size,
+                maxTimeMS=SEARCH_TIMEOUT_MS,
+                comment=tag,
+            )
+        )
+        count_aw = _facet_count(facet_f, count_key)
+    else:
+        count_aw = counts.count(
+            mongo.db[collection],
+            query,
+            search_key,
+            maxTimeMS=SEARCH_TIMEOUT_MS,
+            comment=tag,
+        )
+    total_count_f = asyncio.ensure_future(
+        metrics.timed(
+            metrics.search_phase_seconds.labels(collection, "count"), count_aw
+        )
+    )
+    plan = _page_plan(query, page, position, projection)
+    # a cursor, or whatever stands in for one, see `_iterate`
+    documents: Any
+    if facet_f is not None:
+        documents = _facet_page(facet_f)
+    elif branches is not None:
+        # the indexed branches are not dragged into the scan of the others
+        documents = _merged_page(
+            results, branches, page, position, projection, batch_size, tag
+        )
+    elif _is_computed(projection):
+        documents = _aggregate_page(
+            results,
+            query,
+            page,
+            position,
+            projection,
+            batchSize=batch_size,
+            maxTimeMS=SEARCH_TIMEOUT_MS,
+            comment=tag,
+        )
+    else:
+        documents = (
+            _find_page(results, query, page, position, projection)
+            .batch_size(batch_size)
+            .max_time_ms(SEARCH_TIMEOUT_MS)
+            .comment(tag)
+        )
+    descending = position is not None and "before" in position
+    if facet_f is None and branches is None and descending:
+        documents = _descending_page(documents)
+    # merged pages explain the ids looked up by each branch instead
+    find = None if branches is not None else _find_command(plan)
+    documents = _timed_find(mongo.db[collection], find, documents)
+
+    cache_key = None
+    if search_key is not None:
+        cache_key = cache.result_cache.key(search_key, page)
+    stream = ResultStream(documents, page, collection, total_count_f, cache_key)
+    stream.on_abandon = partial(deadlines.kill_operations, mongo.db, tag)
+    return stream
+
 
-    skip = page * PAGE_LIMIT
+async def _search(
+    mongo: Motor,
+    collection: str,
+    search_key: str,
+    page: int,
+    cursor: Optional[str],
+    build_query: Callable[[], Awaitable[Optional[dict]]],
+    batch_size: int = PAGE_LIMIT,
+    charge: Optional[Charge] = None,
+    projection: Optional[dict] = None,
+) -> ResultStream:
+    # results are cached by page, however the page was reached
+    cache_key = cache.result_cache.key(search_key, page)
+    found = await _timed_cached_results(collection, cache_key, search_key)
+    if found is None:
+        found = await _joined_results(cache_key)
+    if found is not None:
+        return ResultStream.of(found)
 
+    # identical searches arriving while this one streams wait for its results
+    flight = cache.searches.lead(cache_key)
     try:
-        total_count_f = mongo.db[collection].count_documents(query)
-        results_f = (
-            mongo.db[collection]
-            .find(query)
-            .skip(skip)
-            .limit(PAGE_LIMIT)
-            .to_list(length=PAGE_LIMIT)
-        )
-        await asyncio.wait(
-            {total_count_f, results_f}, return_when=asyncio.FIRST_EXCEPTION
-        )
-        # indiscriminately await each future, if one failed then the exception will raise as expected
-        total_count: int = await total_count_f
-        results: list[T] = await results_f
-    except OperationFailure as err:
-        logger.error(f"Failure retrieving {collection}: {err}", err)
+        query = await _charged_query(collection, build_query, charge)
+        stream = await _run_search(
+            mongo,
+            collection,
+            search_key,
+            cache_key,
+            page,
+            cursor,
+            query,
+            batch_size,
+            projection,
+        )
+    except BaseException:
+        if not flight.done():
+            # those waiting search for themselves
+            flight.set_result(None)
+        raise
+    stream.flight = flight
+    return stream
+
 
-        # probably an invalid regex, just return nothing
-        total_count = 0
-        results = []
+async def _collect_search(
+    mongo: Motor,
+    collection: str,
+    search_key: str,
+    page: int,
+    cursor: Optional[str],
+    build_query: Callable[[], Awaitable[Optional[dict]]],
+    charge: Optional[Charge] = None,
+    projection: Optional[dict] = None,
+) -> SearchResults:
+    cache_key = cache.result_cache.key(search_key, page)
+    found = await _timed_cached_results(collection, cache_key, search_key)
+    if found is None:
+        found = await _joined_results(cache_key)
+    if found is not None:
+        return found
 
-    page_count = floor(total_count / PAGE_LIMIT) + 1
+    # charged outside of the flight so only this request is turned away
+    query = await _charged_query(collection, build_query, charge)
 
-    return page_count, results
+    async def collect() -> SearchResults:
+        stream = await _run_search(
+            mongo,
+            collection,
+            search_key,
+            cache_key,
+            page,
+            cursor,
+            query,
+            # a first batch smaller than the page, so that a search that runs
+            # out of time still has the documents of the batches it fetched
+            STREAM_BATCH_SIZE,
+            projection,
+        )
+        return await stream.collect()
+
+    # identical searches arriving while this one runs wait for its results
+    found = await cache.searches.do(cache_key, collect)
+    if found is None:
+        # joined a streamed search that was given up on
+        found = await collect()
+    return found
+
+
+async def _joined_results(cache_key: str) -> Optional[SearchResults]:
+    flight = cache.searches.get(cache_key)
+    if flight is None:
+        return None
+    # the same page is already being searched for in this worker, None if a
+    # streamed search was given up on
+    return await flight
+
+
+async def _timed_cached_results(
+    collection: str, cache_key: str, count_key: str
+) -> Optional[SearchResults]:
+    return await metrics.timed(
+        metrics.search_phase_seconds.labels(collection, "cache"),
+        _cached_results(cache_key, count_key),
+    )
+
+
+async def _charged_query(
+    collection: str,
+    build_query: Callable[[], Awaitable[Optional[dict]]],
+    charge: Optional[Charge],
+) -> Optional[dict]:
+    query = await metrics.timed(
+        metrics.search_phase_seconds.labels(collection, "query"), build_query()
+    )
+    if charge is not None:
+        await charge(querycost.query_cost(query))
+    return query
+
+
+async def _run_search(
+    mongo: Motor,
+    collection: str,
+    search_key: str,
+    cache_key: str,
+    page: int,
+    cursor: Optional[str],
+    query: Optional[dict],
+    batch_size: int = PAGE_LIMIT,
+    projection: Optional[dict] = None,
+) -> ResultStream:
+    token = None
+    if query is not None:
+        token = await cache.result_cache.acquire_lease(cache_key)
+        if token is None:
+            # another worker is running the same search, wait for its results
+            found = await _leader_results(cache_key, search_key)
+            if found is not None:
+                return ResultStream.of(found)
+
+    try:
+        stream = await _get_entities(
+            mongo, collection, query, page, cursor, search_key, batch_size, projection
+        )
+    except BaseException:
+        if token is not None:
+            # other workers would otherwise wait out the lease's whole TTL
+            await cache.result_cache.release_lease(cache_key, token)
+        raise
+    if token is not None:
+        stream.lease = (cache_key, token)
+    return stream
 
 
 async def search_users(
-    mongo: Motor, username: str, page: int
-) -> Tuple[int, list[User]]:
-    return await _get_entities(
-        mongo, DB_USERS, _username_contains_query(username), page
+    mongo: Motor,
+    username: str,
+    page: int,
+    cursor: Optional[str] = None,
+    charge: Optional[Charge] = None,
+) -> SearchResults:
+    async def build_query() -> Optional[dict]:
+        return await _users_query(mongo, username)
+
+    search_key = counts.query_key(DB_USERS, [username])
+    return await _collect_search(
+        mongo, DB_USERS, search_key, page, cursor, build_query, charge
+    )
+
+
+async def _build_posts_query(
+    mongo: Motor,
+    username: str,
+    content: str,
+    behavior: SearchBehavior,
+    mentions: bool,
+    mode: SearchMode = SearchMode.SUBSTRING,
+) -> Optional[dict]:
+    # indexed mentions are looked up whole, so only scanned ones need candidates
+    scan_mentions = mentions and not meta.has_feature(meta.POST_PARTICIPANTS)
+    scan_content = mode == SearchMode.SUBSTRING and not _is_hashtag_search(content)
+    content_candidates, mention_candidates = await asyncio.gather(
+        _content_candidates(mongo, content if scan_content else ""),
+        _content_candidates(mongo, username if scan_mentions else ""),
+    )
+    if mentions:
+        return _search_posts_with_mentions_query(
+            username,
+            content,
+            behavior,
+            content_candidates,
+            mention_candidates,
+            mode,
+        )
+    return _search_posts_query(username, content, behavior, content_candidates, mode)
+
+
+async def stream_posts(
+    mongo: Motor,
+    username: str,
+    content: str,
+    page: int,
+    behavior: SearchBehavior,
+    mentions: bool,
+    cursor: Optional[str] = None,
+    batch_size: int = STREAM_BATCH_SIZE,
+    charge: Optional[Charge] = None,
+    mode: SearchMode = SearchMode.SUBSTRING,
+) -> ResultStream:
+    """
+    Search for posts, handing each result out as soon as it arrives.
+
+    Takes the same parameters as `search_posts`.
+
+    :param batch_size: Number of documents the cursor fetches at a time.
+    :return: The page of results, to be iterated and then finished.
+    """
+
+    mode = search_mode(mode, username, behavior)
+    build_query = partial(
+        _build_posts_query, mongo, username, content, behavior, mentions, mode
+    )
+    search_key = _posts_search_key(username, content, behavior, mentions, mode)
+    projection = _posts_projection(username, content, mode, mentions)
+    return await _search(
+        mongo,
+        DB_POSTS,
+        search_key,
+        page,
+        cursor,
+        build_query,
+        batch_size,
+        charge,
+        projection,
     )
 
 
@@ -199,7 +1422,10 @@ async def search_posts(
     page: int,
     behavior: SearchBehavior,
     mentions: bool,
-) -> Tuple[int, list[Post]]:
+    cursor: Optional[str] = None,
+    charge: Optional[Charge] = None,
+    mode: SearchMode = SearchMode.SUBSTRING,
+) -> SearchResults:
     """
     Search for posts by username and/or content.
 
@@ -213,11 +1439,200 @@ async def search_posts(
     :param mentions: If mentions is true, also include results where the username
                      is mentioned in the content field by any other user. Otherwise
                      just return relevent username matches.
+    :param cursor: Continuation token for the page, see `encode_cursor`. Without
+                   it the page is found by skipping over the earlier results.
+    :param charge: Called with the estimated cost of the query before it runs,
+                   not called for results that are already cached.
+    :param mode: Whether to match the content anywhere, or whole words by their
+                 stems using the `$text` index, most relevant first. Falls back
+                 to the former where the latter cannot be used, see `search_mode`.
     :return:
     """
-    if mentions:
-        query = _search_posts_with_mentions_query(username, content, behavior)
-    else:
-        query = _search_posts_query(username, content, behavior)
-    page_count, results = await _get_entities(mongo, DB_POSTS, query, page)
-    return page_count, results
+
+    mode = search_mode(mode, username, behavior)
+    build_query = partial(
+        _build_posts_query, mongo, username, content, behavior, mentions, mode
+    )
+    search_key = _posts_search_key(username, content, behavior, mentions, mode)
+    projection = _posts_projection(username, content, mode, mentions)
+    return await _collect_search(
+        mongo, DB_POSTS, search_key, page, cursor, build_query, charge, projection
+    )
+
+
+def encode_export_cursor(after: Any) -> str:
+    """
+    Create a token to resume an export from.
+
+    :param after: `_id` of the last document that was exported.
+    :return: URL safe token.
+    """
+    # an export is read in one pass, so its tokens are all for the first page
+    return encode_cursor(0, after=after)
+
+
+def decode_export_cursor(token: str) -> Optional[Any]:
+    """
+    Read a token created by `encode_export_cursor`.
+
+    :param token: Token from the request.
+    :return: `_id` to resume the export after, or None if the token is unusable.
+    """
+    position = decode_cursor(token, 0)
+    if position is None or "after" not in position:
+        return None
+    return position["after"]
+
+
+async def _export(
+    mongo: Motor,
+    collection: str,
+    query: Optional[dict],
+    after: Optional[Any],
+    batch_size: int = EXPORT_BATCH_SIZE,
+    charge: Optional[Charge] = None,
+) -> AsyncGenerator[list, None]:
+    if query is None:
+        return
+
+    if after is not None:
+        query = {"$and": [query, {"_id": {"$gt": after}}]}
+    documents = (
+        mongo.db[collection]
+        .find(query)
+        .sort("_id", ASCENDING)
+        .batch_size(batch_size)
+        .max_time_ms(EXPORT_TIMEOUT_MS)
+    )
+
+    # only a batch of documents is held at a time, and the next one is not
+    # fetched until the last has been written to the client
+    cursor = encode_export_cursor(after) if after is not None else None
+    first = True
+    try:
+        while True:
+            if charge is not None and not first:
+                # the first batch was charged with the query, each further one
+                # costs as much again, as a page of a search would
+                await charge(querycost.query_cost(query))
+            first = False
+
+            batch = await documents.to_list(length=batch_size)
+            if not batch:
+                return
+
+            records = []
+            for document in batch:
+                cursor = encode_export_cursor(document["_id"])
+                records.append({"cursor": cursor, "document": document})
+            yield records
+    except ExecutionTimeout:
+        logger.info(f"Export of {collection} ran out of time")
+        yield [{"error": "The export ran out of time.", "cursor": cursor}]
+    except RateLimitExceeded as err:
+        message = f"The export is over its rate limit, resume in {err.retry_after}s."
+        yield [{"error": message, "cursor": cursor}]
+    except OperationFailure as err:
+        logger.error(f"Failure exporting {collection}: {err}")
+        yield [{"error": "The export failed.", "cursor": cursor}]
+    finally:
+        # stops the query if the client went away part way through, run by
+        # `streaming.stream_ndjson` closing the export as soon as it ends
+        await documents.close()
+
+
+async def export_users(
+    mongo: Motor,
+    username: str,
+    after: Optional[Any] = None,
+    charge: Optional[Charge] = None,
+) -> AsyncGenerator[list, None]:
+    """
+    Find every user matching a search, in `_id` order, for bulk consumers.
+
+    The query is built and charged up front, documents are only fetched as the
+    batches are read. Each batch after the first is charged the query's cost
+    again, so an export that outruns its client's allowance ends early.
+
+    :param mongo: A MongoDB Motor connection object.
+    :param username: Substring of the name or username to search for.
+    :param after: `_id` to resume after, see `decode_export_cursor`.
+    :param charge: Called with the estimated cost of the query before it runs,
+                   and before each further batch is fetched.
+    :return: Batches of records, each holding a document and the token to resume
+             after it. A record holding an error ends an export that was cut short.
+    """
+
+    async def build_query() -> Optional[dict]:
+        return await _users_query(mongo, username)
+
+    query = await _charged_query(DB_USERS, build_query, charge)
+    return _export(mongo, DB_USERS, query, after, charge=charge)
+
+
+async def export_posts(
+    mongo: Motor,
+    username: str,
+    content: str,
+    behavior: SearchBehavior,
+    mentions: bool,
+    after: Optional[Any] = None,
+    charge: Optional[Charge] = None,
+    mode: SearchMode = SearchMode.SUBSTRING,
+) -> AsyncGenerator[list, None]:
+    """
+    Find every post matching a search, in `_id` order, for bulk consumers.
+
+    Takes the same search parameters as `search_posts`, and returns batches
+    like `export_users`.
+
+    :param after: `_id` to resume after, see `decode_export_cursor`.
+    :param charge: Called with the estimated cost of the query before it runs,
+                   and before each further batch is fetched.
+    :param mode: How to search for the content, see `search_posts`. Exports
+                 are in `_id` order either way.
+    :return: Batches of records.
+    """
+
+    mode = search_mode(mode, username, behavior)
+    build_query = partial(
+        _build_posts_query, mongo, username, content, behavior, mentions, mode
+    )
+    query = await _charged_query(DB_POSTS, build_query, charge)
+    return _export(mongo, DB_POSTS, query, after, charge=charge)
+
+
+async def get_comments(
+    mongo: Motor,
+    post_id: Any,
+    offset: int,
+    limit: int = COMMENT_PAGE_SIZE,
+    echo: bool = False,
+) -> Optional[Tuple[list, int]]:
+    """
+    Page through every comment of a post, for those left out of search results.
+
+    :param mongo: A MongoDB Motor connection object.
+    :param post_id: `_id` of the post.
+    :param offset: Number of comments to skip.
+    :param limit: Number of comments to return.
+    :param echo: Page through the comments of the post it echoes instead.
+    :return: The comments and how many the post has, None if there is no such post.
+    """
+    comments = {"$ifNull": ["$echo.comments" if echo else "$comments", []]}
+    posts = mongo.db[DB_POSTS].with_options(codec_options=RESULT_CODEC_OPTIONS)
+    found = await posts.aggregate(
+        [
+            {"$match": {"_id": post_id}},
+            {
+                "$project": {
+                    "comments": _comments_expression(comments, offset, limit),
+                    "comments_total": {"$size": comments},
+                }
+            },
+        ],
+        maxTimeMS=SEARCH_TIMEOUT_MS,
+    ).to_list(length=1)
+    if not found:
+        return None
+    return list(found[0]["comments"]), found[0]["comments_total"]
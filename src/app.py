@@ -1,47 +1,107 @@
 #!/usr/bin/env python
-import os
+import asyncio
 from datetime import timedelta
-from typing import Optional
+from typing import Any, Optional, Tuple
 from urllib.parse import urlencode
 
-from dotenv import load_dotenv
-from quart import Quart, redirect, render_template, request
+from quart import Quart, Response, abort, redirect, render_template, request, url_for
 from quart_motor import Motor
-from quart_rate_limiter import RateLimiter, rate_limit
+from quart_rate_limiter import RateLimiter, RateLimitExceeded, rate_limit
 from quart_rate_limiter.redis_store import RedisStore
 from quart_rate_limiter.store import MemoryStore
 
 import api
+import backend
+import cache
+import httpcache
+import metrics
+import ratelimit
+import streaming
 import templatefilters
+import warmup
+from config import (
+    META_REFRESH_INTERVAL,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_URI,
+    QUART_ENV,
+    REDIS_URL,
+    SEARCH_BACKEND,
+    SEARCH_COST_LIMIT,
+    SEARCH_COST_PERIOD,
+    STREAM_RESULTS,
+    WARMUP_SEARCHES,
+)
 from constants import (
+    API_PATH_COMPONENT,
+    CURSOR_QUERY_PARAM,
+    ECHO_QUERY_PARAM,
     INCLUDE_MENTIONS_QUERY_PARAM,
     PAGE_QUERY_PARAM,
     POSTS_PATH_COMPONENT,
     SEARCH_BEHAVIOR_QUERY_PARAM,
     SEARCH_CONTENT_QUERY_PARAM,
+    SEARCH_MODE_QUERY_PARAM,
     USERNAME_QUERY_PARAM,
     USERS_PATH_COMPONENT,
 )
-from enums import SearchBehavior
-
+from enums import SearchBehavior, SearchMode
 
-load_dotenv()
-
-QUART_ENV = os.environ.get("QUART_ENV")
-MONGO_USER = os.environ.get("MONGO_USER")
-MONGO_PASS = os.environ.get("MONGO_PASS")
-MONGO_ENDPOINT = os.environ.get("MONGO_ENDPOINT")
-MONGO_PORT = os.environ.get("MONGO_PORT")
-REDIS_URL = os.environ.get("REDIS_URL")
 
 app = Quart(__name__, static_folder="public", template_folder="views")
 
 templatefilters.register_filters(app)
 
 mongo = Motor(
-    app, uri=f"mongodb://{MONGO_USER}:{MONGO_PASS}@{MONGO_ENDPOINT}:{MONGO_PORT}/parler"
+    app,
+    uri=MONGO_URI,
+    event_listeners=[metrics.CommandTimer()],
+    minPoolSize=MONGO_MIN_POOL_SIZE,
 )
 
+search_backend = backend.create_backend(SEARCH_BACKEND, mongo)
+
+# long running tasks started for the lifetime of the worker
+background_tasks: list[asyncio.Future] = []
+
+
+@app.before_serving
+async def load_dataset_meta():
+    # registered after Motor so that its client is connected by now
+    await search_backend.refresh_meta()
+    background_tasks.append(
+        asyncio.ensure_future(
+            search_backend.refresh_meta_periodically(META_REFRESH_INTERVAL)
+        )
+    )
+
+
+@app.before_serving
+async def connect_result_cache():
+    if QUART_ENV != "development":
+        await cache.result_cache.connect(REDIS_URL)
+
+
+@app.after_serving
+async def close_result_cache():
+    await cache.result_cache.close()
+
+
+@app.after_serving
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+
+
+@app.after_serving
+async def close_search_backend():
+    await search_backend.close()
+
+
+@app.after_serving
+async def clear_ready():
+    warmup.clear_ready()
+
+
 if QUART_ENV == "development":
     redis_store = MemoryStore()
 else:
@@ -52,12 +112,43 @@ async def key_function() -> Optional[str]:
     return request.headers.get("X-Forwarded-For", request.remote_addr)
 
 
-limiter = RateLimiter(app, key_function=key_function, store=redis_store)
+limiter = RateLimiter(
+    app, key_function=key_function, store=metrics.TimedStore(redis_store)
+)
+
+# searches are limited by how expensive their queries are on top of the
+# per route limits, sharing the limiter's store
+cost_limiter = ratelimit.CostLimiter(
+    lambda: limiter.store, SEARCH_COST_LIMIT, timedelta(seconds=SEARCH_COST_PERIOD)
+)
+
+
+async def charge_search(cost: float) -> None:
+    # keyed as the route limits are, which format the key into theirs
+    await cost_limiter.charge(str(await key_function()), cost)
+
+
+@app.before_serving
+async def start_warm_up():
+    # registered after the limiter so that its store is connected by the time
+    # searches are replayed, which happens in the background while /ready says so
+    background_tasks.append(
+        asyncio.ensure_future(
+            warmup.warm_up(
+                app,
+                mongo.db,
+                MONGO_MIN_POOL_SIZE if search_backend.uses_mongo else 0,
+                WARMUP_SEARCHES,
+            )
+        )
+    )
 
 
 @app.errorhandler(429)
 async def limited(exc):
-    return await render_template("429.html")
+    # tell clients how long until they can afford their search
+    headers = exc.get_headers() if isinstance(exc, RateLimitExceeded) else {}
+    return await render_template("429.html"), 429, headers
 
 
 @app.errorhandler(404)
@@ -70,6 +161,91 @@ ROUTE_PARAMS = {
 }
 
 
+def _page_url(page: int, cursor: str) -> str:
+    args: dict[str, Any] = request.args.to_dict()
+    args.update({PAGE_QUERY_PARAM: page, CURSOR_QUERY_PARAM: cursor})
+    # in a fixed order, so that following the link from differently ordered
+    # searches requests the same page, and shares its HTTP cache entry
+    return url_for(str(request.endpoint), **dict(sorted(args.items())))
+
+
+def _pager_urls(
+    found: api.SearchResults, page: int
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Build links that seek directly to the pages either side of the current one.
+
+    :param found: results of the current page
+    :param page: current page number
+    :return: previous and next page urls, None where there is no such page
+    """
+    results = found.results
+    if not results or "_id" not in results[0]:
+        return None, None
+
+    prev_url = next_url = None
+    if page > 0:
+        prev_url = _page_url(
+            page - 1, api.encode_cursor(page - 1, before=results[0]["_id"])
+        )
+    # after partial results there is no telling where the next page starts
+    more = page + 1 < found.page_count or not found.page_count_exact
+    if more and not found.partial:
+        next_url = _page_url(
+            page + 1, api.encode_cursor(page + 1, after=results[-1]["_id"])
+        )
+    return prev_url, next_url
+
+
+def _pager_context(found: api.SearchResults, page: int) -> dict:
+    prev_url, next_url = _pager_urls(found, page)
+    return {
+        "page_count": found.page_count,
+        "page_count_exact": found.page_count_exact,
+        "partial": found.partial,
+        "prev_url": prev_url,
+        "next_url": next_url,
+    }
+
+
+def _uncached_if_partial(found: api.SearchResults, body: str) -> Response:
+    response = Response(body)
+    if found.partial:
+        # a search that ran out of time may find everything when tried again
+        response.cache_control.no_store = True
+    return response
+
+
+def _posts_search_args() -> Tuple[str, str, SearchBehavior, bool, SearchMode]:
+    username = request.args.get(USERNAME_QUERY_PARAM, "")
+    search_content = request.args.get(SEARCH_CONTENT_QUERY_PARAM, "")
+    mentions = request.args.get(INCLUDE_MENTIONS_QUERY_PARAM, "") == "true"
+
+    try:
+        behavior = SearchBehavior(request.args.get(SEARCH_BEHAVIOR_QUERY_PARAM, ""))
+    except ValueError:
+        behavior = SearchBehavior.MATCH_ALL
+
+    try:
+        mode = SearchMode(request.args.get(SEARCH_MODE_QUERY_PARAM, ""))
+    except ValueError:
+        mode = SearchMode.SUBSTRING
+
+    return username, search_content, behavior, mentions, mode
+
+
+def _export_after() -> Optional[Any]:
+    cursor = request.args.get(CURSOR_QUERY_PARAM)
+    if not cursor:
+        return None
+
+    after = api.decode_export_cursor(cursor)
+    if after is None:
+        # restarting from the beginning would silently repeat documents
+        abort(400)
+    return after
+
+
 @app.route("/")
 @rate_limit(1, timedelta(milliseconds=500))
 async def home():
@@ -92,54 +268,140 @@ async def about():
 
 
 @app.route(f"/{POSTS_PATH_COMPONENT}", strict_slashes=False)
-@rate_limit(1, timedelta(seconds=3))
+@rate_limit(1, timedelta(milliseconds=500))
+@httpcache.http_cached
 async def posts():
-    username = request.args.get(USERNAME_QUERY_PARAM, "")
-    search_content = request.args.get(SEARCH_CONTENT_QUERY_PARAM, "")
-    page = request.args.get(PAGE_QUERY_PARAM, 0)
-    behavior = request.args.get(SEARCH_BEHAVIOR_QUERY_PARAM, "")
-    mentions = request.args.get(INCLUDE_MENTIONS_QUERY_PARAM, "") == "true"
+    username, search_content, behavior, mentions, mode = _posts_search_args()
+    cursor = request.args.get(CURSOR_QUERY_PARAM)
 
     try:
-        behavior = SearchBehavior(behavior)
-    except ValueError:
-        behavior = SearchBehavior.MATCH_ALL
-
-    try:
-        page = int(page)
+        page = int(request.args.get(PAGE_QUERY_PARAM, 0))
     except ValueError:
         page = 0
 
     if not username and not search_content:
         return await render_template("posts.html")
 
-    page_count, results = await api.search_posts(
-        mongo, username, search_content, page, behavior, mentions
+    # the form keeps the mode asked for, results are highlighted as searched
+    searched_mode = api.search_mode(mode, username, behavior)
+    highlighter_regex = None
+    if search_content:
+        highlighter_regex = api.get_highlighter(search_content, searched_mode)
+
+    context = {
+        "page": page,
+        "username": username,
+        "search_content": search_content,
+        "behavior": behavior.value,
+        "mentions": mentions,
+        "mode": mode.value,
+        "searched_mode": searched_mode.value,
+        "search_type": POSTS_PATH_COMPONENT,
+        "highlighter_regex": highlighter_regex,
+    }
+
+    if STREAM_RESULTS:
+        stream = await metrics.timed(
+            metrics.view_phase_seconds.labels(POSTS_PATH_COMPONENT, "search"),
+            search_backend.stream_posts(
+                username,
+                search_content,
+                page,
+                behavior,
+                mentions,
+                cursor,
+                charge=charge_search,
+                mode=mode,
+            ),
+        )
+
+        async def load_pager() -> dict:
+            return _pager_context(await stream.finish(), page)
+
+        response = await streaming.stream_template(
+            "posts.html",
+            posts=stream,
+            load_pager=load_pager,
+            streaming=True,
+            **context,
+        )
+        # the headers are sent before it is known whether the results are partial
+        response.cache_control.no_cache = True
+        return response
+
+    found = await metrics.timed(
+        metrics.view_phase_seconds.labels(POSTS_PATH_COMPONENT, "search"),
+        search_backend.search_posts(
+            username,
+            search_content,
+            page,
+            behavior,
+            mentions,
+            cursor,
+            charge=charge_search,
+            mode=mode,
+        ),
+    )
+
+    return _uncached_if_partial(
+        found,
+        await metrics.timed(
+            metrics.view_phase_seconds.labels(POSTS_PATH_COMPONENT, "render"),
+            render_template(
+                "posts.html",
+                posts=found.results,
+                **_pager_context(found, page),
+                **context,
+            ),
+        ),
     )
 
+
+@app.route(f"/{POSTS_PATH_COMPONENT}/<post_id>/comments")
+@rate_limit(4, timedelta(seconds=1))
+@httpcache.http_cached
+async def post_comments(post_id: str):
+    search_content = request.args.get(SEARCH_CONTENT_QUERY_PARAM, "")
+    offset = request.args.get("offset", 0)
+    try:
+        offset = max(int(offset), 0)
+    except ValueError:
+        offset = 0
+    try:
+        mode = SearchMode(request.args.get(SEARCH_MODE_QUERY_PARAM, ""))
+    except ValueError:
+        mode = SearchMode.SUBSTRING
+
+    # the comments of the post it echoes, shown alongside its own
+    echo = request.args.get(ECHO_QUERY_PARAM, "") == "true"
+    found = await search_backend.get_comments(post_id, offset, echo=echo)
+    if found is None:
+        abort(404)
+    comments, total = found
+
+    next_offset = offset + len(comments)
     highlighter_regex = None
     if search_content:
-        highlighter_regex = api.get_highlighter_regex(search_content)
-
+        highlighter_regex = api.get_highlighter(search_content, mode)
     return await render_template(
-        "posts.html",
-        posts=results,
-        page=page,
-        username=username,
+        "comments_page.html",
+        comments=comments,
+        post_id=post_id,
+        echo=echo,
+        next_offset=next_offset if comments and next_offset < total else None,
         search_content=search_content,
-        behavior=behavior.value,
-        mentions=mentions,
-        page_count=page_count,
-        search_type=POSTS_PATH_COMPONENT,
+        mode=mode.value,
         highlighter_regex=highlighter_regex,
     )
 
 
 @app.route(f"/{USERS_PATH_COMPONENT}", strict_slashes=False)
-@rate_limit(1, timedelta(seconds=1))
+@rate_limit(1, timedelta(milliseconds=500))
+@httpcache.http_cached
 async def users():
     username = request.args.get(USERNAME_QUERY_PARAM)
     page = request.args.get(PAGE_QUERY_PARAM, 0)
+    cursor = request.args.get(CURSOR_QUERY_PARAM)
     try:
         page = int(page)
     except ValueError:
@@ -148,16 +410,78 @@ async def users():
     if not username:
         return await render_template("users.html")
 
-    page_count, results = await api.search_users(mongo, username, page)
+    found = await metrics.timed(
+        metrics.view_phase_seconds.labels(USERS_PATH_COMPONENT, "search"),
+        search_backend.search_users(username, page, cursor, charge=charge_search),
+    )
 
-    return await render_template(
-        "users.html",
-        users=results,
-        page=page,
-        username=username,
-        page_count=page_count,
-        search_type=USERS_PATH_COMPONENT,
+    return _uncached_if_partial(
+        found,
+        await metrics.timed(
+            metrics.view_phase_seconds.labels(USERS_PATH_COMPONENT, "render"),
+            render_template(
+                "users.html",
+                users=found.results,
+                page=page,
+                username=username,
+                search_type=USERS_PATH_COMPONENT,
+                **_pager_context(found, page),
+            ),
+        ),
+    )
+
+
+@app.route(f"/{API_PATH_COMPONENT}/{POSTS_PATH_COMPONENT}", strict_slashes=False)
+@rate_limit(1, timedelta(milliseconds=500))
+async def export_posts():
+    if not search_backend.uses_mongo:
+        abort(404)
+
+    username, search_content, behavior, mentions, mode = _posts_search_args()
+    if not username and not search_content:
+        abort(400)
+
+    batches = await api.export_posts(
+        mongo,
+        username,
+        search_content,
+        behavior,
+        mentions,
+        _export_after(),
+        charge=charge_search,
+        mode=mode,
     )
+    return streaming.stream_ndjson(batches)
+
+
+@app.route(f"/{API_PATH_COMPONENT}/{USERS_PATH_COMPONENT}", strict_slashes=False)
+@rate_limit(1, timedelta(milliseconds=500))
+async def export_users():
+    if not search_backend.uses_mongo:
+        abort(404)
+
+    username = request.args.get(USERNAME_QUERY_PARAM)
+    if not username:
+        abort(400)
+
+    batches = await api.export_users(
+        mongo, username, _export_after(), charge=charge_search
+    )
+    return streaming.stream_ndjson(batches)
+
+
+@app.route("/ready")
+async def ready():
+    # for load balancers, which should only send traffic to warmed up workers
+    if not warmup.is_ready():
+        return "warming up", 503
+    return "ready"
+
+
+@app.route("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.latest()
+    return Response(body, content_type=content_type)
 
 
 if __name__ == "__main__":
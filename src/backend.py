@@ -0,0 +1,184 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+from bson import ObjectId
+from quart_motor import Motor
+
+import api
+import meta
+from config import SQLITE_PATH, SQLITE_POOL_SIZE
+from enums import SearchBehavior, SearchMode
+
+
+MONGO = "mongo"
+SQLITE = "sqlite"
+
+
+class SearchBackend(ABC):
+    """Answers the searches of the site, see `api` for what each one means."""
+
+    # exports, and the MongoDB connections warmed up at start, need MongoDB
+    uses_mongo = False
+
+    @abstractmethod
+    async def search_posts(
+        self,
+        username: str,
+        content: str,
+        page: int,
+        behavior: SearchBehavior,
+        mentions: bool,
+        cursor: Optional[str] = None,
+        charge: Optional[api.Charge] = None,
+        mode: SearchMode = SearchMode.SUBSTRING,
+    ) -> api.SearchResults:
+        pass
+
+    async def stream_posts(
+        self,
+        username: str,
+        content: str,
+        page: int,
+        behavior: SearchBehavior,
+        mentions: bool,
+        cursor: Optional[str] = None,
+        charge: Optional[api.Charge] = None,
+        mode: SearchMode = SearchMode.SUBSTRING,
+    ) -> api.ResultStream:
+        # backends that cannot hand results out as they arrive do so all at once
+        return api.ResultStream.of(
+            await self.search_posts(
+                username,
+                content,
+                page,
+                behavior,
+                mentions,
+                cursor,
+                charge=charge,
+                mode=mode,
+            )
+        )
+
+    @abstractmethod
+    async def search_users(
+        self,
+        username: str,
+        page: int,
+        cursor: Optional[str] = None,
+        charge: Optional[api.Charge] = None,
+    ) -> api.SearchResults:
+        pass
+
+    @abstractmethod
+    async def get_comments(
+        self, post_id: str, offset: int, echo: bool = False
+    ) -> Optional[Tuple[list, int]]:
+        pass
+
+    @abstractmethod
+    async def refresh_meta(self) -> None:
+        """Reload the dataset version and features into `meta`."""
+
+    async def refresh_meta_periodically(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            await self.refresh_meta()
+
+    async def close(self) -> None:
+        pass
+
+
+class MongoBackend(SearchBackend):
+    """Searches MongoDB, through `api`."""
+
+    uses_mongo = True
+
+    def __init__(self, mongo: Motor):
+        self.mongo = mongo
+
+    async def search_posts(
+        self,
+        username: str,
+        content: str,
+        page: int,
+        behavior: SearchBehavior,
+        mentions: bool,
+        cursor: Optional[str] = None,
+        charge: Optional[api.Charge] = None,
+        mode: SearchMode = SearchMode.SUBSTRING,
+    ) -> api.SearchResults:
+        return await api.search_posts(
+            self.mongo,
+            username,
+            content,
+            page,
+            behavior,
+            mentions,
+            cursor,
+            charge=charge,
+            mode=mode,
+        )
+
+    async def stream_posts(
+        self,
+        username: str,
+        content: str,
+        page: int,
+        behavior: SearchBehavior,
+        mentions: bool,
+        cursor: Optional[str] = None,
+        charge: Optional[api.Charge] = None,
+        mode: SearchMode = SearchMode.SUBSTRING,
+    ) -> api.ResultStream:
+        return await api.stream_posts(
+            self.mongo,
+            username,
+            content,
+            page,
+            behavior,
+            mentions,
+            cursor,
+            charge=charge,
+            mode=mode,
+        )
+
+    async def search_users(
+        self,
+        username: str,
+        page: int,
+        cursor: Optional[str] = None,
+        charge: Optional[api.Charge] = None,
+    ) -> api.SearchResults:
+        return await api.search_users(self.mongo, username, page, cursor, charge=charge)
+
+    async def get_comments(
+        self, post_id: str, offset: int, echo: bool = False
+    ) -> Optional[Tuple[list, int]]:
+        return await api.get_comments(
+            self.mongo,
+            ObjectId(post_id) if ObjectId.is_valid(post_id) else post_id,
+            offset,
+            echo=echo,
+        )
+
+    async def refresh_meta(self) -> None:
+        await meta.refresh(self.mongo.db)
+
+
+def create_backend(name: str, mongo: Motor) -> SearchBackend:
+    """
+    Set up the search backend named by `SEARCH_BACKEND`.
+
+    :param name: `mongo` or `sqlite`
+    :param mongo: Motor instance, used by the `mongo` backend
+    :return: the backend
+    """
+    if name == MONGO:
+        return MongoBackend(mongo)
+    if name == SQLITE:
+        # imported here, as it builds on this module
+        import sqlitebackend
+
+        return sqlitebackend.SQLiteBackend(SQLITE_PATH, SQLITE_POOL_SIZE)
+    raise ValueError(f"Unknown search backend {name!r}")
@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import uuid
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Generic, Optional, TypeVar
+
+import aioredis
+import bson
+from bson.codec_options import DEFAULT_CODEC_OPTIONS, CodecOptions
+
+import meta
+import metrics
+from config import (
+    RESULT_CACHE_BYTES,
+    RESULT_CACHE_TTL,
+    SEARCH_LEASE_POLL_INTERVAL,
+    SEARCH_LEASE_TTL,
+)
+
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "results"
+LEASE_PREFIX = "lease"
+
+# deletes a lease only if it is still held by whoever releases it, as it may
+# have lapsed and been taken by another worker since
+RELEASE_LEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+class LRUCache:
+    """Encoded values kept in memory, least recently used first out past a size in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Shares one run of a coroutine between everyone asking for the same key at once.
+
+    The run is cancelled once every caller waiting on it has been cancelled.
+    """
+
+    def __init__(self):
+        self._flights: dict[str, asyncio.Future] = {}
+        self._waiters: Counter[str] = Counter()
+
+    def get(self, key: str) -> Optional[Awaitable[T]]:
+        flight = self._flights.get(key)
+        if flight is None:
+            return None
+        return self._wait(key, flight)
+
+    async def _wait(self, key: str, flight: asyncio.Future) -> T:
+        self._waiters[key] += 1
+        try:
+            # one waiter giving up must not cancel the run for the others
+            return await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                flight.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def lead(self, key: str) -> asyncio.Future:
+        """
+        Register a run whose result is set by its caller, for others to wait on.
+
+        :param key: key of the run
+        :return: future to set the result of the run on
+        """
+        flight = asyncio.get_event_loop().create_future()
+        self._flights[key] = flight
+        flight.add_done_callback(lambda done: self._land(key, done))
+        return flight
+
+    async def do(self, key: str, f: Callable[[], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(f())
+            self._flights[key] = flight
+            flight.add_done_callback(lambda done: self._land(key, done))
+        return await self._wait(key, flight)
+
+    def _land(self, key: str, flight: asyncio.Future) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+
+class ResultCache:
+    """
+    Search results cached in two tiers, each worker's memory and a shared redis.
+
+    Keys include the dataset version, so loading a new dump and recording its
+    version invalidates everything cached for the previous one.
+    """
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.local = LRUCache(max_bytes)
+        self.ttl = ttl
+        self._redis: Optional[aioredis.Redis] = None
+        self._version = ""
+
+    async def connect(self, redis_url: str) -> None:
+        self._redis = await aioredis.create_redis_pool(redis_url)
+
+    async def close(self) -> None:
+        if self._redis is not None:
+            self._redis.close()
+            await self._redis.wait_closed()
+            self._redis = None
+
+    def key(self, search_key: str, page: int) -> str:
+        version = meta.dataset_version()
+        if version != self._version:
+            # nothing cached for the previous dump can be hit again
+            self.local.clear()
+            self._version = version
+        return f"{KEY_PREFIX}:{version}:{search_key}:{page}"
+
+    async def get(
+        self, key: str, codec_options: CodecOptions = DEFAULT_CODEC_OPTIONS
+    ) -> Optional[dict]:
+        value = self.local.get(key)
+        if value is not None:
+            metrics.result_cache_lookups.labels("local_hit").inc()
+            return bson.decode(value, codec_options)
+
+        if self._redis is not None:
+            try:
+                value = await self._redis.get(key)
+            except (aioredis.RedisError, OSError) as err:
+                logger.error(f"Failure reading cached results: {err}")
+
+            if value is not None:
+                metrics.result_cache_lookups.labels("redis_hit").inc()
+                self.local.set(key, value)
+                return bson.decode(value, codec_options)
+
+        metrics.result_cache_lookups.labels("miss").inc()
+        return None
+
+    async def acquire_lease(
+        self, key: str, ttl: int = SEARCH_LEASE_TTL
+    ) -> Optional[str]:
+        """
+        Claim the right to compute a value across every worker sharing redis.
+
+        :param key: key the value will be cached under
+        :param ttl: seconds before the lease lapses, should its holder never release it
+        :return: token to release the lease with if this worker should compute
+                 the value, otherwise None
+        """
+        token = uuid.uuid4().hex
+        if self._redis is None:
+            return token
+
+        try:
+            acquired = await self._redis.set(
+                f"{LEASE_PREFIX}:{key}",
+                token,
+                expire=ttl,
+                exist=aioredis.Redis.SET_IF_NOT_EXIST,
+            )
+        except (aioredis.RedisError, OSError) as err:
+            logger.error(f"Failure acquiring lease: {err}")
+            return token
+        return token if acquired else None
+
+    async def release_lease(self, key: str, token: str) -> None:
+        """
+        Give up a lease, unless it has lapsed and is now held by someone else.
+
+        :param key: key the lease was acquired for
+        :param token: token returned by `acquire_lease`
+        """
+        if self._redis is None:
+            return
+
+        try:
+            await self._redis.eval(
+                RELEASE_LEASE_SCRIPT, keys=[f"{LEASE_PREFIX}:{key}"], args=[token]
+            )
+        except (aioredis.RedisError, OSError) as err:
+            logger.error(f"Failure releasing lease: {err}")
+
+    async def wait(
+        self,
+        key: str,
+        timeout: float = SEARCH_LEASE_TTL,
+        codec_options: CodecOptions = DEFAULT_CODEC_OPTIONS,
+    ) -> Optional[dict]:
+        """
+        Wait for the holder of a lease to cache its value.
+
+        :param key: key the value will be cached under
+        :param timeout: seconds to wait at most
+        :param codec_options: options to decode the value with
+        :return: the value, or None if the lease ended without one
+        """
+        if self._redis is None:
+            return None
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            await asyncio.sleep(SEARCH_LEASE_POLL_INTERVAL)
+            try:
+                value, leased = await asyncio.gather(
+                    self._redis.get(key), self._redis.exists(f"{LEASE_PREFIX}:{key}")
+                )
+            except (aioredis.RedisError, OSError) as err:
+                logger.error(f"Failure waiting for cached results: {err}")
+                return None
+
+            if value is not None:
+                metrics.result_cache_lookups.labels("lease_hit").inc()
+                self.local.set(key, value)
+                return bson.decode(value, codec_options)
+            if not leased:
+                return None
+
+        return None
+
+    async def set(self, key: str, value: dict) -> None:
+        encoded = bson.encode(value)
+        self.local.set(key, encoded)
+
+        if self._redis is not None:
+            try:
+                await self._redis.set(key, encoded, expire=self.ttl)
+            except (aioredis.RedisError, OSError) as err:
+                logger.error(f"Failure caching results: {err}")
+
+
+result_cache = ResultCache(RESULT_CACHE_BYTES, RESULT_CACHE_TTL)
+
+# searches being run to completion in this worker, by result cache key
+searches: SingleFlight = SingleFlight()
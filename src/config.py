@@ -0,0 +1,102 @@
+import os
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+QUART_ENV = os.environ.get("QUART_ENV")
+MONGO_USER = os.environ.get("MONGO_USER")
+MONGO_PASS = os.environ.get("MONGO_PASS")
+MONGO_ENDPOINT = os.environ.get("MONGO_ENDPOINT")
+MONGO_PORT = os.environ.get("MONGO_PORT")
+REDIS_URL = os.environ.get("REDIS_URL", "")
+
+MONGO_URI = f"mongodb://{MONGO_USER}:{MONGO_PASS}@{MONGO_ENDPOINT}:{MONGO_PORT}/parler"
+# where searches are answered from, "mongo" or "sqlite" for a database built
+# by `manage.py build-sqlite`, which needs no MongoDB
+SEARCH_BACKEND = os.environ.get("SEARCH_BACKEND", "mongo")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "parler.sqlite3")
+# read-only connections to the SQLite database, each used by its own thread
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", os.cpu_count() or 1))
+
+# connections each worker keeps open to MongoDB, opened before it reports ready
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", 10))
+
+# searches replayed by each worker as it starts, as whitespace separated paths
+# such as /posts?search_content=bong, to warm MongoDB and the result caches
+WARMUP_SEARCHES = os.environ.get("WARMUP_SEARCHES", "").split()
+
+# workers started by hypercorn, every one of which has to be warmed up before
+# /ready says so, and a directory they all record being warmed up in
+WORKERS = int(os.environ.get("WORKERS", 1))
+READY_DIR = os.environ.get("READY_DIR", "")
+
+# above this many candidate ids a trigram lookup is abandoned in favour of a scan
+TRIGRAM_MAX_CANDIDATES = int(os.environ.get("TRIGRAM_MAX_CANDIDATES", 50000))
+
+# the archive never changes, so counts can be cached for a long time
+COUNT_CACHE_TTL = int(os.environ.get("COUNT_CACHE_TTL", 24 * 60 * 60))
+COUNT_CACHE_SIZE = int(os.environ.get("COUNT_CACHE_SIZE", 10000))
+# stop counting results past this many, 0 always counts every result
+COUNT_LIMIT = int(os.environ.get("COUNT_LIMIT", 1000))
+
+# longest a search may run in MongoDB before the results that arrived in time
+# are shown, in milliseconds
+SEARCH_TIMEOUT_MS = int(os.environ.get("SEARCH_TIMEOUT_MS", 10000))
+# longest the background exact count of a search may run, in milliseconds
+EXACT_COUNT_TIMEOUT_MS = int(os.environ.get("EXACT_COUNT_TIMEOUT_MS", 60000))
+# most background exact counts run at once, across every worker sharing redis
+EXACT_COUNT_CONCURRENCY = int(os.environ.get("EXACT_COUNT_CONCURRENCY", 2))
+
+# how often workers reload the dataset version and features, in seconds
+META_REFRESH_INTERVAL = int(os.environ.get("META_REFRESH_INTERVAL", 60))
+
+# search results cached in each worker, in bytes of BSON
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", 64 * 1024 * 1024))
+# lifetime of search results cached in redis, in seconds
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 60 * 60))
+
+# each client may spend this much query cost per period, see querycost for the
+# scale, which by default allows one scan of the four post content fields
+# every 3 seconds
+SEARCH_COST_LIMIT = float(os.environ.get("SEARCH_COST_LIMIT", 120))
+SEARCH_COST_PERIOD = float(os.environ.get("SEARCH_COST_PERIOD", 9))
+
+# seconds a worker may spend on a search while the others wait for its results
+SEARCH_LEASE_TTL = int(os.environ.get("SEARCH_LEASE_TTL", 30))
+# seconds between checks for the results of a search another worker is running
+SEARCH_LEASE_POLL_INTERVAL = float(os.environ.get("SEARCH_LEASE_POLL_INTERVAL", 0.1))
+
+# hand results to the templates as RawBSONDocuments, decoding fields as they render
+RAW_BSON_RESULTS = os.environ.get("RAW_BSON_RESULTS", "") == "true"
+
+# render /posts while the results arrive rather than once the whole page is in
+STREAM_RESULTS = os.environ.get("STREAM_RESULTS", "") == "true"
+# documents per batch when streaming, smaller batches reach the browser sooner
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", 5))
+
+# documents per batch of an NDJSON export, each batch is one write to the client
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 500))
+# longest MongoDB may spend on an export before it has to be resumed, in milliseconds
+EXPORT_TIMEOUT_MS = int(os.environ.get("EXPORT_TIMEOUT_MS", 5 * 60 * 1000))
+
+# collections searched with a single aggregation counting the results and
+# fetching the page, as whitespace separated names, rather than a count and a
+# find that each match the query
+FACET_COLLECTIONS = frozenset(os.environ.get("FACET_COLLECTIONS", "").split())
+
+# comments shown with each post in search results, the rest are loaded on request
+COMMENTS_PER_POST = int(os.environ.get("COMMENTS_PER_POST", 5))
+# comments loaded per request once a post's comments are opened
+COMMENT_PAGE_SIZE = int(os.environ.get("COMMENT_PAGE_SIZE", 50))
+
+# how long clients and proxies may reuse a search page without revalidating
+# it, in seconds
+HTTP_CACHE_MAX_AGE = int(os.environ.get("HTTP_CACHE_MAX_AGE", 24 * 60 * 60))
+# directory of pages rendered ahead of time by `manage.py prerender`, served
+# in place of rendering them, empty to serve none
+PRERENDER_DIR = os.environ.get("PRERENDER_DIR", "")
+
+# explain and log queries slower than this many seconds, 0 logs none
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", 0))
@@ -2,13 +2,30 @@
 USERNAME_QUERY_PARAM = "username"
 SEARCH_CONTENT_QUERY_PARAM = "search_content"
 PAGE_QUERY_PARAM = "page"
+CURSOR_QUERY_PARAM = "cursor"
 SEARCH_BEHAVIOR_QUERY_PARAM = "behavior"
 INCLUDE_MENTIONS_QUERY_PARAM = "mentions"
+SEARCH_MODE_QUERY_PARAM = "mode"
+ECHO_QUERY_PARAM = "echo"
 
 # path components
 POSTS_PATH_COMPONENT = "posts"
 USERS_PATH_COMPONENT = "users"
+API_PATH_COMPONENT = "api"
 
 # db schemas
 DB_POSTS = "posts"
 DB_USERS = "users"
+DB_META = "meta"
+DB_POST_TRIGRAMS = "post_trigrams"
+DB_USER_TRIGRAMS = "user_trigrams"
+DB_HASHTAGS = "hashtags"
+
+# post fields searched by content queries
+POST_CONTENT_FIELDS = ("text", "media.title", "comment.text", "echo.text")
+
+# post fields covered by the $text index, see textsearch
+POST_TEXT_FIELDS = ("text", "media.title", "comments.text", "echo.text")
+
+# user fields searched by username queries
+USER_CONTENT_FIELDS = ("name", "username")
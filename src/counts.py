@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from bson import json_util
+from pymongo.errors import PyMongoError
+
+import cache as shared_cache
+import meta
+from config import (
+    COUNT_CACHE_SIZE,
+    COUNT_CACHE_TTL,
+    COUNT_LIMIT,
+    EXACT_COUNT_CONCURRENCY,
+    EXACT_COUNT_TIMEOUT_MS,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# exact counts are shared between workers in redis, under this prefix
+SHARED_PREFIX = "counts"
+# the leases held by the exact counts running across every worker, one per slot
+SLOT_PREFIX = "exact-count-slot"
+# slots and counts are leased past the count's own timeout, in case a worker
+# dies without releasing them
+EXACT_COUNT_LEASE_TTL = EXACT_COUNT_TIMEOUT_MS // 1000 + 10
+
+
+def query_key(collection: str, query: Any) -> str:
+    """
+    Build a cache key that is the same for every equivalent query.
+
+    :param collection: name of the queried collection
+    :param query: MongoDB query, or any other BSON serializable search description
+    :return: cache key
+    """
+    canonical = json_util.dumps(query, sort_keys=True)
+    return f"{collection}:{hashlib.sha1(canonical.encode()).hexdigest()}"
+
+
+class CountCache:
+    """
+    Result counts keyed by normalized query, expiring after a TTL.
+
+    Counts are dropped whenever the dataset version changes, as they were
+    counted in the previous dump.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Tuple[float, int, bool]] = OrderedDict()
+        self._version = ""
+
+    def _check_version(self) -> None:
+        version = meta.dataset_version()
+        if version != self._version:
+            self.clear()
+            self._version = version
+
+    def get(self, key: str) -> Optional[Tuple[int, bool]]:
+        self._check_version()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, count, exact = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return count, exact
+
+    def set(self, key: str, count: int, exact: bool) -> None:
+        self._check_version()
+        self._entries[key] = (time.monotonic() + self.ttl, count, exact)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+cache = CountCache(COUNT_CACHE_TTL, COUNT_CACHE_SIZE)
+
+# exact counts being filled in the background by this worker, by cache key
+_pending: dict[str, asyncio.Future] = {}
+
+
+def _shared_key(key: str) -> str:
+    return f"{SHARED_PREFIX}:{meta.dataset_version()}:{key}"
+
+
+async def _shared_count(key: str) -> Optional[int]:
+    shared = await shared_cache.result_cache.get(_shared_key(key))
+    return shared["count"] if shared is not None else None
+
+
+async def _acquire_slot() -> Optional[Tuple[str, str]]:
+    for slot in range(EXACT_COUNT_CONCURRENCY):
+        name = f"{SLOT_PREFIX}:{slot}"
+        token = await shared_cache.result_cache.acquire_lease(
+            name, EXACT_COUNT_LEASE_TTL
+        )
+        if token is not None:
+            return name, token
+    return None
+
+
+async def _fill_exact(collection, query: dict, key: str) -> None:
+    shared_key = _shared_key(key)
+    leases = []
+    try:
+        token = await shared_cache.result_cache.acquire_lease(
+            shared_key, EXACT_COUNT_LEASE_TTL
+        )
+        if token is None:
+            # another worker is counting, its count is read from redis
+            return
+        leases.append((shared_key, token))
+
+        slot = await _acquire_slot()
+        if slot is None:
+            logger.info(f"Not counting {key} exactly, every slot is taken")
+            return
+        leases.append(slot)
+
+        total_count = await collection.count_documents(
+            query, maxTimeMS=EXACT_COUNT_TIMEOUT_MS
+        )
+    except PyMongoError as err:
+        logger.error(f"Failure counting {collection.name}: {err}")
+    else:
+        cache.set(key, total_count, True)
+        await shared_cache.result_cache.set(shared_key, {"count": total_count})
+    finally:
+        for lease in leases:
+            await shared_cache.result_cache.release_lease(*lease)
+        _pending.pop(key, None)
+
+
+def fill_exact(collection, query: dict, key: str) -> None:
+    """
+    Count every result of a query in the background and share the exact count.
+
+    At most `EXACT_COUNT_CONCURRENCY` counts run at once across every worker
+    sharing redis, and each query is only counted by one of them. Counts that
+    find no free slot are left as lower bounds.
+
+    :param collection: Motor collection to count in.
+    :param query: MongoDB query.
+    :param key: Cache key of the query.
+    :return:
+    """
+    if key in _pending or len(_pending) >= EXACT_COUNT_CONCURRENCY:
+        return
+    _pending[key] = asyncio.ensure_future(_fill_exact(collection, query, key))
+
+
+async def count(
+    collection, query: dict, key: Optional[str] = None, **options: Any
+) -> Tuple[int, bool]:
+    """
+    Count the results of a query, stopping at COUNT_LIMIT.
+
+    Counts are cached, so paging through a search only counts it once. When the
+    limit is reached the exact count is filled in by a background job, or read
+    from redis once any worker has counted it.
+
+    :param collection: Motor collection to count in.
+    :param query: MongoDB query.
+    :param key: Cache key, derived from the query when not given.
+    :param options: Passed on to `count_documents`, e.g. `maxTimeMS`.
+    :return: The count and whether it is exact rather than a lower bound.
+    """
+    key = key or query_key(collection.name, query)
+    cached = cache.get(key)
+    if cached is not None:
+        if not cached[1]:
+            shared = await _shared_count(key)
+            if shared is not None:
+                cache.set(key, shared, True)
+                return shared, True
+            # in case no slot was free when it was first counted
+            fill_exact(collection, query, key)
+        return cached
+
+    if not COUNT_LIMIT:
+        total_count = await collection.count_documents(query, **options)
+        cache.set(key, total_count, True)
+        return total_count, True
+
+    total_count = await collection.count_documents(query, limit=COUNT_LIMIT, **options)
+    exact = total_count < COUNT_LIMIT
+    if not exact:
+        shared = await _shared_count(key)
+        if shared is not None:
+            total_count, exact = shared, True
+        else:
+            fill_exact(collection, query, key)
+    cache.set(key, total_count, exact)
+
+    return total_count, exact
+
+
+async def stored_count(collection, _id: Any) -> Tuple[int, bool]:
+    """
+    Look up a count that was worked out offline, see `derived.backfill_hashtags`.
+
+    :param collection: Motor collection holding a `count` per `_id`.
+    :param _id: What was counted.
+    :return: The count, 0 if there is none, and that it is exact.
+    """
+    counted = await collection.find_one({"_id": _id}, {"count": 1})
+    return (counted["count"] if counted is not None else 0), True
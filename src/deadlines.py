@@ -0,0 +1,47 @@
+import logging
+import uuid
+
+from pymongo.errors import PyMongoError
+
+
+logger = logging.getLogger(__name__)
+
+TAG_PREFIX = "search"
+
+
+def operation_tag() -> str:
+    """
+    Create a comment to tag the operations of a single search with.
+
+    :return: a tag unique to the search
+    """
+    return f"{TAG_PREFIX}-{uuid.uuid4().hex}"
+
+
+async def kill_operations(db, tag: str) -> None:
+    """
+    Kill the operations of a search that nobody is waiting for anymore.
+
+    Cancelling the futures of a search leaves MongoDB running its queries
+    until they finish or run out of time, so they are found by their tag and
+    killed. Needs the `inprog` and `killop` privileges.
+
+    :param db: Motor database the search ran against
+    :param tag: comment the search's operations were tagged with
+    """
+    admin = db.client.admin
+    try:
+        current = await admin.command(
+            {
+                "currentOp": True,
+                # getMores carry the comment of the find that started them
+                "$or": [
+                    {"command.comment": tag},
+                    {"originatingCommand.comment": tag},
+                ],
+            }
+        )
+        for operation in current.get("inprog", []):
+            await admin.command({"killOp": 1, "op": operation["opid"]})
+    except PyMongoError as err:
+        logger.error(f"Failure killing abandoned search: {err}")
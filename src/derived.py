@@ -0,0 +1,225 @@
+import logging
+import re
+from typing import Callable
+
+from pymongo import ASCENDING, UpdateOne
+from pymongo.collection import Collection
+
+from constants import POST_CONTENT_FIELDS
+from trigrams import field_values
+
+
+logger = logging.getLogger(__name__)
+
+# number of documents updated per bulk write
+BATCH_SIZE = 1000
+
+MENTION_REGEX = re.compile(r"@\w+")
+# the hashtags `templatefilters` links to searches
+HASHTAG_REGEX = re.compile(r"#\w+")
+
+# fields naming the users taking part in a post
+POST_PARTICIPANT_FIELDS = ("username", "comments.username", "echo.username")
+
+
+def post_participants(post: dict) -> list[str]:
+    """
+    Collect the author, commenters and echoed author of a post.
+
+    :param post: post to read from
+    :return: sorted usernames, each listed once
+    """
+    return sorted(
+        {
+            username
+            for field in POST_PARTICIPANT_FIELDS
+            for username in field_values(post, field)
+        }
+    )
+
+
+def post_mentions(post: dict) -> list[str]:
+    """
+    Collect the @handles written in the content of a post.
+
+    Handles are case-folded, so they are looked up with `mention_key`.
+
+    :param post: post to read from
+    :return: sorted handles, each listed once
+    """
+    return sorted(
+        {
+            mention_key(handle)
+            for field in POST_CONTENT_FIELDS
+            for value in field_values(post, field)
+            for handle in MENTION_REGEX.findall(value)
+        }
+    )
+
+
+def mention_key(handle: str) -> str:
+    return handle.casefold()
+
+
+def post_hashtags(post: dict) -> list[str]:
+    """
+    Collect the #hashtags written in the content of a post.
+
+    Hashtags are case-folded, so they are looked up with `hashtag_key`.
+
+    :param post: post to read from
+    :return: sorted hashtags, each listed once
+    """
+    return sorted(
+        {
+            hashtag_key(hashtag)
+            for field in POST_CONTENT_FIELDS
+            for value in field_values(post, field)
+            for hashtag in HASHTAG_REGEX.findall(value)
+        }
+    )
+
+
+def hashtag_key(hashtag: str) -> str:
+    return hashtag.casefold()
+
+
+def is_hashtag(s: str) -> bool:
+    return HASHTAG_REGEX.fullmatch(s) is not None
+
+
+def post_fields(post: dict) -> dict:
+    return {
+        "participants": post_participants(post),
+        "mentions": post_mentions(post),
+    }
+
+
+def hashtag_fields(post: dict) -> dict:
+    return {"hashtags": post_hashtags(post)}
+
+
+def user_fields(user: dict) -> dict:
+    return {
+        "username_lower": (user.get("username") or "").casefold(),
+        "name_lower": (user.get("name") or "").casefold(),
+    }
+
+
+def backfill(
+    collection: Collection,
+    derive: Callable[[dict], dict],
+    projection: dict,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Store fields derived from each document of a collection on the document.
+
+    :param collection: collection to update
+    :param derive: builds the fields to set from a document
+    :param projection: fields of each document that `derive` reads
+    :param batch_size: number of documents updated per bulk write
+    :return: number of documents updated
+    """
+    updates = []
+    updated = 0
+    cursor = (
+        collection.find({}, projection).sort("_id", ASCENDING).batch_size(batch_size)
+    )
+    for doc in cursor:
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": derive(doc)}))
+        if len(updates) == batch_size:
+            collection.bulk_write(updates, ordered=False)
+            updated += len(updates)
+            updates = []
+            logger.info(f"Updated {updated} {collection.name}")
+
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+        updated += len(updates)
+    logger.info(f"Finished updating {updated} {collection.name}")
+
+    return updated
+
+
+def backfill_posts(posts: Collection, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Add `participants` and `mentions` to every post and index them.
+
+    Both indexes end in `_id`, so a page of posts by or mentioning a user is
+    read in order straight off the index.
+
+    :param posts: posts collection
+    :param batch_size: number of posts updated per bulk write
+    :return: number of posts updated
+    """
+    projection = {field: 1 for field in POST_PARTICIPANT_FIELDS + POST_CONTENT_FIELDS}
+    updated = backfill(posts, post_fields, projection, batch_size)
+    index_posts(posts)
+    return updated
+
+
+def index_posts(posts: Collection) -> None:
+    posts.create_index([("participants", ASCENDING), ("_id", ASCENDING)])
+    posts.create_index([("mentions", ASCENDING), ("_id", ASCENDING)])
+
+
+def backfill_hashtags(
+    posts: Collection, tags: Collection, batch_size: int = BATCH_SIZE
+) -> int:
+    """
+    Add `hashtags` to every post, index them and count the posts using each.
+
+    The counts replace the `tags` collection, holding a document per hashtag
+    with its number of posts under `count`.
+
+    :param posts: posts collection
+    :param tags: collection to write the counts to
+    :param batch_size: number of posts updated per bulk write
+    :return: number of posts updated
+    """
+    projection = {field: 1 for field in POST_CONTENT_FIELDS}
+    updated = backfill(posts, hashtag_fields, projection, batch_size)
+    index_hashtags(posts, tags)
+    return updated
+
+
+def index_hashtags(posts: Collection, tags: Collection) -> None:
+    """
+    Index the `hashtags` of every post and count the posts using each.
+
+    :param posts: posts collection, with `hashtags` on every post
+    :param tags: collection to write the counts to
+    """
+    posts.create_index([("hashtags", ASCENDING), ("_id", ASCENDING)])
+
+    posts.aggregate(
+        [
+            {"$unwind": "$hashtags"},
+            {"$group": {"_id": "$hashtags", "count": {"$sum": 1}}},
+            {"$out": tags.name},
+        ],
+        allowDiskUse=True,
+    )
+    logger.info(f"Counted hashtags into {tags.name}")
+
+
+def backfill_users(users: Collection, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Add case-folded copies of every user's username and name and index them.
+
+    Prefixes of a username are then found with an index seek, and substrings
+    of either with a scan of the index rather than the whole collection.
+
+    :param users: users collection
+    :param batch_size: number of users updated per bulk write
+    :return: number of users updated
+    """
+    updated = backfill(users, user_fields, {"username": 1, "name": 1}, batch_size)
+    index_users(users)
+    return updated
+
+
+def index_users(users: Collection) -> None:
+    users.create_index([("username_lower", ASCENDING)])
+    users.create_index([("name_lower", ASCENDING)])
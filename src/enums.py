@@ -4,3 +4,10 @@ from enum import Enum
 class SearchBehavior(Enum):
     MATCH_ANY = "match_any"
     MATCH_ALL = "match_all"
+
+
+class SearchMode(Enum):
+    # unanchored case-insensitive regexes, which match anywhere inside words
+    SUBSTRING = "substring"
+    # the $text index, matching whole words by their stems
+    WORDS = "words"
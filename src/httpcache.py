@@ -0,0 +1,127 @@
+import hashlib
+import os
+from functools import wraps
+from typing import Callable, Optional
+from urllib.parse import urlencode
+
+from quart import Quart, Response, current_app, make_response, request, send_file
+from werkzeug.datastructures import MultiDict
+from werkzeug.sansio.response import Response as BaseResponse
+
+import meta
+from config import HTTP_CACHE_MAX_AGE, PRERENDER_DIR
+
+
+_templates_digest: Optional[str] = None
+
+
+def templates_digest(app: Quart) -> str:
+    """
+    Hash the templates, so pages cached by a previous release are not reused.
+
+    :param app: app whose templates to hash
+    :return: hex digest of every template's source, computed once per worker
+    """
+    global _templates_digest
+
+    if _templates_digest is None:
+        digest = hashlib.sha1()
+        loader = app.jinja_env.loader
+        # an app without a loader has no templates to hash
+        if loader is not None:
+            for name in sorted(app.jinja_env.list_templates()):
+                source, _, _ = loader.get_source(app.jinja_env, name)
+                digest.update(name.encode())
+                digest.update(source.encode())
+        _templates_digest = digest.hexdigest()
+    return _templates_digest
+
+
+def canonical_args(args: MultiDict) -> str:
+    """
+    Encode query params in a fixed order, so the same search has one spelling.
+
+    :param args: query params of a request
+    :return: the params urlencoded, sorted by name then value
+    """
+    return urlencode(sorted(args.items(multi=True)))
+
+
+def etag(version: str, release: str, path: str, args: MultiDict) -> str:
+    """
+    Derive the entity tag of a page from everything that goes into rendering it.
+
+    :param version: dataset version the page was rendered from
+    :param release: digest of the templates it was rendered with
+    :param path: path of the page
+    :param args: query params of the page
+    :return: the entity tag, without quotes
+    """
+    identity = "\0".join((version, release, path, canonical_args(args)))
+    return hashlib.sha1(identity.encode()).hexdigest()
+
+
+def snapshot_path(directory: str, tag: str) -> str:
+    """
+    Name the file a page is prerendered to.
+
+    Pages are named by their tag, so a snapshot is only found for the dataset
+    version and templates it was rendered from.
+
+    :param directory: directory of prerendered pages
+    :param tag: entity tag of the page
+    :return: path of the page's snapshot, which may not exist
+    """
+    return os.path.join(directory, f"{tag}.html")
+
+
+def _cacheable(response: BaseResponse) -> None:
+    response.cache_control.public = True
+    response.cache_control.max_age = HTTP_CACHE_MAX_AGE
+
+
+def http_cached(view: Callable) -> Callable:
+    """
+    Let clients and proxies cache the pages of a view until the dataset changes.
+
+    A request whose `If-None-Match` holds the page's tag, even a weak one, is
+    answered with a 304 before the view runs, and one for a page prerendered in
+    `PRERENDER_DIR` is sent from disk. Responses other than 200s, and those the
+    view gave a `Cache-Control` of its own, are left alone. Nothing is cached
+    until a dataset version has been recorded, as the data may change without
+    notice.
+
+    :param view: view whose output depends only on its path, query params and
+                 the dataset
+    :return: the wrapped view
+    """
+
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        version = meta.dataset_version()
+        if not version:
+            return await view(*args, **kwargs)
+
+        tag = etag(version, templates_digest(current_app), request.path, request.args)
+        # weakly, as RFC 7232 says, since compressing proxies weaken the tag
+        if request.if_none_match.contains_weak(tag):
+            not_modified = Response("", status=304)
+            not_modified.set_etag(tag)
+            _cacheable(not_modified)
+            return not_modified
+
+        if PRERENDER_DIR:
+            path = snapshot_path(PRERENDER_DIR, tag)
+            if os.path.exists(path):
+                snapshot = await send_file(path, "text/html", add_etags=False)
+                snapshot.set_etag(tag)
+                _cacheable(snapshot)
+                return snapshot
+
+        response = await make_response(await view(*args, **kwargs))
+        if response.status_code == 200 and not response.headers.get("Cache-Control"):
+            response.set_etag(tag)
+            _cacheable(response)
+        return response
+
+    return wrapper
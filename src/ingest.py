@@ -0,0 +1,324 @@
+import gzip
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import time
+import typing
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import IO, Any, Iterator, NamedTuple, Optional, Union
+
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+
+import derived
+from api_types import Post, User
+from constants import DB_META, DB_POSTS, DB_USERS
+
+
+logger = logging.getLogger(__name__)
+
+# lines parsed and inserted by a worker at a time, which is also how far back
+# an interrupted load resumes from
+CHUNK_SIZE = 5000
+
+DUPLICATE_KEY_ERROR = 11000
+
+SCHEMAS = {DB_POSTS: Post, DB_USERS: User}
+
+CHECKPOINT_PREFIX = "ingest"
+
+NONE_TYPE = type(None)
+
+
+def _is_typeddict(t: Any) -> bool:
+    return isinstance(t, type) and issubclass(t, dict) and hasattr(t, "__total__")
+
+
+def validate(value: Any, t: Any, path: str = "") -> Optional[str]:
+    """
+    Check a decoded JSON value against the `api_types` shape it should have.
+
+    Keys not in the shape are allowed, and kept.
+
+    :param value: value to check
+    :param t: type it should have, e.g. `Post`
+    :param path: dotted path of the value, for the error message
+    :return: what is wrong with the value, None if nothing is
+    """
+    origin = typing.get_origin(t)
+    if origin is typing.Union:
+        errors = [validate(value, arg, path) for arg in typing.get_args(t)]
+        if None in errors:
+            return None
+        return errors[0]
+
+    if origin is list:
+        if not isinstance(value, list):
+            return f"{path or 'value'} should be a list"
+        (item_type,) = typing.get_args(t)
+        for i, item in enumerate(value):
+            error = validate(item, item_type, f"{path}.{i}")
+            if error is not None:
+                return error
+        return None
+
+    if _is_typeddict(t):
+        if not isinstance(value, dict):
+            return f"{path or 'value'} should be an object"
+        for key, key_type in typing.get_type_hints(t).items():
+            key_path = f"{path}.{key}".lstrip(".")
+            if key not in value:
+                if key in t.__required_keys__:
+                    return f"{key_path} is missing"
+                continue
+            error = validate(value[key], key_type, key_path)
+            if error is not None:
+                return error
+        return None
+
+    if t is NONE_TYPE:
+        if value is not None:
+            return f"{path} should be null"
+        return None
+
+    # bool is a subclass of int, but true and false are not counts
+    if not isinstance(value, t) or (t is int and isinstance(value, bool)):
+        return f"{path} should be a {t.__name__}"
+    return None
+
+
+def document_id(kind: str, doc: dict) -> ObjectId:
+    """
+    Derive an `_id` from a document, the same every time it is loaded.
+
+    Users are identified by their username, posts by their whole content, so
+    loading a file twice, or the same post from two files, inserts it once.
+
+    :param kind: collection the document belongs to
+    :param doc: decoded document, without an `_id`
+    :return: the `_id`
+    """
+    if kind == DB_USERS:
+        identity = doc["username"]
+    else:
+        identity = json.dumps(doc, sort_keys=True, ensure_ascii=False)
+    return ObjectId(hashlib.sha1(identity.encode()).digest()[:12])
+
+
+def _derive(kind: str, doc: dict) -> dict:
+    if kind == DB_USERS:
+        return derived.user_fields(doc)
+    return {**derived.post_fields(doc), **derived.hashtag_fields(doc)}
+
+
+class Chunk(NamedTuple):
+    documents: list
+    # line number and reason of every line that was left out
+    invalid: list
+
+
+def parse_chunk(kind: str, lines: list[bytes], first_line: int) -> Chunk:
+    """
+    Decode, validate and complete the documents of a chunk of an NDJSON dump.
+
+    :param kind: collection the documents belong to
+    :param lines: raw lines of the dump
+    :param first_line: line number of the first line, counting from 1
+    :return: the documents ready to insert, and the lines that were not valid
+    """
+    schema = SCHEMAS[kind]
+    documents = []
+    invalid = []
+    for line_number, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            doc = json.loads(line)
+        except ValueError as err:
+            invalid.append((line_number, f"not JSON: {err}"))
+            continue
+
+        error = validate(doc, schema)
+        if error is not None:
+            invalid.append((line_number, error))
+            continue
+
+        # an `_id` from the dump is dropped for one that is stable across loads
+        doc.pop("_id", None)
+        doc["_id"] = document_id(kind, doc)
+        doc.update(_derive(kind, doc))
+        documents.append(doc)
+
+    return Chunk(documents, invalid)
+
+
+def insert(collection: Collection, documents: list) -> int:
+    """
+    Insert documents in one unordered batch, skipping those already loaded.
+
+    :param collection: collection to insert into
+    :param documents: documents to insert
+    :return: number of documents inserted
+    """
+    if not documents:
+        return 0
+
+    try:
+        return len(collection.insert_many(documents, ordered=False).inserted_ids)
+    except BulkWriteError as err:
+        errors = err.details["writeErrors"]
+        if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        return err.details["nInserted"]
+
+
+# each worker process has its own client, set up by `_init_worker`
+_worker_collection: Optional[Collection] = None
+
+
+def _init_worker(mongo_uri: str, kind: str) -> None:
+    global _worker_collection
+    _worker_collection = MongoClient(mongo_uri).get_default_database()[kind]
+
+
+def _load_chunk(kind: str, lines: list[bytes], first_line: int) -> tuple[int, list]:
+    documents, invalid = parse_chunk(kind, lines, first_line)
+    return insert(_worker_collection, documents), invalid
+
+
+def open_dump(path: str) -> Union[IO[bytes], gzip.GzipFile]:
+    """
+    Open an NDJSON dump for reading, optionally gzipped.
+
+    :param path: path of the dump, gzipped if it ends in `.gz`
+    :return: the dump's lines, as bytes
+    """
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _chunks(lines: Iterator[bytes], skip: int, size: int) -> Iterator[list[bytes]]:
+    for _ in range(skip):
+        if next(lines, None) is None:
+            return
+
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _checkpoint_id(kind: str, path: str) -> str:
+    return f"{CHECKPOINT_PREFIX}:{kind}:{os.path.basename(path)}"
+
+
+def read_checkpoint(db: Database, kind: str, path: str) -> int:
+    checkpoint = db[DB_META].find_one({"_id": _checkpoint_id(kind, path)})
+    return checkpoint["lines"] if checkpoint is not None else 0
+
+
+def write_checkpoint(db: Database, kind: str, path: str, lines: int) -> None:
+    db[DB_META].update_one(
+        {"_id": _checkpoint_id(kind, path)}, {"$set": {"lines": lines}}, upsert=True
+    )
+
+
+class Progress:
+    """Tallies a load and logs how far it has got."""
+
+    def __init__(self, path: str, lines: int):
+        self.path = path
+        self.lines = lines
+        self.inserted = 0
+        self.invalid = 0
+        self._start = time.monotonic()
+        self._start_lines = lines
+
+    def add(self, lines: int, inserted: int, invalid: list) -> None:
+        self.lines += lines
+        self.inserted += inserted
+        self.invalid += len(invalid)
+        for line_number, error in invalid:
+            logger.warning(f"{self.path}:{line_number}: {error}")
+
+    def log(self) -> None:
+        elapsed = time.monotonic() - self._start
+        rate = (self.lines - self._start_lines) / elapsed if elapsed else 0
+        logger.info(
+            f"{self.path}: {self.lines} lines read, {self.inserted} inserted, "
+            f"{self.invalid} invalid ({rate:.0f} lines/s)"
+        )
+
+
+def load_file(
+    db: Database,
+    kind: str,
+    path: str,
+    pool: Executor,
+    max_pending: int,
+    chunk_size: int = CHUNK_SIZE,
+) -> Progress:
+    """
+    Load an NDJSON dump, optionally gzipped, resuming where a previous load stopped.
+
+    Chunks are parsed and inserted by the pool's workers. The checkpoint only
+    moves past a chunk once it and every chunk before it are in, so chunks
+    loaded after it are loaded again on resume, and skipped as duplicates.
+
+    :param db: database to load into
+    :param kind: collection to load into, `posts` or `users`
+    :param path: path of the dump
+    :param pool: worker processes, set up with `_init_worker`
+    :param max_pending: chunks handed to the pool at once, bounding the lines
+                        held in memory
+    :param chunk_size: lines per chunk
+    :return: the totals for the file
+    """
+    skip = read_checkpoint(db, kind, path)
+    if skip:
+        logger.info(f"{path}: resuming after line {skip}")
+    progress = Progress(path, skip)
+
+    pending: deque[tuple[int, Future]] = deque()
+
+    def finish_oldest() -> None:
+        lines, future = pending.popleft()
+        inserted, invalid = future.result()
+        progress.add(lines, inserted, invalid)
+        write_checkpoint(db, kind, path, progress.lines)
+        progress.log()
+
+    with open_dump(path) as f:
+        first_line = skip + 1
+        for chunk in _chunks(iter(f), skip, chunk_size):
+            if len(pending) == max_pending:
+                finish_oldest()
+            pending.append(
+                (len(chunk), pool.submit(_load_chunk, kind, chunk, first_line))
+            )
+            first_line += len(chunk)
+
+    while pending:
+        finish_oldest()
+    return progress
+
+
+def create_pool(mongo_uri: str, kind: str, workers: int) -> ProcessPoolExecutor:
+    # spawned rather than forked, so no worker inherits the parent's client
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(mongo_uri, kind),
+    )
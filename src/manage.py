@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Iterator
+
+from pymongo import MongoClient
+
+import derived
+import ingest
+import meta
+import prerender
+import sqlitebackend
+import textsearch
+import trigrams
+from config import MONGO_URI, PRERENDER_DIR, SQLITE_PATH
+from constants import (
+    DB_HASHTAGS,
+    DB_POST_TRIGRAMS,
+    DB_POSTS,
+    DB_USER_TRIGRAMS,
+    DB_USERS,
+    POST_CONTENT_FIELDS,
+    USER_CONTENT_FIELDS,
+)
+
+
+def build_trigram_index(db, args: argparse.Namespace):
+    trigrams.build_index(
+        db[DB_POSTS], db[DB_POST_TRIGRAMS], POST_CONTENT_FIELDS, args.batch_size
+    )
+    meta.add_feature(db, meta.POST_TRIGRAMS)
+
+
+def build_user_indexes(db, args: argparse.Namespace):
+    derived.backfill_users(db[DB_USERS], args.batch_size)
+    meta.add_feature(db, meta.USER_LOWERCASE_FIELDS)
+
+    trigrams.build_index(
+        db[DB_USERS], db[DB_USER_TRIGRAMS], USER_CONTENT_FIELDS, trigrams.BATCH_SIZE
+    )
+    meta.add_feature(db, meta.USER_TRIGRAMS)
+
+
+def build_participants(db, args: argparse.Namespace):
+    derived.backfill_posts(db[DB_POSTS], args.batch_size)
+    meta.add_feature(db, meta.POST_PARTICIPANTS)
+
+
+def build_hashtags(db, args: argparse.Namespace):
+    derived.backfill_hashtags(db[DB_POSTS], db[DB_HASHTAGS], args.batch_size)
+    meta.add_feature(db, meta.POST_HASHTAGS)
+
+
+def build_text_index(db, args: argparse.Namespace):
+    textsearch.build_index(db[DB_POSTS])
+    meta.add_feature(db, meta.POST_TEXT_INDEX)
+
+
+def set_dataset_version(db, args: argparse.Namespace):
+    version = args.version or datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    meta.set_dataset_version(db, version)
+    logging.info(f"Dataset version set to {version}")
+
+
+def index_posts(db):
+    derived.index_posts(db[DB_POSTS])
+    meta.add_feature(db, meta.POST_PARTICIPANTS)
+    derived.index_hashtags(db[DB_POSTS], db[DB_HASHTAGS])
+    meta.add_feature(db, meta.POST_HASHTAGS)
+    textsearch.build_index(db[DB_POSTS])
+    meta.add_feature(db, meta.POST_TEXT_INDEX)
+    trigrams.build_index(db[DB_POSTS], db[DB_POST_TRIGRAMS], POST_CONTENT_FIELDS)
+    meta.add_feature(db, meta.POST_TRIGRAMS)
+
+
+def index_users(db):
+    derived.index_users(db[DB_USERS])
+    meta.add_feature(db, meta.USER_LOWERCASE_FIELDS)
+    trigrams.build_index(db[DB_USERS], db[DB_USER_TRIGRAMS], USER_CONTENT_FIELDS)
+    meta.add_feature(db, meta.USER_TRIGRAMS)
+
+
+# indexes built from the whole collection, which miss documents loaded since
+STALE_FEATURES = {
+    DB_POSTS: (meta.POST_TRIGRAMS, meta.POST_HASHTAGS),
+    DB_USERS: (meta.USER_TRIGRAMS,),
+}
+
+
+def ingest_dumps(db, args: argparse.Namespace):
+    # searches stop relying on them until they are rebuilt below, or by hand
+    # after loading with --skip-indexes
+    for feature in STALE_FEATURES[args.kind]:
+        meta.remove_feature(db, feature)
+
+    inserted = 0
+    with ingest.create_pool(MONGO_URI, args.kind, args.workers) as pool:
+        for path in args.paths:
+            progress = ingest.load_file(
+                db, args.kind, path, pool, 2 * args.workers, args.chunk_size
+            )
+            inserted += progress.inserted
+
+    if args.skip_indexes:
+        return
+    if args.kind == DB_POSTS:
+        index_posts(db)
+    else:
+        index_users(db)
+    if inserted:
+        set_dataset_version(db, argparse.Namespace(version=None))
+
+
+def build_sqlite(db, args: argparse.Namespace):
+    inserted = sqlitebackend.build(args.path, args.kind, args.paths, args.chunk_size)
+    logging.info(f"Loaded {inserted} {args.kind} into {args.path}")
+
+
+def _read_logs(paths: list[str]) -> Iterator[str]:
+    for path in paths:
+        if path.endswith(".gz"):
+            with gzip.open(path, "rt", errors="replace") as gzipped:
+                yield from gzipped
+        else:
+            with open(path, errors="replace") as f:
+                yield from f
+
+
+async def _prerender(searches: list[str], directory: str) -> int:
+    # imported here as the app connects to MongoDB and redis as it starts serving
+    from app import app
+
+    async with app.test_app():
+        return await prerender.prerender(app, searches, directory)
+
+
+def prerender_searches(db, args: argparse.Namespace):
+    if not args.directory:
+        raise SystemExit("Set PRERENDER_DIR or pass --directory")
+
+    searches = prerender.top_searches(_read_logs(args.logs), args.top)
+    rendered = asyncio.run(_prerender(searches, args.directory))
+    logging.info(f"Prerendered {rendered} of the {len(searches)} top searches")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Maintenance commands for the Parler archive."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    trigram_parser = subparsers.add_parser(
+        "build-trigram-index",
+        help="Build the trigram postings used to narrow content searches.",
+    )
+    trigram_parser.add_argument("--batch-size", type=int, default=trigrams.BATCH_SIZE)
+    trigram_parser.set_defaults(handler=build_trigram_index)
+
+    participants_parser = subparsers.add_parser(
+        "build-participants",
+        help="Add the participants and mentions of each post used by username searches.",
+    )
+    participants_parser.add_argument(
+        "--batch-size", type=int, default=derived.BATCH_SIZE
+    )
+    participants_parser.set_defaults(handler=build_participants)
+
+    hashtags_parser = subparsers.add_parser(
+        "build-hashtags",
+        help="Add the hashtags of each post and count the posts using each one.",
+    )
+    hashtags_parser.add_argument("--batch-size", type=int, default=derived.BATCH_SIZE)
+    hashtags_parser.set_defaults(handler=build_hashtags)
+
+    users_parser = subparsers.add_parser(
+        "build-user-indexes",
+        help="Add the case-folded fields and trigram index used by user searches.",
+    )
+    users_parser.add_argument("--batch-size", type=int, default=derived.BATCH_SIZE)
+    users_parser.set_defaults(handler=build_user_indexes)
+
+    text_parser = subparsers.add_parser(
+        "build-text-index",
+        help="Build the text index used by word searches.",
+    )
+    text_parser.set_defaults(handler=build_text_index)
+
+    ingest_parser = subparsers.add_parser(
+        "ingest",
+        help="Load NDJSON dumps, optionally gzipped, with their derived fields.",
+    )
+    ingest_parser.add_argument("kind", choices=[DB_POSTS, DB_USERS])
+    ingest_parser.add_argument("paths", nargs="+")
+    ingest_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ingest_parser.add_argument("--chunk-size", type=int, default=ingest.CHUNK_SIZE)
+    ingest_parser.add_argument(
+        "--skip-indexes",
+        action="store_true",
+        help="Leave building the search indexes until the last dump is loaded.",
+    )
+    ingest_parser.set_defaults(handler=ingest_dumps)
+
+    sqlite_parser = subparsers.add_parser(
+        "build-sqlite",
+        help="Load NDJSON dumps into a SQLite database for SEARCH_BACKEND=sqlite.",
+    )
+    sqlite_parser.add_argument("kind", choices=[DB_POSTS, DB_USERS])
+    sqlite_parser.add_argument("paths", nargs="+")
+    sqlite_parser.add_argument("--path", default=SQLITE_PATH)
+    sqlite_parser.add_argument("--chunk-size", type=int, default=ingest.CHUNK_SIZE)
+    sqlite_parser.set_defaults(handler=build_sqlite)
+
+    prerender_parser = subparsers.add_parser(
+        "prerender",
+        help="Render the searches most requested in access logs ahead of time.",
+    )
+    prerender_parser.add_argument("logs", nargs="+")
+    prerender_parser.add_argument("--top", type=int, default=100)
+    prerender_parser.add_argument("--directory", default=PRERENDER_DIR)
+    prerender_parser.set_defaults(handler=prerender_searches)
+
+    version_parser = subparsers.add_parser(
+        "set-dataset-version",
+        help="Record a new dataset version, invalidating cached search results.",
+    )
+    version_parser.add_argument(
+        "version", nargs="?", help="Defaults to the current UTC time."
+    )
+    version_parser.set_defaults(handler=set_dataset_version)
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = MongoClient(MONGO_URI).get_default_database()
+    args.handler(db, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import logging
+
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+
+from constants import DB_META
+
+
+logger = logging.getLogger(__name__)
+
+DATASET_META_ID = "dataset"
+
+# optional features that offline builders record once their data is in place
+POST_TRIGRAMS = "post_trigrams"
+POST_PARTICIPANTS = "post_participants"
+POST_TEXT_INDEX = "post_text_index"
+POST_HASHTAGS = "post_hashtags"
+USER_TRIGRAMS = "user_trigrams"
+USER_LOWERCASE_FIELDS = "user_lowercase_fields"
+
+_features: set[str] = set()
+_dataset_version = ""
+
+
+def has_feature(name: str) -> bool:
+    return name in _features
+
+
+def dataset_version() -> str:
+    """
+    Identify the loaded dump, anything derived from the archive can be cached under it.
+
+    :return: the version recorded by the last load, empty if none was recorded
+    """
+    return _dataset_version
+
+
+async def refresh(db) -> None:
+    """
+    Reload the dataset metadata document written by the offline builders.
+
+    :param db: A Motor database.
+    :return:
+    """
+    try:
+        doc = await db[DB_META].find_one({"_id": DATASET_META_ID})
+    except PyMongoError as err:
+        logger.error(f"Failure loading dataset metadata: {err}")
+        return
+
+    doc = doc or {}
+    load(set(doc.get("features", [])), str(doc.get("version", "")))
+
+
+def load(features: set[str], version: str) -> None:
+    """
+    Replace the dataset metadata, for search backends other than MongoDB.
+
+    :param features: names of the features built
+    :param version: version of the loaded dump
+    """
+    global _features, _dataset_version
+
+    _features = features
+    _dataset_version = version
+
+
+def add_feature(db: Database, name: str) -> None:
+    db[DB_META].update_one(
+        {"_id": DATASET_META_ID}, {"$addToSet": {"features": name}}, upsert=True
+    )
+
+
+def remove_feature(db: Database, name: str) -> None:
+    db[DB_META].update_one({"_id": DATASET_META_ID}, {"$pull": {"features": name}})
+
+
+def set_dataset_version(db: Database, version: str) -> None:
+    db[DB_META].update_one(
+        {"_id": DATASET_META_ID}, {"$set": {"version": version}}, upsert=True
+    )
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Awaitable, TypeVar
+
+from bson import SON, json_util
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.registry import REGISTRY
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+from quart_rate_limiter.store import RateLimiterStoreABC
+
+from config import SEARCH_TIMEOUT_MS, SLOW_QUERY_SECONDS
+
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger(f"{__name__}.slow_queries")
+
+# mongo and redis round trips are mostly well under a second, renders and
+# unindexed searches are not
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+EXAMINED_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+NAMESPACE = "parler"
+
+search_phase_seconds = Histogram(
+    "search_phase_seconds",
+    "Time spent in each phase of a search.",
+    ["collection", "phase"],
+    buckets=BUCKETS,
+    namespace=NAMESPACE,
+)
+view_phase_seconds = Histogram(
+    "view_phase_seconds",
+    "Time spent in each phase of a view.",
+    ["view", "phase"],
+    buckets=BUCKETS,
+    namespace=NAMESPACE,
+)
+mongo_command_seconds = Histogram(
+    "mongo_command_seconds",
+    "Duration of MongoDB commands.",
+    ["command"],
+    buckets=BUCKETS,
+    namespace=NAMESPACE,
+)
+rate_limit_store_seconds = Histogram(
+    "rate_limit_store_seconds",
+    "Duration of rate limiter store operations.",
+    ["operation"],
+    buckets=BUCKETS,
+    namespace=NAMESPACE,
+)
+slow_query_docs_examined = Histogram(
+    "slow_query_docs_examined",
+    "Documents examined by slow queries, from their explain plans.",
+    ["collection"],
+    buckets=EXAMINED_BUCKETS,
+    namespace=NAMESPACE,
+)
+slow_query_keys_examined = Histogram(
+    "slow_query_keys_examined",
+    "Index keys examined by slow queries, from their explain plans.",
+    ["collection"],
+    buckets=EXAMINED_BUCKETS,
+    namespace=NAMESPACE,
+)
+result_cache_lookups = Counter(
+    "result_cache_lookups",
+    "Result cache lookups, by the tier that answered them.",
+    ["outcome"],
+    namespace=NAMESPACE,
+)
+
+
+async def timed(histogram: Histogram, aw: Awaitable[T]) -> T:
+    start = time.perf_counter()
+    try:
+        return await aw
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Records the duration of every command sent to MongoDB."""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        mongo_command_seconds.labels(event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        mongo_command_seconds.labels(event.command_name).observe(
+            event.duration_micros / 1e6
+        )
+
+
+class TimedStore(RateLimiterStoreABC):
+    """Wraps a rate limiter store, recording how long its round trips take."""
+
+    def __init__(self, store: RateLimiterStoreABC):
+        self.store = store
+
+    async def before_serving(self) -> None:
+        await self.store.before_serving()
+
+    async def get(self, key: str, default: datetime) -> datetime:
+        return await timed(
+            rate_limit_store_seconds.labels("get"), self.store.get(key, default)
+        )
+
+    async def set(self, key: str, tat: datetime) -> None:
+        await timed(rate_limit_store_seconds.labels("set"), self.store.set(key, tat))
+
+    async def after_serving(self) -> None:
+        await self.store.after_serving()
+
+
+async def _explain(collection, find: dict, elapsed: float) -> None:
+    # executionStats runs the winning plan once more, without trying the others
+    command = SON(
+        [
+            ("explain", SON([("find", collection.name), *find.items()])),
+            ("verbosity", "executionStats"),
+            ("maxTimeMS", SEARCH_TIMEOUT_MS),
+        ]
+    )
+    try:
+        plan = await collection.database.command(command)
+    except PyMongoError as err:
+        logger.error(f"Failure explaining slow query: {err}")
+        return
+
+    stats = plan.get("executionStats", {})
+    slow_query_docs_examined.labels(collection.name).observe(
+        stats.get("totalDocsExamined", 0)
+    )
+    slow_query_keys_examined.labels(collection.name).observe(
+        stats.get("totalKeysExamined", 0)
+    )
+    slow_query_logger.warning(
+        f"{collection.name} query took {elapsed:.3f}s: "
+        f"{json_util.dumps({'find': find, 'plan': plan})}"
+    )
+
+
+def check_slow_query(collection, find: dict, elapsed: float) -> None:
+    """
+    Explain and log a query in the background if it ran slower than configured.
+
+    Command replies do not say how much work a query did, so the documents
+    and keys examined are taken from the plan instead.
+
+    :param collection: Motor collection that was queried
+    :param find: fields of the find command that was run, e.g. `filter`,
+                 `sort`, `skip` and `limit`
+    :param elapsed: how long the query took, in seconds
+    """
+    if SLOW_QUERY_SECONDS and elapsed >= SLOW_QUERY_SECONDS:
+        asyncio.ensure_future(_explain(collection, find, elapsed))
+
+
+def latest() -> tuple[bytes, str]:
+    """
+    Render every metric in the Prometheus text format.
+
+    With `PROMETHEUS_MULTIPROC_DIR` set, metrics from every worker are combined.
+
+    :return: the body and its content type
+    """
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
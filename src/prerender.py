@@ -0,0 +1,133 @@
+import logging
+import os
+import re
+from collections import Counter
+from typing import Iterable
+from urllib.parse import parse_qsl, urlsplit
+
+from quart import Quart
+from werkzeug.datastructures import MultiDict
+
+import httpcache
+import meta
+import warmup
+from constants import (
+    CURSOR_QUERY_PARAM,
+    PAGE_QUERY_PARAM,
+    POSTS_PATH_COMPONENT,
+    SEARCH_CONTENT_QUERY_PARAM,
+    USERNAME_QUERY_PARAM,
+    USERS_PATH_COMPONENT,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# the request line and status of common and combined format access logs, as
+# written by hypercorn and nginx
+ACCESS_LOG_REGEX = re.compile(r'"GET (?P<target>\S+) HTTP/[\d.]+" (?P<status>\d{3}) ')
+
+SEARCH_PATHS = frozenset({f"/{POSTS_PATH_COMPONENT}", f"/{USERS_PATH_COMPONENT}"})
+
+SEARCH_PARAMS = (USERNAME_QUERY_PARAM, SEARCH_CONTENT_QUERY_PARAM)
+
+# 304s are searches the app answered too, they were only cached by the client
+COUNTED_STATUSES = frozenset({"200", "304"})
+
+
+def first_page_search(target: str) -> str:
+    """
+    Put a request target in canonical form, if it is the first page of a search.
+
+    :param target: path and query string of a request
+    :return: the target with its params sorted, empty if it is not a search
+             or not its first page
+    """
+    parts = urlsplit(target)
+    path = parts.path.rstrip("/")
+    if path not in SEARCH_PATHS:
+        return ""
+
+    args = MultiDict(parse_qsl(parts.query, keep_blank_values=True))
+    if not any(args.get(param) for param in SEARCH_PARAMS):
+        return ""
+    if args.get(CURSOR_QUERY_PARAM) or args.get(PAGE_QUERY_PARAM, "0") != "0":
+        return ""
+    return f"{path}?{httpcache.canonical_args(args)}"
+
+
+def top_searches(lines: Iterable[str], n: int) -> list[str]:
+    """
+    Find the searches most often requested in access logs.
+
+    :param lines: lines of access logs
+    :param n: number of searches to find
+    :return: the first pages of the most requested searches, most requested first
+    """
+    counts: Counter = Counter()
+    for line in lines:
+        match = ACCESS_LOG_REGEX.search(line)
+        if match is None or match["status"] not in COUNTED_STATUSES:
+            continue
+        search = first_page_search(match["target"])
+        if search:
+            counts[search] += 1
+    return [search for search, _ in counts.most_common(n)]
+
+
+def _write(path: str, body: bytes) -> None:
+    # renamed into place, so a page is never served half written
+    partial_path = f"{path}.tmp"
+    with open(partial_path, "wb") as f:
+        f.write(body)
+    os.replace(partial_path, path)
+
+
+async def prerender(app: Quart, searches: list[str], directory: str) -> int:
+    """
+    Render searches to files the app serves in place of rendering them again.
+
+    Snapshots of searches no longer among those given, or of a previous
+    dataset version, are removed. Must run in the same release as the app
+    serving the snapshots, as they are named by tags that include the templates.
+
+    :param app: app to render the searches with, already serving
+    :param searches: paths with their query strings, see `top_searches`
+    :param directory: directory to render the searches into
+    :return: number of searches rendered
+    """
+    version = meta.dataset_version()
+    if not version:
+        # pages are only cached once they are tied to a version of the dataset
+        raise ValueError("No dataset version is recorded")
+
+    os.makedirs(directory, exist_ok=True)
+    release = httpcache.templates_digest(app)
+    client = app.test_client()
+    kept = set()
+    rendered = 0
+    for i, search in enumerate(searches):
+        parts = urlsplit(search)
+        args = MultiDict(parse_qsl(parts.query, keep_blank_values=True))
+        tag = httpcache.etag(version, release, parts.path, args)
+        path = httpcache.snapshot_path(directory, tag)
+        kept.add(os.path.basename(path))
+        if os.path.exists(path):
+            continue
+
+        response = await warmup.get_in_process(client, search, "prerender", i)
+        body = await response.get_data(as_text=False)
+        if response.get_etag()[0] != tag:
+            # not a page clients may cache, such as partial results
+            logger.warning(f"Not prerendering {search}: {response.status_code}")
+            kept.discard(os.path.basename(path))
+            continue
+
+        _write(path, body)
+        rendered += 1
+        logger.info(f"Prerendered {search}")
+
+    for name in os.listdir(directory):
+        if name.endswith(".html") and name not in kept:
+            os.remove(os.path.join(directory, name))
+    return rendered
@@ -0,0 +1,83 @@
+import re
+from typing import Any, Optional
+
+from bson.regex import Regex
+
+
+# fields with an index on them, see `derived` and the default `_id` index
+INDEXED_FIELDS = frozenset(
+    {"_id", "participants", "mentions", "hashtags", "username_lower", "name_lower"}
+)
+
+# costs relative to looking a value up in an index
+INDEX_SEEK_COST = 1.0
+# an unanchored regex on an indexed field reads every key, but no documents
+INDEX_SCAN_COST = 4.0
+# a $text search seeks each of its words in the text index, then scores the posts
+TEXT_SEARCH_COST = 2.0
+# each field matched by reading every document in the collection
+COLLECTION_SCAN_COST = 10.0
+
+
+def _regex_pattern(condition: Any) -> Optional[str]:
+    if isinstance(condition, (re.Pattern, Regex)):
+        if condition.flags & re.IGNORECASE:
+            # case-insensitive regexes are never answered by seeking
+            return None
+        return condition.pattern
+    if isinstance(condition, dict) and "$regex" in condition:
+        if "i" in condition.get("$options", ""):
+            return None
+        return condition["$regex"]
+    return None
+
+
+def _is_regex(condition: Any) -> bool:
+    return isinstance(condition, (re.Pattern, Regex)) or (
+        isinstance(condition, dict) and "$regex" in condition
+    )
+
+
+def _field_cost(field: str, condition: Any) -> float:
+    if field not in INDEXED_FIELDS:
+        return COLLECTION_SCAN_COST
+    if not _is_regex(condition):
+        return INDEX_SEEK_COST
+
+    pattern = _regex_pattern(condition)
+    if pattern is not None and pattern.startswith("^"):
+        return INDEX_SEEK_COST
+    return INDEX_SCAN_COST
+
+
+def _cost(query: dict) -> float:
+    costs = []
+    for key, condition in query.items():
+        if key == "$or":
+            # every branch is answered separately
+            costs.append(sum(_cost(branch) for branch in condition))
+        elif key == "$text":
+            costs.append(TEXT_SEARCH_COST)
+        elif key == "$and":
+            # the cheapest branch narrows the documents the others are checked on
+            costs.append(min(_cost(branch) for branch in condition))
+        else:
+            costs.append(_field_cost(key, condition))
+
+    # conditions side by side are an implicit $and
+    return min(costs, default=COLLECTION_SCAN_COST)
+
+
+def query_cost(query: Optional[dict]) -> float:
+    """
+    Estimate how much work MongoDB does to answer a query from its shape.
+
+    An index lookup costs 1, every field matched by scanning the collection
+    costs `COLLECTION_SCAN_COST`.
+
+    :param query: query built by the search functions in `api`
+    :return: the estimated cost, 0 if there is no query to run
+    """
+    if query is None:
+        return 0.0
+    return _cost(query)
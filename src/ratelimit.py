@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from math import ceil
+from typing import Callable
+
+from quart_rate_limiter import RateLimitExceeded
+from quart_rate_limiter.store import RateLimiterStoreABC
+
+
+KEY_PREFIX = "cost"
+
+
+class CostLimiter:
+    """
+    Rate limits by the cost of each request rather than their number.
+
+    Uses the same GCRA as `quart_rate_limiter`, except that each request moves
+    the theoretical arrival time on by its cost. A request may cost at most
+    `limit`, so even the most expensive one is let through after a rest.
+    """
+
+    def __init__(
+        self,
+        store: Callable[[], RateLimiterStoreABC],
+        limit: float,
+        period: timedelta,
+    ):
+        self._store = store
+        self.limit = limit
+        self.period = period
+
+    async def charge(self, key: str, cost: float) -> None:
+        """
+        Spend part of a client's allowance, or reject the request.
+
+        :param key: identifies the client
+        :param cost: cost of the request
+        :raises RateLimitExceeded: if the client cannot afford it yet
+        """
+        store = self._store()
+        store_key = f"{KEY_PREFIX}-{key}"
+        now = datetime.utcnow()
+        tat = max(await store.get(store_key, now), now)
+        new_tat = tat + self.period * (min(cost, self.limit) / self.limit)
+
+        separation = new_tat - now
+        if separation > self.period:
+            raise RateLimitExceeded(ceil((separation - self.period).total_seconds()))
+
+        await store.set(store_key, new_tat)
@@ -0,0 +1,471 @@
+import asyncio
+import json
+import logging
+import pathlib
+import queue
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+
+import api
+import derived
+import ingest
+import meta
+import querycost
+from backend import SearchBackend
+from config import COMMENT_PAGE_SIZE, COMMENTS_PER_POST, COUNT_LIMIT
+from constants import DB_POSTS, POST_CONTENT_FIELDS, USER_CONTENT_FIELDS
+from enums import SearchBehavior, SearchMode
+from trigrams import field_values
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY,
+    oid TEXT NOT NULL UNIQUE,
+    document TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS post_participants (
+    username TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    PRIMARY KEY (username, post_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS post_mentions (
+    mention TEXT NOT NULL,
+    post_id INTEGER NOT NULL,
+    PRIMARY KEY (mention, post_id)
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS post_content USING fts5(
+    content, tokenize='trigram'
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    oid TEXT NOT NULL UNIQUE,
+    document TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS user_content USING fts5(
+    content, tokenize='trigram'
+);
+"""
+
+# joins the searched fields of a document, a search cannot match across it
+FIELD_SEPARATOR = "\x1f"
+
+# the trigram index only answers terms at least this long, shorter ones scan
+TRIGRAM_LENGTH = 3
+
+# fields added by `ingest`, kept in tables of their own rather than the documents
+DERIVED_FIELDS = (
+    "participants",
+    "mentions",
+    "hashtags",
+    "username_lower",
+    "name_lower",
+)
+
+VERSION_KEY = "version"
+
+
+def _searched_text(doc: dict, fields: tuple) -> str:
+    return FIELD_SEPARATOR.join(
+        value for field in fields for value in field_values(doc, field)
+    )
+
+
+def _insert(conn: sqlite3.Connection, kind: str, doc: dict) -> bool:
+    table, content_table, fields = (
+        ("posts", "post_content", POST_CONTENT_FIELDS)
+        if kind == DB_POSTS
+        else ("users", "user_content", USER_CONTENT_FIELDS)
+    )
+    participants = doc.get("participants", [])
+    mentions = doc.get("mentions", [])
+    oid = str(doc.pop("_id"))
+    for field in DERIVED_FIELDS:
+        doc.pop(field, None)
+
+    inserted = conn.execute(
+        f"INSERT OR IGNORE INTO {table} (oid, document) VALUES (?, ?)",
+        (oid, json.dumps(doc, ensure_ascii=False)),
+    )
+    if not inserted.rowcount:
+        # loaded before, from this dump or another
+        return False
+
+    row_id = inserted.lastrowid
+    conn.execute(
+        f"INSERT INTO {content_table} (rowid, content) VALUES (?, ?)",
+        (row_id, _searched_text(doc, fields)),
+    )
+    if kind == DB_POSTS:
+        conn.executemany(
+            "INSERT OR IGNORE INTO post_participants VALUES (?, ?)",
+            [(username, row_id) for username in participants],
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO post_mentions VALUES (?, ?)",
+            [(mention, row_id) for mention in mentions],
+        )
+    return True
+
+
+def build(
+    path: str, kind: str, dump_paths: list[str], chunk_size: int = ingest.CHUNK_SIZE
+) -> int:
+    """
+    Load NDJSON dumps into a SQLite database searched by `SQLiteBackend`.
+
+    Documents are validated and identified as `ingest` does, so loading a
+    dump twice inserts each document once. A new dataset version is recorded
+    when anything was inserted.
+
+    :param path: path of the database, created if missing
+    :param kind: collection the dumps hold, `posts` or `users`
+    :param dump_paths: paths of the dumps, optionally gzipped
+    :param chunk_size: lines parsed and inserted in one transaction
+    :return: number of documents inserted
+    """
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    inserted = 0
+    for dump_path in dump_paths:
+        with ingest.open_dump(dump_path) as f:
+            first_line = 1
+            while True:
+                lines = list(islice(f, chunk_size))
+                if not lines:
+                    break
+
+                documents, invalid = ingest.parse_chunk(kind, lines, first_line)
+                for line_number, error in invalid:
+                    logger.warning(f"{dump_path}:{line_number}: {error}")
+                with conn:
+                    inserted += sum(_insert(conn, kind, doc) for doc in documents)
+                first_line += len(lines)
+        logger.info(f"{dump_path}: {first_line - 1} lines read, {inserted} inserted")
+
+    with conn:
+        # merge the index segments written by each transaction
+        content_table = "post_content" if kind == DB_POSTS else "user_content"
+        conn.execute(
+            f"INSERT INTO {content_table} ({content_table}) VALUES ('optimize')"
+        )
+        if inserted:
+            version = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (VERSION_KEY, version)
+            )
+    conn.close()
+    return inserted
+
+
+class ConnectionPool:
+    """Read-only connections to a SQLite database, each used by one thread at a time."""
+
+    def __init__(self, path: str, size: int):
+        uri = f"{pathlib.Path(path).absolute().as_uri()}?mode=ro"
+        self._connections: queue.SimpleQueue = queue.SimpleQueue()
+        for _ in range(size):
+            self._connections.put(
+                sqlite3.connect(uri, uri=True, check_same_thread=False)
+            )
+        # SQLite lets go of the GIL while it runs a statement, so the threads
+        # search in parallel
+        self._executor = ThreadPoolExecutor(size)
+        self._size = size
+
+    def _call(self, f: Callable, args: tuple) -> Any:
+        conn = self._connections.get()
+        try:
+            return f(conn, *args)
+        finally:
+            self._connections.put(conn)
+
+    async def run(self, f: Callable, *args: Any) -> Any:
+        """
+        Call a function with a connection, on a thread of the pool.
+
+        :param f: function taking a connection and `args`
+        :return: what the function returned
+        """
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, self._call, f, args
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown()
+        for _ in range(self._size):
+            self._connections.get().close()
+
+
+class Condition(NamedTuple):
+    # SQL selecting the ids of matching rows
+    sql: str
+    params: tuple
+    cost: float
+
+
+def _content_condition(table: str, term: str) -> Condition:
+    if len(term) >= TRIGRAM_LENGTH:
+        # a quoted phrase of trigrams matches the term anywhere in the content
+        phrase = '"' + term.replace('"', '""') + '"'
+        return Condition(
+            f"SELECT rowid FROM {table} WHERE {table} MATCH ?",
+            (phrase,),
+            querycost.INDEX_SEEK_COST,
+        )
+
+    pattern = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return Condition(
+        f"SELECT rowid FROM {table} WHERE content LIKE ? ESCAPE '\\'",
+        (f"%{pattern}%",),
+        querycost.COLLECTION_SCAN_COST,
+    )
+
+
+def _combine(conditions: list, behavior: SearchBehavior) -> Condition:
+    if len(conditions) == 1:
+        return conditions[0]
+    operator = " UNION " if behavior == SearchBehavior.MATCH_ANY else " INTERSECT "
+    # as in `querycost`, every branch of an or is answered, the cheapest of an
+    # and narrows the others
+    costs = [condition.cost for condition in conditions]
+    cost = sum(costs) if behavior == SearchBehavior.MATCH_ANY else min(costs)
+    return Condition(
+        operator.join(f"SELECT * FROM ({condition.sql})" for condition in conditions),
+        tuple(param for condition in conditions for param in condition.params),
+        cost,
+    )
+
+
+def _posts_condition(
+    username: str, content: str, behavior: SearchBehavior, mentions: bool
+) -> Optional[Condition]:
+    user_conditions = []
+    if username:
+        formatted_username = api.normalize_username(username)
+        user_conditions.append(
+            Condition(
+                "SELECT post_id FROM post_participants WHERE username = ?",
+                (formatted_username,),
+                querycost.INDEX_SEEK_COST,
+            )
+        )
+        if mentions:
+            user_conditions.append(
+                Condition(
+                    "SELECT post_id FROM post_mentions WHERE mention = ?",
+                    (derived.mention_key(formatted_username),),
+                    querycost.INDEX_SEEK_COST,
+                )
+            )
+
+    conditions = []
+    if user_conditions:
+        # the user's own posts and their mentions are alternatives either way
+        conditions.append(_combine(user_conditions, SearchBehavior.MATCH_ANY))
+    if api.escape(content):
+        conditions.append(_content_condition("post_content", content))
+    if not conditions:
+        return None
+    return _combine(conditions, behavior)
+
+
+def _page_rows(
+    conn: sqlite3.Connection,
+    table: str,
+    condition: Condition,
+    page: int,
+    position: Optional[dict],
+) -> Tuple[list, int]:
+    seek = ""
+    order = "ASC"
+    offset = page * api.PAGE_LIMIT
+    params: tuple = condition.params
+    if position is not None:
+        offset = 0
+        if "after" in position:
+            seek = "AND id > ?"
+            params += (position["after"],)
+        else:
+            seek = "AND id < ?"
+            order = "DESC"
+            params += (position["before"],)
+
+    rows = conn.execute(
+        f"SELECT id, document FROM {table} WHERE id IN ({condition.sql}) {seek} "
+        f"ORDER BY id {order} LIMIT ? OFFSET ?",
+        params + (api.PAGE_LIMIT, offset),
+    ).fetchall()
+    if order == "DESC":
+        rows.reverse()
+
+    (total_count,) = conn.execute(
+        f"SELECT count(*) FROM (SELECT 1 FROM ({condition.sql}) LIMIT ?)",
+        # -1 is no limit
+        condition.params + (COUNT_LIMIT or -1,),
+    ).fetchone()
+    return rows, total_count
+
+
+def _comment_matches(
+    comment: dict, username: str, content: str, mentions: bool
+) -> bool:
+    # the same comments `api._posts_projection` keeps
+    if username and comment.get("username") == api.normalize_username(username):
+        return True
+    text = comment.get("text") or ""
+    if mentions and api.escape(username):
+        if re.search(api.mention_regex(username), text, re.IGNORECASE):
+            return True
+    return bool(api.escape(content)) and content.casefold() in text.casefold()
+
+
+def _post_result(row: tuple, username: str, content: str, mentions: bool) -> dict:
+    row_id, document = row
+    post = _with_comments_preview(json.loads(document), username, content, mentions)
+    if isinstance(post.get("echo"), dict):
+        _with_comments_preview(post["echo"], username, content, mentions)
+    post["_id"] = row_id
+    return post
+
+
+def _with_comments_preview(
+    post: dict, username: str, content: str, mentions: bool
+) -> dict:
+    comments = post.get("comments") or []
+    if username or api.escape(content):
+        shown = [
+            comment
+            for comment in comments
+            if _comment_matches(comment, username, content, mentions)
+        ]
+    else:
+        shown = comments
+    post["comments"] = [
+        {"username": comment.get("username"), "text": comment.get("text")}
+        for comment in shown[:COMMENTS_PER_POST]
+    ]
+    post["comments_total"] = len(comments)
+    return post
+
+
+def _user_result(row: tuple) -> dict:
+    row_id, document = row
+    return {**json.loads(document), "_id": row_id}
+
+
+def _search_results(
+    rows: list, total_count: int, page: int, to_result: Callable
+) -> api.SearchResults:
+    # counts stop at `COUNT_LIMIT`, past which the page count is a lower bound
+    exact = not COUNT_LIMIT or total_count < COUNT_LIMIT
+    page_count = api.page_count(total_count, exact, page)
+    return api.SearchResults(page_count, [to_result(row) for row in rows], exact)
+
+
+def _read_version(conn: sqlite3.Connection) -> str:
+    row = conn.execute(
+        "SELECT value FROM meta WHERE key = ?", (VERSION_KEY,)
+    ).fetchone()
+    return row[0] if row is not None else ""
+
+
+def _read_comments(
+    conn: sqlite3.Connection, post_id: int, offset: int, limit: int, echo: bool
+) -> Optional[Tuple[list, int]]:
+    row = conn.execute("SELECT document FROM posts WHERE id = ?", (post_id,)).fetchone()
+    if row is None:
+        return None
+    post = json.loads(row[0])
+    if echo:
+        post = post.get("echo") if isinstance(post.get("echo"), dict) else {}
+    comments = post.get("comments") or []
+    return [
+        {"username": comment.get("username"), "text": comment.get("text")}
+        for comment in comments[offset : offset + limit]
+    ], len(comments)
+
+
+class SQLiteBackend(SearchBackend):
+    """
+    Searches a SQLite database built by `build`, with no MongoDB needed.
+
+    Content is matched with FTS5's trigram tokenizer, which answers the same
+    case-insensitive substring searches as MongoDB's regexes. Words are not
+    stemmed, so word searches are answered as substring searches.
+    """
+
+    def __init__(self, path: str, pool_size: int):
+        self._pool = ConnectionPool(path, pool_size)
+
+    async def search_posts(
+        self,
+        username: str,
+        content: str,
+        page: int,
+        behavior: SearchBehavior,
+        mentions: bool,
+        cursor: Optional[str] = None,
+        charge: Optional[api.Charge] = None,
+        mode: SearchMode = SearchMode.SUBSTRING,
+    ) -> api.SearchResults:
+        condition = _posts_condition(username, content, behavior, mentions)
+        if condition is None:
+            return api.SearchResults(0, [])
+        if charge is not None:
+            await charge(condition.cost)
+
+        position = api.decode_cursor(cursor, page) if cursor else None
+        rows, total_count = await self._pool.run(
+            _page_rows, "posts", condition, page, position
+        )
+        return _search_results(
+            rows,
+            total_count,
+            page,
+            lambda row: _post_result(row, username, content, mentions),
+        )
+
+    async def search_users(
+        self,
+        username: str,
+        page: int,
+        cursor: Optional[str] = None,
+        charge: Optional[api.Charge] = None,
+    ) -> api.SearchResults:
+        if not api.escape(username):
+            return api.SearchResults(0, [])
+        condition = _content_condition("user_content", username)
+        if charge is not None:
+            await charge(condition.cost)
+
+        position = api.decode_cursor(cursor, page) if cursor else None
+        rows, total_count = await self._pool.run(
+            _page_rows, "users", condition, page, position
+        )
+        return _search_results(rows, total_count, page, _user_result)
+
+    async def get_comments(
+        self, post_id: str, offset: int, echo: bool = False
+    ) -> Optional[Tuple[list, int]]:
+        try:
+            row_id = int(post_id)
+        except ValueError:
+            return None
+        return await self._pool.run(
+            _read_comments, row_id, offset, COMMENT_PAGE_SIZE, echo
+        )
+
+    async def refresh_meta(self) -> None:
+        # the indexes are all built with the database, so there are no features
+        meta.load(set(), await self._pool.run(_read_version))
+
+    async def close(self) -> None:
+        self._pool.close()
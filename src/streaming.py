@@ -0,0 +1,104 @@
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator
+
+from bson import json_util
+from quart import Response, current_app, stream_with_context
+from quart.wrappers.response import IterableBody
+
+
+# rendered chunks that may wait on a slow client before rendering pauses
+MAX_PENDING_CHUNKS = 64
+
+_DONE = object()
+
+
+async def _coalesce(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    """
+    Join together whatever has been rendered each time rendering has to wait.
+
+    Rendering runs ahead in its own task, so the client is sent one write per
+    wait on the database rather than one per template node.
+
+    :param chunks: rendered template chunks
+    :return: encoded chunks, as large as rendering allows without delaying them
+    """
+    queue: asyncio.Queue = asyncio.Queue(MAX_PENDING_CHUNKS)
+
+    async def render():
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+        except Exception as err:
+            await queue.put(err)
+        else:
+            await queue.put(_DONE)
+
+    renderer = asyncio.ensure_future(render())
+    try:
+        while True:
+            pending = [await queue.get()]
+            while not queue.empty():
+                pending.append(queue.get_nowait())
+
+            text = "".join(chunk for chunk in pending if isinstance(chunk, str))
+            if text:
+                yield text.encode()
+
+            if pending[-1] is _DONE:
+                return
+            if isinstance(pending[-1], Exception):
+                raise pending[-1]
+    finally:
+        # the client went away, stop rendering for it
+        renderer.cancel()
+
+
+async def stream_template(template_name: str, **context: Any) -> Response:
+    """
+    Render a template into a response that is sent while it renders.
+
+    Async iterables in the context are rendered as they yield, so a page of
+    results reaches the browser one result at a time.
+
+    :param template_name: template to render
+    :param context: variables for the template
+    :return: streamed response
+    """
+    await current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+
+    @stream_with_context
+    async def body() -> AsyncIterator[bytes]:
+        async for chunk in _coalesce(template.generate_async(context)):
+            yield chunk
+
+    return current_app.response_class(body(), mimetype="text/html")
+
+
+def stream_ndjson(batches: AsyncGenerator[list, None]) -> Response:
+    """
+    Send records as newline delimited JSON, in MongoDB's relaxed extended JSON.
+
+    Each batch is written in one go, and the next is only read once the client
+    has taken it, so a slow client slows the query down rather than using memory.
+    The batches are closed as soon as the response ends, or the client leaves.
+
+    :param batches: lists of records to send
+    :return: streamed response
+    """
+
+    async def body() -> AsyncGenerator[bytes, None]:
+        try:
+            async for batch in batches:
+                yield "".join(
+                    json_util.dumps(record, json_options=json_util.RELAXED_JSON_OPTIONS)
+                    + "\n"
+                    for record in batch
+                ).encode()
+        finally:
+            # rather than whenever the batches are garbage collected
+            await batches.aclose()
+
+    return current_app.response_class(
+        IterableBody(body()), mimetype="application/x-ndjson"
+    )
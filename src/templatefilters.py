@@ -1,8 +1,9 @@
 import re
+from functools import lru_cache
 from re import Match
 from typing import Any, Optional
 
-from quart import Quart, url_for
+from quart import Quart, request, url_for
 
 from constants import (
     INCLUDE_MENTIONS_QUERY_PARAM,
@@ -10,6 +11,7 @@ from constants import (
     SEARCH_CONTENT_QUERY_PARAM,
     USERNAME_QUERY_PARAM,
 )
+from textsearch import Highlighter
 
 
 SEARCH_LINK_TEMPLATE = '<a href="{url}">{text}</a>'
@@ -17,25 +19,41 @@ HIGHLIGHT_SEARCHED_TERM_TEMPLATE = "<mark>\\1</mark>"
 
 USERNAME_AND_HASHTAG_REGEX = re.compile(r"[@|#]\w+")
 
+# There are some users masked with a "Private User" username
+PRIVATE_USERNAME = "@Private"
 
-def _create_search_link(m: Match):
-    matched_word = m.group(0)
+# the same handful of usernames and hashtags turn up all over a page
+SEARCH_URL_CACHE_SIZE = 4096
 
-    # There are some users masked with a "Private User" username
-    if matched_word == "@Private":
-        return matched_word
 
-    if matched_word.startswith("@"):
+@lru_cache(maxsize=SEARCH_URL_CACHE_SIZE)
+def _cached_search_url(root_path: str, word: str) -> str:
+    # root_path is only part of the cache key, url_for reads it from the request
+    params: dict[str, Any]
+    if word.startswith("@"):
         params = {
-            USERNAME_QUERY_PARAM: matched_word,
+            USERNAME_QUERY_PARAM: word,
             INCLUDE_MENTIONS_QUERY_PARAM: "true",
         }
     else:
-        params = {SEARCH_CONTENT_QUERY_PARAM: matched_word}
+        params = {SEARCH_CONTENT_QUERY_PARAM: word}
+
+    return url_for(POSTS_PATH_COMPONENT, **params)
+
+
+def _search_url(word: str) -> str:
+    return _cached_search_url(request.root_path, word)
+
+
+def _create_search_link(m: Match):
+    matched_word = m.group(0)
+
+    if matched_word == PRIVATE_USERNAME:
+        return matched_word
 
     # create hashtag link
     return SEARCH_LINK_TEMPLATE.format(
-        url=url_for(POSTS_PATH_COMPONENT, **params),
+        url=_search_url(matched_word),
         text=matched_word,
     )
 
@@ -55,17 +73,83 @@ def with_search_links(s: str):
     return with_links
 
 
-def with_highlighted_term(s: str, highlighter_regex: Optional[re.Pattern[Any]]):
+def with_highlighted_term(s: str, highlighter_regex: Optional[Highlighter]):
     if not s or highlighter_regex is None:
         return s
 
-    with_highlighted_terms = re.sub(
-        highlighter_regex, HIGHLIGHT_SEARCHED_TERM_TEMPLATE, s
-    )
+    with_highlighted_terms = highlighter_regex.sub(HIGHLIGHT_SEARCHED_TERM_TEMPLATE, s)
 
     return with_highlighted_terms
 
 
+def _marked(s: str, start: int, end: int, highlights: list, h: int) -> tuple:
+    # the part of the string between start and end, with the highlights from
+    # the h-th on cut to fit it
+    if start == end:
+        return "", h
+
+    out = []
+    i = start
+    while h < len(highlights) and highlights[h][0] < end:
+        highlight_start, highlight_end = highlights[h]
+        highlight_start = max(highlight_start, start)
+        out.append(s[i:highlight_start])
+        i = min(highlight_end, end)
+        out.append(f"<mark>{s[highlight_start:i]}</mark>")
+        if highlight_end > end:
+            # carries on past the end, into what comes next
+            break
+        h += 1
+    out.append(s[i:end])
+    return "".join(out), h
+
+
+def with_links_and_highlights(s: str, highlighter_regex: Optional[Highlighter] = None):
+    """
+    Link usernames and hashtags and highlight the searched term in a single pass.
+
+    The links and highlights are each found by their own regex, which can skip
+    ahead to where one starts, and written out in one walk over both.
+    Unlike chaining `with_search_links` and `with_highlighted_term`, the term is
+    only ever highlighted in the text itself, never inside a link's markup. A
+    highlight overlapping a link is split at the link's edges.
+
+    :param s: string to template links and highlights into
+    :param highlighter_regex: regex matching the searched term, if there is one
+    :return: string with links and highlights templated into it
+    """
+    if not s:
+        return s
+
+    highlights = []
+    if highlighter_regex is not None:
+        highlights = [
+            m.span() for m in highlighter_regex.finditer(s) if m.end() > m.start()
+        ]
+
+    out = []
+    i = h = 0
+    # looked up once, rather than for every link
+    root_path = None
+    for link in USERNAME_AND_HASHTAG_REGEX.finditer(s):
+        token = link.group(0)
+        if token == PRIVATE_USERNAME:
+            continue
+
+        text, h = _marked(s, i, link.start(), highlights, h)
+        out.append(text)
+        i = link.end()
+        text, h = _marked(s, link.start(), i, highlights, h)
+        if root_path is None:
+            root_path = request.root_path
+        url = _cached_search_url(root_path, token)
+        out.append(SEARCH_LINK_TEMPLATE.format(url=url, text=text))
+    text, _ = _marked(s, i, len(s), highlights, h)
+    out.append(text)
+
+    return "".join(out)
+
+
 def register_filters(app: Quart):
     """
     Register all filters with the main app.
@@ -75,3 +159,4 @@ def register_filters(app: Quart):
     """
     app.add_template_filter(with_search_links)
     app.add_template_filter(with_highlighted_term)
+    app.add_template_filter(with_links_and_highlights)
@@ -0,0 +1,103 @@
+import re
+from typing import Any, Callable, Iterator, Optional, Protocol, Union
+
+import snowballstemmer
+from pymongo import TEXT
+
+from constants import POST_TEXT_FIELDS
+
+
+# the language MongoDB stems and drops stop words for, see `build_index`
+LANGUAGE = "english"
+INDEX_NAME = "post_text"
+
+# a quoted phrase, a word, or either negated
+_TERM_REGEX = re.compile(r'(-?)(?:"([^"]*)"|(\S+))')
+_WORD_REGEX = re.compile(r"(\w+)")
+
+
+def build_index(collection) -> None:
+    """
+    Create the `$text` index used by word searches.
+
+    :param collection: PyMongo posts collection
+    """
+    collection.create_index(
+        [(field, TEXT) for field in POST_TEXT_FIELDS],
+        name=INDEX_NAME,
+        default_language=LANGUAGE,
+    )
+
+
+def text_query(search: str) -> dict:
+    return {"$text": {"$search": search, "$language": LANGUAGE}}
+
+
+def searched_words(search: str) -> list[str]:
+    """
+    List the words a `$text` search looks for, leaving out negated terms.
+
+    :param search: search string, in the `$search` syntax
+    :return: the words, in the case they were typed
+    """
+    words = []
+    for m in _TERM_REGEX.finditer(search):
+        negated, phrase, word = m.groups()
+        if not negated:
+            words.extend(_WORD_REGEX.findall(phrase if phrase is not None else word))
+    return words
+
+
+def words_regex(search: str) -> Optional[str]:
+    """
+    Build a regex roughly matching what a `$text` search matches, for MongoDB.
+
+    Words are matched by their beginning, which covers most of their stems.
+
+    :param search: search string, in the `$search` syntax
+    :return: the regex, None if nothing is searched for
+    """
+    words = searched_words(search)
+    if not words:
+        return None
+    return rf"\b(?:{'|'.join(re.escape(word) for word in words)})"
+
+
+class Highlighter(Protocol):
+    """What the template filters use of a regex matching the searched term."""
+
+    def finditer(self, string: str) -> Iterator[re.Match]:
+        ...
+
+    def sub(self, repl: Any, string: str) -> str:
+        ...
+
+
+class WordHighlighter:
+    """
+    Matches the words of a text that a `$text` search for some words matches.
+
+    Words match when they share a stem, as they do in MongoDB, so a search for
+    "running" highlights "runs". Only `finditer` and `sub` are provided, which
+    is all the template filters use of a highlighter regex.
+    """
+
+    def __init__(self, search: str):
+        self._stemmer = snowballstemmer.stemmer(LANGUAGE)
+        self._stems = frozenset(
+            self._stemmer.stemWords([w.casefold() for w in searched_words(search)])
+        )
+
+    def _matches(self, m: re.Match) -> bool:
+        return self._stemmer.stemWord(m.group(1).casefold()) in self._stems
+
+    def finditer(self, string: str) -> Iterator[re.Match]:
+        return (m for m in _WORD_REGEX.finditer(string) if self._matches(m))
+
+    def sub(self, repl: Union[str, Callable[[re.Match], str]], string: str) -> str:
+        def replace(m: re.Match) -> str:
+            if not self._matches(m):
+                return m.group(0)
+            return repl(m) if callable(repl) else m.expand(repl)
+
+        return _WORD_REGEX.sub(replace, string)
@@ -0,0 +1,191 @@
+import logging
+from collections import defaultdict
+from typing import Any, Iterable, Iterator, Optional
+
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+
+
+logger = logging.getLogger(__name__)
+
+TRIGRAM_LENGTH = 3
+
+# number of source documents whose postings are written out together, which
+# also bounds the size of every postings document well below the BSON limit
+BATCH_SIZE = 10000
+
+# only the rarest trigrams of a term are intersected, the regex check that
+# runs on the candidates takes care of the rest
+MAX_QUERY_TRIGRAMS = 4
+
+# a trigram with this many times more postings than there are candidates left
+# costs more to load than it saves the regex check, so it is skipped
+MAX_POSTINGS_RATIO = 10
+
+
+def trigrams(s: str) -> set[str]:
+    """
+    Break a string into its set of case-folded trigrams.
+
+    Whitespace is kept so that bounded searches like ` bong ` narrow the
+    candidates just as much as they narrow the regex.
+
+    :param s: string to break up
+    :return: every trigram appearing in the string
+    """
+    folded = s.casefold()
+    return {
+        folded[i : i + TRIGRAM_LENGTH] for i in range(len(folded) - TRIGRAM_LENGTH + 1)
+    }
+
+
+def _descend(value: Any, key: str) -> Iterator[Any]:
+    if isinstance(value, dict):
+        if key in value:
+            yield value[key]
+    elif isinstance(value, list):
+        for item in value:
+            if isinstance(item, dict) and key in item:
+                yield item[key]
+
+
+def field_values(doc: dict, path: str) -> Iterator[str]:
+    """
+    Yield every string stored under a dotted path.
+
+    Arrays are descended into the same way MongoDB does when it matches a
+    regex against the path, so the postings cover exactly what the query scans.
+
+    :param doc: document to read from
+    :param path: dotted field path, e.g. `media.title`
+    :return: the string values found at the path
+    """
+    values = [doc]
+    for key in path.split("."):
+        values = [child for value in values for child in _descend(value, key)]
+
+    for value in values:
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, list):
+            yield from (item for item in value if isinstance(item, str))
+
+
+def document_trigrams(doc: dict, fields: Iterable[str]) -> set[str]:
+    grams: set[str] = set()
+    for field in fields:
+        for value in field_values(doc, field):
+            grams |= trigrams(value)
+    return grams
+
+
+def _flush_postings(target: Collection, postings: dict[str, list]) -> None:
+    if not postings:
+        return
+
+    target.insert_many(
+        [
+            {"trigram": gram, "ids": ids, "count": len(ids)}
+            for gram, ids in postings.items()
+        ],
+        ordered=False,
+    )
+
+
+def build_index(
+    source: Collection,
+    target: Collection,
+    fields: Iterable[str],
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Write trigram -> document id postings for every document in a collection.
+
+    The postings are built in a staging collection which is renamed over the
+    target once complete, so searches never see a partially built index.
+
+    :param source: collection to index
+    :param target: collection to write the postings to
+    :param fields: dotted paths of the fields to index
+    :param batch_size: number of source documents per postings chunk
+    :return: number of documents indexed
+    """
+    fields = tuple(fields)
+    staging = target.database[f"{target.name}_build"]
+    staging.drop()
+
+    postings: dict[str, list] = defaultdict(list)
+    indexed = 0
+    cursor = (
+        source.find({}, {field: 1 for field in fields})
+        .sort("_id", ASCENDING)
+        .batch_size(batch_size)
+    )
+    for doc in cursor:
+        for gram in document_trigrams(doc, fields):
+            postings[gram].append(doc["_id"])
+
+        indexed += 1
+        if indexed % batch_size == 0:
+            _flush_postings(staging, postings)
+            postings = defaultdict(list)
+            logger.info(f"Indexed {indexed} {source.name}")
+
+    _flush_postings(staging, postings)
+    staging.create_index([("trigram", ASCENDING)])
+    staging.rename(target.name, dropTarget=True)
+    logger.info(f"Finished indexing {indexed} {source.name}")
+
+    return indexed
+
+
+async def find_candidates(postings, term: str, max_candidates: int) -> Optional[list]:
+    """
+    Find the ids of every document that could contain a term.
+
+    The result is a superset of the matching documents, it still needs to be
+    checked against the search regex.
+
+    :param postings: Motor collection holding the postings.
+    :param term: Substring being searched for.
+    :param max_candidates: Give up if even the rarest trigram matches more
+                           documents than this. No postings of a trigram
+                           matching more documents are ever loaded.
+    :return: Sorted candidate ids, or None if the index cannot narrow the search.
+    """
+    grams = trigrams(term)
+    if not grams:
+        return None
+
+    stats = await postings.aggregate(
+        [
+            {"$match": {"trigram": {"$in": sorted(grams)}}},
+            {"$group": {"_id": "$trigram", "count": {"$sum": "$count"}}},
+        ]
+    ).to_list(length=None)
+
+    if len(stats) < len(grams):
+        # at least one trigram of the term appears in no document at all
+        return []
+
+    rarest = sorted(stats, key=lambda stat: stat["count"])[:MAX_QUERY_TRIGRAMS]
+    if rarest[0]["count"] > max_candidates:
+        return None
+
+    candidates: Optional[set] = None
+    for stat in rarest:
+        if stat["count"] > max_candidates or (
+            candidates is not None
+            and stat["count"] > MAX_POSTINGS_RATIO * len(candidates)
+        ):
+            # the trigrams are rarest first, so every one left is skipped too
+            break
+
+        ids: set = set()
+        async for chunk in postings.find({"trigram": stat["_id"]}, {"ids": 1}):
+            ids.update(chunk["ids"])
+        candidates = ids if candidates is None else candidates & ids
+        if not candidates:
+            break
+
+    return sorted(candidates or [])
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import time
+
+from quart import Quart, Response
+from quart.typing import TestClientProtocol
+
+from config import READY_DIR, WORKERS
+
+
+logger = logging.getLogger(__name__)
+
+_ready = False
+
+
+def _marker_prefix() -> str:
+    # workers are recorded under the process that started them, so those of a
+    # previous run are not counted
+    return f"{os.getppid()}-"
+
+
+def _marker_path() -> str:
+    return os.path.join(READY_DIR, f"{_marker_prefix()}{os.getpid()}")
+
+
+def _mark_ready() -> None:
+    if not READY_DIR:
+        return
+    try:
+        os.makedirs(READY_DIR, exist_ok=True)
+        with open(_marker_path(), "w"):
+            pass
+    except OSError as err:
+        logger.error(f"Failure recording readiness: {err}")
+
+
+def clear_ready() -> None:
+    """Stop counting this worker as ready, as it shuts down."""
+    if not READY_DIR:
+        return
+    try:
+        os.remove(_marker_path())
+    except OSError:
+        pass
+
+
+def is_ready() -> bool:
+    """
+    Tell whether every worker has warmed up.
+
+    Without `READY_DIR`, workers cannot see each other, so only this one is.
+
+    :return: True once this worker, and `WORKERS` of them in all, are warm
+    """
+    if not _ready or not READY_DIR:
+        return _ready
+    try:
+        names = os.listdir(READY_DIR)
+    except OSError:
+        return False
+    prefix = _marker_prefix()
+    return sum(name.startswith(prefix) for name in names) >= WORKERS
+
+
+def precompile_templates(app: Quart) -> int:
+    """
+    Compile every template up front, rather than on the request that first renders it.
+
+    :param app: app whose templates to compile
+    :return: number of templates compiled
+    """
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+async def prime_pool(db, size: int) -> None:
+    """
+    Open connections to MongoDB until the pool holds at least `size`.
+
+    Each concurrent command checks out a connection of its own, so the pool
+    has to open one for each.
+
+    :param db: Motor database
+    :param size: number of connections to open
+    """
+    await asyncio.gather(*(db.command("ping") for _ in range(size)))
+
+
+async def get_in_process(
+    client: TestClientProtocol, path: str, source: str, number: int
+) -> Response:
+    """
+    Request a page on behalf of a job running alongside the app.
+
+    Rate limits are keyed by `X-Forwarded-For`, so each request is given an
+    address of its own, `<source>-<number>`, rather than the job being limited
+    as a single client.
+
+    :param client: test client of the app
+    :param path: path with its query string
+    :param source: name of the job, which prefixes its addresses
+    :param number: number of the request within the job
+    :return: the response
+    """
+    return await client.get(path, headers={"X-Forwarded-For": f"{source}-{number}"})
+
+
+async def replay(app: Quart, paths: list[str]) -> None:
+    """
+    Request popular searches, warming MongoDB's working set and the result caches.
+
+    :param app: app to request the searches from
+    :param paths: paths with their query strings, e.g. `/posts?search_content=a`
+    """
+    client = app.test_client()
+    for i, path in enumerate(paths):
+        start = time.perf_counter()
+        response = await get_in_process(client, path, "warmup", i)
+        await response.get_data()
+        logger.info(
+            f"Warmed up {path}: {response.status_code} in "
+            f"{time.perf_counter() - start:.3f}s"
+        )
+
+
+async def warm_up(app: Quart, db, pool_size: int, paths: list[str]) -> None:
+    """
+    Get a worker ready to serve, then report it as ready.
+
+    The worker is reported ready even if a step fails, a cold worker being
+    better than none.
+
+    :param app: app to warm up
+    :param db: Motor database
+    :param pool_size: number of MongoDB connections to open
+    :param paths: searches to replay, see `replay`
+    """
+    global _ready
+
+    start = time.perf_counter()
+    try:
+        logger.info(f"Compiled {precompile_templates(app)} templates")
+        await prime_pool(db, pool_size)
+        await replay(app, paths)
+    except Exception:
+        logger.exception("Failure warming up")
+    finally:
+        _ready = True
+        _mark_ready()
+
+    logger.info(f"Warmed up in {time.perf_counter() - start:.3f}s")
@@ -1,17 +1,25 @@
+import asyncio
 import re
-from unittest.mock import Mock, patch
+from base64 import urlsafe_b64encode
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
 
 import pytest
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import ExecutionTimeout, OperationFailure
 from quart_motor import Motor
+from quart_rate_limiter import RateLimitExceeded
 
 import api
-from enums import SearchBehavior
+import meta
+from enums import SearchBehavior, SearchMode
+from tests.utils.mongo import FakeCursor
 
 
 @pytest.mark.asyncio
 @patch("api._get_entities")
 async def test_search_posts_with_mentions(get_entities):
-    get_entities.return_value = 0, []
+    get_entities.return_value = api.ResultStream.of(api.SearchResults(0, []))
     mongo = Mock(spec=Motor)
     username = "@test_username"
     content = "test_content"
@@ -76,7 +84,16 @@ async def test_search_posts_with_mentions(get_entities):
         ],
     }
 
-    get_entities.assert_called_once_with(mongo, "posts", query, 0)
+    get_entities.assert_called_once_with(
+        mongo,
+        "posts",
+        query,
+        0,
+        None,
+        api._posts_search_key(username, content, SearchBehavior.MATCH_ALL, True),
+        api.STREAM_BATCH_SIZE,
+        api._posts_projection(username, content, SearchMode.SUBSTRING, True),
+    )
 
 
 def test_search_posts_query_returns_None():
@@ -189,3 +206,681 @@ def test_get_match_any_regex():
     assert api.get_match_any_regex("some_string +") == re.compile(
         r".*some_string\ \+.*", re.IGNORECASE
     )
+
+
+def test_cursor_round_trip():
+    token = api.encode_cursor(3, after=ObjectId("60f0c0ffee0000000000beef"))
+
+    assert api.decode_cursor(token, 3) == {
+        "page": 3,
+        "after": ObjectId("60f0c0ffee0000000000beef"),
+    }
+
+
+def test_cursor_for_another_page_is_ignored():
+    assert api.decode_cursor(api.encode_cursor(3, after=1), 4) is None
+
+
+def test_garbage_cursor_is_ignored():
+    assert api.decode_cursor("not a cursor!", 0) is None
+
+
+@pytest.mark.parametrize(
+    "position",
+    [
+        '{"page": 0, "after": {"$oid": "zz"}}',
+        '{"page": 0, "after": {"$date": "nope"}}',
+        '{"page": 0, "after": {"$where": "sleep(1)"}}',
+        '{"page": 0, "before": "60f0c0ffee0000000000beef"}',
+        '{"page": 0, "after": true}',
+    ],
+)
+def test_crafted_cursor_is_ignored(position):
+    token = urlsafe_b64encode(position.encode()).decode()
+
+    assert api.decode_cursor(token, 0) is None
+
+
+def test_find_page_without_cursor_skips():
+    collection = MagicMock()
+    query = {"username": "@test"}
+
+    api._find_page(collection, query, 2, None)
+
+    collection.find.assert_called_once_with(query, None)
+    collection.find().sort().skip.assert_called_once_with(2 * api.PAGE_LIMIT)
+
+
+def test_find_page_seeks_after_cursor():
+    collection = MagicMock()
+    query = {"username": "@test"}
+
+    api._find_page(collection, query, 2, {"page": 2, "after": 41})
+
+    collection.find.assert_called_once_with(
+        {"$and": [query, {"_id": {"$gt": 41}}]}, None
+    )
+    collection.find().sort.assert_called_once_with([("_id", ASCENDING)])
+    collection.find().sort().skip.assert_not_called()
+
+
+def test_find_page_seeks_before_cursor():
+    collection = MagicMock()
+    query = {"username": "@test"}
+
+    api._find_page(collection, query, 1, {"page": 1, "before": 41})
+
+    collection.find.assert_called_once_with(
+        {"$and": [query, {"_id": {"$lt": 41}}]}, None
+    )
+    collection.find().sort.assert_called_once_with([("_id", DESCENDING)])
+
+
+def test_find_page_ranks_text_searches_by_relevance():
+    collection = MagicMock()
+    query = {"$and": [{"participants": "@test"}, {"$text": {"$search": "bong"}}]}
+
+    api._find_page(collection, query, 2, {"page": 2, "after": 41}, {"text": 1})
+
+    score = {"$meta": "textScore"}
+    collection.find.assert_called_once_with(query, {"text": 1, "score": score})
+    collection.find().sort.assert_called_once_with(
+        [("score", score), ("_id", ASCENDING)]
+    )
+    collection.find().sort().skip.assert_called_once_with(2 * api.PAGE_LIMIT)
+
+
+def test_words_search_uses_text_index():
+    query = api._search_posts_query(
+        "@test", "bong", SearchBehavior.MATCH_ALL, mode=SearchMode.WORDS
+    )
+
+    assert query == {
+        "$and": [
+            api._posts_by_user_query("@test"),
+            {"$text": {"$search": "bong", "$language": "english"}},
+        ]
+    }
+
+
+@pytest.mark.parametrize(
+    "features,username,behavior,expected",
+    [
+        (set(), "", SearchBehavior.MATCH_ALL, SearchMode.SUBSTRING),
+        ({meta.POST_TEXT_INDEX}, "", SearchBehavior.MATCH_ANY, SearchMode.WORDS),
+        ({meta.POST_TEXT_INDEX}, "@a", SearchBehavior.MATCH_ALL, SearchMode.WORDS),
+        (
+            {meta.POST_TEXT_INDEX},
+            "@a",
+            SearchBehavior.MATCH_ANY,
+            SearchMode.SUBSTRING,
+        ),
+        (
+            {meta.POST_TEXT_INDEX, meta.POST_PARTICIPANTS},
+            "@a",
+            SearchBehavior.MATCH_ANY,
+            SearchMode.WORDS,
+        ),
+    ],
+)
+def test_search_mode_falls_back_to_substrings(features, username, behavior, expected):
+    with patch("meta._features", features):
+        assert api.search_mode(SearchMode.WORDS, username, behavior) == expected
+
+
+def test_words_searches_are_keyed_apart():
+    substring_key = api._posts_search_key("", "bong", SearchBehavior.MATCH_ALL, False)
+    words_key = api._posts_search_key(
+        "", "bong", SearchBehavior.MATCH_ALL, False, SearchMode.WORDS
+    )
+
+    assert substring_key != words_key
+
+
+@pytest.mark.asyncio
+@patch("counts.count")
+@patch("api.RESULT_CODEC_OPTIONS")
+async def test_get_entities_projects_fields(codec_options, count):
+    count.return_value = (1, True)
+    mongo = MagicMock()
+    collection = mongo.db["posts"].with_options.return_value
+    collection.find.return_value = FakeCursor([{"text": "a"}])
+
+    stream = await api._get_entities(mongo, "posts", {"text": "a"}, 0)
+
+    assert await stream.collect() == api.SearchResults(1, [{"text": "a"}])
+    mongo.db["posts"].with_options.assert_called_once_with(codec_options=codec_options)
+    collection.find.assert_called_once_with({"text": "a"}, api.PROJECTIONS["posts"])
+
+
+@pytest.mark.asyncio
+@patch("counts.count")
+async def test_get_entities_failure_returns_nothing(count):
+    count.return_value = (1, True)
+    mongo = MagicMock()
+    cursor = MagicMock()
+    cursor.__aiter__.side_effect = OperationFailure("bad regex")
+    find = mongo.db["posts"].with_options().find().sort().skip().limit()
+    find.batch_size().max_time_ms().comment.return_value = cursor
+
+    stream = await api._get_entities(mongo, "posts", {"text": "a"}, 0)
+
+    assert await stream.collect() == api.SearchResults(1, [])
+
+
+@pytest.mark.asyncio
+@patch("counts.count")
+async def test_get_entities_sets_deadline(count):
+    count.return_value = (1, True)
+    mongo = MagicMock()
+    find = mongo.db["posts"].with_options().find().sort().skip().limit()
+
+    with patch("api.SEARCH_TIMEOUT_MS", 500):
+        await api._get_entities(mongo, "posts", {"text": "a"}, 0, search_key="key")
+
+    find.batch_size().max_time_ms.assert_called_with(500)
+    tag = find.batch_size().max_time_ms().comment.call_args.args[0]
+    count.assert_called_once_with(
+        mongo.db["posts"], {"text": "a"}, "key", maxTimeMS=500, comment=tag
+    )
+
+
+@pytest.mark.asyncio
+@patch("counts.count")
+@patch("metrics.check_slow_query")
+async def test_get_entities_explains_the_page_it_found(check_slow_query, count):
+    count.return_value = (1, True)
+    mongo = MagicMock()
+    collection = mongo.db["posts"].with_options.return_value
+    collection.find.return_value = FakeCursor([{"text": "a"}])
+    cursor = api.encode_cursor(1, after=5)
+
+    stream = await api._get_entities(mongo, "posts", {"text": "a"}, 1, cursor)
+    await stream.collect()
+
+    (_, find, _), _ = check_slow_query.call_args
+    assert find["filter"] == {"$and": [{"text": "a"}, {"_id": {"$gt": 5}}]}
+    assert find["sort"] == {"_id": ASCENDING}
+    assert find["limit"] == api.PAGE_LIMIT
+    assert "skip" not in find
+
+
+async def slow_documents():
+    yield {"text": "in time"}
+    raise ExecutionTimeout("operation exceeded time limit")
+
+
+@pytest.mark.asyncio
+async def test_timed_out_search_returns_partial_results():
+    async def count():
+        return 100, True
+
+    stream = api.ResultStream(slow_documents(), 0, "posts", count(), "key")
+
+    with patch("cache.result_cache") as result_cache:
+        found = await stream.collect()
+
+    assert found == api.SearchResults(6, [{"text": "in time"}], True, partial=True)
+    result_cache.set.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_timed_out_count_leaves_page_count_open():
+    async def count():
+        raise ExecutionTimeout("operation exceeded time limit")
+
+    stream = api.ResultStream([{"text": "a"}], 2, "posts", count())
+
+    assert await stream.collect() == api.SearchResults(3, [{"text": "a"}], False)
+
+
+@pytest.mark.asyncio
+async def test_abandoned_search_is_cleaned_up():
+    started = asyncio.Event()
+
+    async def count():
+        await asyncio.Event().wait()
+
+    async def documents():
+        started.set()
+        await asyncio.Event().wait()
+        yield
+
+    count_f = asyncio.ensure_future(count())
+    stream = api.ResultStream(documents(), 0, "posts", count_f)
+    on_abandon = stream.on_abandon = AsyncMock()
+    collecting = asyncio.ensure_future(stream.collect())
+    await started.wait()
+
+    collecting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await collecting
+    await asyncio.sleep(0)
+
+    assert count_f.cancelled()
+    on_abandon.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_stream_without_a_count_pages_by_what_it_found():
+    stream = api.ResultStream([{"text": "a"}], 2, "posts")
+
+    assert await stream.collect() == api.SearchResults(3, [{"text": "a"}], False)
+
+
+@pytest.mark.asyncio
+async def test_abandoned_search_releases_its_lease():
+    started = asyncio.Event()
+
+    async def count():
+        return 0, True
+
+    async def documents():
+        started.set()
+        await asyncio.Event().wait()
+        yield
+
+    count_f = asyncio.ensure_future(count())
+    stream = api.ResultStream(documents(), 0, "posts", count_f, "key")
+    stream.lease = ("key", "token")
+    with patch("cache.result_cache") as result_cache:
+        result_cache.release_lease = AsyncMock()
+        collecting = asyncio.ensure_future(stream.collect())
+        await started.wait()
+
+        collecting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await collecting
+        await asyncio.sleep(0)
+
+    result_cache.release_lease.assert_awaited_once_with("key", "token")
+
+
+@pytest.mark.asyncio
+async def test_users_query_without_indexes_scans():
+    mongo = Mock(spec=Motor)
+
+    assert await api._users_query(mongo, "Bob") == api._username_contains_query("Bob")
+
+
+@pytest.mark.asyncio
+@patch("meta._features", {meta.USER_LOWERCASE_FIELDS})
+async def test_users_query_seeks_handle_prefix():
+    regex = api.get_match_any_regex("@Bo")
+
+    assert await api._users_query(Mock(spec=Motor), "@Bo") == {
+        "$or": [
+            {"username_lower": {"$regex": "^@bo"}, "username": regex},
+            {"name_lower": {"$regex": "@bo"}, "name": regex},
+        ],
+    }
+
+
+@pytest.mark.asyncio
+@patch("meta._features", {meta.USER_LOWERCASE_FIELDS, meta.USER_TRIGRAMS})
+@patch("trigrams.find_candidates")
+async def test_users_query_narrows_by_trigram(find_candidates):
+    find_candidates.return_value = [1, 2]
+    mongo = MagicMock()
+
+    assert await api._users_query(mongo, "bob") == {
+        "$and": [{"_id": {"$in": [1, 2]}}, api._username_contains_query("bob")],
+    }
+
+
+@pytest.mark.asyncio
+@patch("meta._features", {meta.USER_LOWERCASE_FIELDS, meta.USER_TRIGRAMS})
+@patch("trigrams.find_candidates")
+async def test_users_query_scans_lowercase_indexes_for_short_terms(find_candidates):
+    find_candidates.return_value = None
+    regex = api.get_match_any_regex("Bo")
+
+    assert await api._users_query(MagicMock(), "Bo") == {
+        "$or": [
+            {"name_lower": {"$regex": "bo"}, "name": regex},
+            {"username_lower": {"$regex": "bo"}, "username": regex},
+        ],
+    }
+
+
+def test_export_cursor_round_trips():
+    _id = ObjectId()
+    assert api.decode_export_cursor(api.encode_export_cursor(_id)) == _id
+    assert api.decode_export_cursor("garbage") is None
+    assert api.decode_export_cursor(api.encode_cursor(1, after=_id)) is None
+
+
+@pytest.mark.asyncio
+async def test_export_yields_batches_and_resume_tokens():
+    docs = [{"_id": i} for i in range(5)]
+    mongo = MagicMock()
+    cursor = FakeCursor(docs)
+    mongo.db["posts"].find().sort().batch_size().max_time_ms.return_value = cursor
+
+    batches = [
+        batch
+        async for batch in api._export(mongo, "posts", {"text": "a"}, 1, batch_size=2)
+    ]
+
+    mongo.db["posts"].find.assert_called_with(
+        {"$and": [{"text": "a"}, {"_id": {"$gt": 1}}]}
+    )
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[2][0] == {
+        "cursor": api.encode_export_cursor(4),
+        "document": {"_id": 4},
+    }
+    assert cursor.closed
+
+
+@pytest.mark.asyncio
+async def test_export_ends_with_error_when_out_of_time():
+    mongo = MagicMock()
+    cursor = mongo.db["users"].find().sort().batch_size().max_time_ms()
+    cursor.to_list = AsyncMock(
+        side_effect=[[{"_id": 1}], ExecutionTimeout("operation exceeded time limit")]
+    )
+    cursor.close = AsyncMock()
+
+    batches = [batch async for batch in api._export(mongo, "users", {}, None)]
+
+    assert batches[-1] == [
+        {"error": "The export ran out of time.", "cursor": api.encode_export_cursor(1)}
+    ]
+    cursor.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_export_ends_with_error_when_over_its_rate_limit():
+    mongo = MagicMock()
+    cursor = mongo.db["posts"].find().sort().batch_size().max_time_ms()
+    cursor.to_list = AsyncMock(side_effect=[[{"_id": 1}], [{"_id": 2}]])
+    cursor.close = AsyncMock()
+    charge = AsyncMock(side_effect=RateLimitExceeded(3))
+
+    batches = [
+        batch
+        async for batch in api._export(
+            mongo, "posts", {"text": "a"}, None, charge=charge
+        )
+    ]
+
+    # the first batch is covered by the charge for the query
+    assert cursor.to_list.await_count == 1
+    charge.assert_awaited_once()
+    assert batches[-1] == [
+        {
+            "error": "The export is over its rate limit, resume in 3s.",
+            "cursor": api.encode_export_cursor(1),
+        }
+    ]
+    cursor.close.assert_awaited_once()
+
+
+def test_posts_projection_keeps_echoed_comments_matching_the_search():
+    projection = api._posts_projection("test", "bong", SearchMode.SUBSTRING, True)
+
+    assert not any(field.startswith("echo.") for field in projection)
+    is_echo, echo, not_echo = projection["echo"]["$cond"]
+    assert not_echo == "$echo"
+    assert echo["media"]["title"] == "$echo.media.title"
+    comments = echo["comments"]["$map"]["input"]["$slice"]
+    assert comments[0]["$filter"]["input"] == {"$ifNull": ["$echo.comments", []]}
+    assert comments[0]["$filter"]["cond"] == (
+        projection["comments"]["$map"]["input"]["$slice"][0]["$filter"]["cond"]
+    )
+    assert echo["comments_total"] == {"$size": {"$ifNull": ["$echo.comments", []]}}
+
+
+def test_posts_projection_keeps_comments_matching_the_search():
+    projection = api._posts_projection("test", "bong", SearchMode.SUBSTRING, True)
+
+    assert "comments.text" not in projection
+    comments = projection["comments"]["$map"]["input"]["$slice"]
+    assert comments[1] == api.COMMENTS_PER_POST
+    assert comments[0]["$filter"]["cond"] == {
+        "$or": [
+            {"$eq": ["$$comment.username", "@test"]},
+            {
+                "$regexMatch": {
+                    "input": "$$comment.text",
+                    "regex": api.mention_regex("test"),
+                    "options": "i",
+                }
+            },
+            {
+                "$regexMatch": {
+                    "input": "$$comment.text",
+                    "regex": "bong",
+                    "options": "i",
+                }
+            },
+        ]
+    }
+
+
+def test_posts_projection_without_search_keeps_first_comments():
+    projection = api._posts_projection("", "", SearchMode.SUBSTRING, False)
+
+    assert projection["comments"]["$map"]["input"]["$slice"] == [
+        {"$ifNull": ["$comments", []]},
+        api.COMMENTS_PER_POST,
+    ]
+
+
+@pytest.mark.asyncio
+@patch("counts.count")
+async def test_get_entities_aggregates_computed_projections(count):
+    count.return_value = (1, True)
+    mongo = MagicMock()
+    collection = mongo.db["posts"].with_options.return_value
+    collection.aggregate.return_value = FakeCursor([{"text": "a"}])
+    projection = api._posts_projection("", "a", SearchMode.SUBSTRING, False)
+
+    stream = await api._get_entities(
+        mongo, "posts", {"text": "a"}, 2, projection=projection
+    )
+
+    assert await stream.collect() == api.SearchResults(1, [{"text": "a"}])
+    pipeline = collection.aggregate.call_args.args[0]
+    assert pipeline == [
+        {"$match": {"text": "a"}},
+        {"$sort": {"_id": ASCENDING}},
+        {"$skip": 2 * api.PAGE_LIMIT},
+        {"$limit": api.PAGE_LIMIT},
+        {"$project": projection},
+    ]
+    assert collection.aggregate.call_args.kwargs["maxTimeMS"] == api.SEARCH_TIMEOUT_MS
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("thanks @bob!", True),
+        ("@Bob", True),
+        ("hi @bobby", False),
+        ("hi @@bob", False),
+        ("bob", False),
+    ],
+)
+def test_comment_mentions_match_whole_handles(text, expected):
+    regex = api.mention_regex("bob")
+
+    assert bool(re.search(regex, text, re.IGNORECASE)) == expected
+
+
+@pytest.mark.asyncio
+async def test_get_comments():
+    mongo = MagicMock()
+    aggregate = mongo.db["posts"].with_options.return_value.aggregate
+    aggregate.return_value = FakeCursor(
+        [{"comments": [{"username": "@a", "text": "b"}], "comments_total": 3}]
+    )
+
+    assert await api.get_comments(mongo, 1, 2) == (
+        [{"username": "@a", "text": "b"}],
+        3,
+    )
+    assert aggregate.call_args.args[0][0] == {"$match": {"_id": 1}}
+
+    aggregate.return_value = FakeCursor([])
+    assert await api.get_comments(mongo, 1, 0) is None
+
+
+@patch("meta._features", {meta.POST_PARTICIPANTS})
+def test_split_query_separates_indexed_branches_from_scans():
+    query = api._search_posts_with_mentions_query(
+        "test", "bong", SearchBehavior.MATCH_ANY
+    )
+    assert query is not None
+    user_query, mention_query, content_query = query["$or"]
+
+    assert api._split_query(query) == [user_query, mention_query, content_query]
+    assert api._split_query({"$or": [user_query, content_query["$or"][0]]}) == [
+        user_query,
+        content_query["$or"][0],
+    ]
+    assert api._split_query({"$or": [user_query, mention_query]}) is None
+    assert api._split_query(content_query) is None
+    assert api._split_query({"$and": [user_query, content_query]}) is None
+    assert api._split_query({"$or": [{"$text": {"$search": "a"}}, user_query]}) is None
+
+
+@pytest.mark.asyncio
+@patch("counts.count")
+async def test_get_entities_merges_split_queries(count):
+    count.return_value = (25, True)
+    indexed = {"participants": "@a"}
+    scanned = {"text": re.compile("a")}
+    branch_ids = {
+        repr({"$and": [indexed, {"_id": {"$gt": 3}}]}): [4, 6, 9],
+        repr({"$and": [scanned, {"_id": {"$gt": 3}}]}): [5, 6, 7],
+    }
+
+    def find(query, projection):
+        if projection == {"_id": True}:
+            return FakeCursor([{"_id": i} for i in branch_ids[repr(query)]])
+        return FakeCursor([{"_id": i} for i in query["_id"]["$in"]])
+
+    mongo = MagicMock()
+    collection = mongo.db["posts"].with_options.return_value
+    collection.find.side_effect = find
+
+    stream = await api._get_entities(
+        mongo,
+        "posts",
+        {"$or": [indexed, scanned]},
+        1,
+        api.encode_cursor(1, after=3),
+        projection={"text": True},
+    )
+
+    found = await stream.collect()
+    assert [result["_id"] for result in found.results] == [4, 5, 6, 7, 9]
+    collection.find.assert_called_with(
+        {"_id": {"$in": [4, 5, 6, 7, 9]}}, {"text": True}
+    )
+
+
+@pytest.mark.asyncio
+@patch("counts.count")
+async def test_merged_page_keeps_the_branches_found_in_time(count):
+    count.return_value = (25, True)
+    indexed = {"participants": "@a"}
+    scanned = {"text": re.compile("a")}
+
+    def find(query, projection):
+        if projection != {"_id": True}:
+            return FakeCursor([{"_id": i} for i in query["_id"]["$in"]])
+        if query == indexed:
+            return FakeCursor([{"_id": 2}, {"_id": 8}])
+        cursor = MagicMock()
+        cursor.sort().limit().max_time_ms().comment().to_list = AsyncMock(
+            side_effect=ExecutionTimeout("operation exceeded time limit")
+        )
+        return cursor
+
+    mongo = MagicMock()
+    collection = mongo.db["posts"].with_options.return_value
+    collection.find.side_effect = find
+
+    stream = await api._get_entities(mongo, "posts", {"$or": [indexed, scanned]}, 0)
+
+    found = await stream.collect()
+    assert [result["_id"] for result in found.results] == [2, 8]
+    assert found.partial
+
+
+@pytest.mark.asyncio
+async def test_merged_page_failure_cancels_the_other_branches():
+    blocked = asyncio.Event()
+
+    async def branch_ids(collection, branch, *args):
+        if branch == "failing":
+            await asyncio.sleep(0)
+            raise OperationFailure("bad regex")
+        await blocked.wait()
+
+    with patch("api._branch_ids", side_effect=branch_ids):
+        page = api._merged_page(MagicMock(), ["failing", "slow"], 0, None, None, 5, "")
+        with pytest.raises(OperationFailure):
+            await page.__anext__()
+        await asyncio.sleep(0)
+
+    assert not [
+        task for task in asyncio.all_tasks() if "_branch_ids_in_time" in repr(task)
+    ]
+
+
+def test_facet_pipeline_counts_every_match_and_seeks_the_page():
+    position = {"page": 2, "after": 5}
+
+    assert api._facet_pipeline({"text": "a"}, 2, position, {"text": 1}) == [
+        {"$match": {"text": "a"}},
+        {"$sort": {"_id": ASCENDING}},
+        {
+            "$facet": {
+                "count": [{"$count": "total"}],
+                "page": [
+                    {"$match": {"$and": [{}, {"_id": {"$gt": 5}}]}},
+                    {"$limit": api.PAGE_LIMIT},
+                    {"$project": {"text": 1}},
+                ],
+            }
+        },
+    ]
+    assert api._facet_pipeline({"text": "a"}, 2, None, None)[2]["$facet"]["page"] == [
+        {"$skip": 2 * api.PAGE_LIMIT},
+        {"$limit": api.PAGE_LIMIT},
+    ]
+
+
+@pytest.mark.asyncio
+@patch("api.FACET_COLLECTIONS", {"posts"})
+@patch("counts.count")
+async def test_get_entities_counts_and_finds_in_one_facet(count):
+    api.counts.cache.clear()
+    mongo = MagicMock()
+    collection = mongo.db["posts"].with_options.return_value
+    collection.aggregate.return_value = FakeCursor(
+        [{"count": [{"total": 41}], "page": [{"_id": 2}, {"_id": 1}]}]
+    )
+    cursor = api.encode_cursor(0, before=3)
+
+    stream = await api._get_entities(
+        mongo, "posts", {"text": "a"}, 0, cursor, search_key="key"
+    )
+
+    assert await stream.collect() == api.SearchResults(3, [{"_id": 1}, {"_id": 2}])
+    count.assert_not_called()
+    collection.find.assert_not_called()
+    assert collection.aggregate.call_args.kwargs["maxTimeMS"] == api.SEARCH_TIMEOUT_MS
+    assert api.counts.cache.get("key") == (41, True)
+
+    # with the count cached, only the page is found
+    collection.find.return_value = FakeCursor([])
+    count.return_value = (41, True)
+    stream = await api._get_entities(mongo, "posts", {"text": "a"}, 1, search_key="key")
+    await stream.collect()
+    collection.aggregate.assert_called_once()
+    api.counts.cache.clear()
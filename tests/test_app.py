@@ -1,7 +1,15 @@
-from unittest.mock import patch
+from unittest.mock import ANY, AsyncMock, patch
 
+import bson
+import bson.json_util
 import pytest
+from bson.raw_bson import RawBSONDocument
+from quart_rate_limiter import RateLimitExceeded
 
+import api
+import meta
+import querycost
+from enums import SearchBehavior, SearchMode
 from tests.utils.posts import make_post
 from tests.utils.users import make_user
 
@@ -25,12 +33,14 @@ async def test_posts_route(app):
     client = app.test_client()
     response = await client.get("/posts")
     assert response.status_code == 200
+    data = str(await response.data)
+    assert "No results found for this query" not in data
 
 
 @pytest.mark.asyncio
 @patch("api.search_users")
 async def test_users_route_retrieves_no_users(mock_search_users, app):
-    mock_search_users.return_value = (0, [])
+    mock_search_users.return_value = api.SearchResults(0, [])
     client = app.test_client()
     response = await client.get("/users?username=test-username")
     assert response.status_code == 200
@@ -41,7 +51,7 @@ async def test_users_route_retrieves_no_users(mock_search_users, app):
 @pytest.mark.asyncio
 @patch("api.search_posts")
 async def test_posts_route_retrieves_no_posts(mock_search_posts, app):
-    mock_search_posts.return_value = (0, [])
+    mock_search_posts.return_value = api.SearchResults(0, [])
     client = app.test_client()
     response = await client.get("/posts?username=test-username")
     assert response.status_code == 200
@@ -52,7 +62,7 @@ async def test_posts_route_retrieves_no_posts(mock_search_posts, app):
 @pytest.mark.asyncio
 @patch("api.search_users")
 async def test_users_route_one_page_users(mock_search_users, app):
-    mock_search_users.return_value = (
+    mock_search_users.return_value = api.SearchResults(
         1,
         [make_user(f"@test_username_{i}", f"test-name-{i}") for i in range(20)],
     )
@@ -73,7 +83,7 @@ async def test_users_route_one_page_users(mock_search_users, app):
 async def test_users_route_one_page_users_private_users_skipped_from_linking(
     mock_search_users, app
 ):
-    mock_search_users.return_value = (
+    mock_search_users.return_value = api.SearchResults(
         1,
         [make_user("@Private User", "private-user")],
     )
@@ -89,7 +99,7 @@ async def test_users_route_one_page_users_private_users_skipped_from_linking(
 @pytest.mark.asyncio
 @patch("api.search_posts")
 async def test_posts_route_one_page_posts(mock_search_posts, app):
-    mock_search_posts.return_value = (
+    mock_search_posts.return_value = api.SearchResults(
         1,
         [
             make_post(f"test-username-{i}", f"test-post-text-{i}", [], None, None)
@@ -109,7 +119,7 @@ async def test_posts_route_one_page_posts(mock_search_posts, app):
 @pytest.mark.asyncio
 @patch("api.search_posts")
 async def test_posts_route_one_page_posts_highlight(mock_search_posts, app):
-    mock_search_posts.return_value = (
+    mock_search_posts.return_value = api.SearchResults(
         1,
         [
             make_post(f"test-username-{i}", f"test-post-text-{i}", [], None, None)
@@ -126,3 +136,355 @@ async def test_posts_route_one_page_posts_highlight(mock_search_posts, app):
         assert f"Username:</strong> test-username-{i}" in data
         assert f"Content:</strong> <mark>test-post-text</mark>-{i}" in data
         assert "Comments:</strong>" not in data
+
+
+@pytest.mark.asyncio
+@patch("api.search_posts")
+async def test_posts_route_links_neighbouring_pages(mock_search_posts, app):
+    posts = [
+        make_post(f"test-username-{i}", f"test-post-text-{i}", [], None, None)
+        for i in range(20)
+    ]
+    for i, post in enumerate(posts):
+        post["_id"] = 100 + i
+    mock_search_posts.return_value = api.SearchResults(3, posts)
+    client = app.test_client()
+    response = await client.get("/posts?username=test-username&page=1")
+    assert response.status_code == 200
+    data = (await response.data).decode()
+
+    prev_cursor = api.encode_cursor(0, before=100)
+    next_cursor = api.encode_cursor(2, after=119)
+    assert f"cursor={prev_cursor}&amp;page=0" in data
+    assert f"cursor={next_cursor}&amp;page=2" in data
+
+
+@pytest.mark.asyncio
+@patch("api.search_users")
+async def test_users_route_passes_cursor(mock_search_users, app):
+    mock_search_users.return_value = api.SearchResults(0, [])
+    client = app.test_client()
+    cursor = api.encode_cursor(1, after=5)
+    response = await client.get(f"/users?username=test-username&page=1&cursor={cursor}")
+    assert response.status_code == 200
+    mock_search_users.assert_called_once_with(
+        ANY, "test-username", 1, cursor, charge=ANY
+    )
+
+
+@pytest.mark.asyncio
+@patch("api.search_posts")
+async def test_posts_route_shows_bounded_page_count(mock_search_posts, app):
+    mock_search_posts.return_value = api.SearchResults(
+        50,
+        [make_post("test-username", "test-post-text", [], None, None)],
+        page_count_exact=False,
+    )
+    client = app.test_client()
+    response = await client.get("/posts?username=test-username")
+    assert response.status_code == 200
+    data = str(await response.data)
+    assert "Page (of 50+):" in data
+
+
+@pytest.mark.asyncio
+@patch("api.search_posts")
+async def test_posts_route_renders_raw_bson_posts(mock_search_posts, app):
+    comment = {"username": "@commenter", "text": "test-comment-text", "date": ""}
+    post = make_post("test-username", "test-post-text", [comment], None, None)
+    mock_search_posts.return_value = api.SearchResults(
+        1, [RawBSONDocument(bson.encode(post))]
+    )
+    client = app.test_client()
+    response = await client.get("/posts?username=test-username")
+    assert response.status_code == 200
+    data = str(await response.data)
+    assert "Username:</strong> test-username" in data
+    assert "Content:</strong> test-post-text" in data
+    assert "Content:</strong> test-comment-text" in data
+
+
+@pytest.mark.asyncio
+@patch("api.search_posts")
+async def test_posts_route_shows_partial_results(mock_search_posts, app):
+    posts = [
+        make_post(f"test-username-{i}", f"test-post-text-{i}", [], None, None)
+        for i in range(20)
+    ]
+    for i, post in enumerate(posts):
+        post["_id"] = 100 + i
+    mock_search_posts.return_value = api.SearchResults(3, posts, partial=True)
+    client = app.test_client()
+    response = await client.get("/posts?username=test-username")
+    assert response.status_code == 200
+    data = (await response.data).decode()
+    assert "This search took too long" in data
+    assert "page=1&amp;" not in data
+
+
+@pytest.mark.asyncio
+@patch("app.STREAM_RESULTS", True)
+@patch("api.stream_posts")
+async def test_posts_route_streams_posts(mock_stream_posts, app):
+    mock_stream_posts.return_value = api.ResultStream.of(
+        api.SearchResults(
+            2,
+            [
+                make_post(f"test-username-{i}", f"test-post-text-{i}", [], None, None)
+                for i in range(20)
+            ],
+        )
+    )
+    client = app.test_client()
+    response = await client.get("/posts?username=test-username")
+    assert response.status_code == 200
+    data = (await response.data).decode()
+    for i in range(20):
+        assert f"Username:</strong> test-username-{i}" in data
+    # the pager follows the results once they have all been counted
+    assert data.index("test-username-19") < data.index("Page (of 2):")
+
+
+@pytest.mark.asyncio
+@patch("app.STREAM_RESULTS", True)
+@patch("api.stream_posts")
+async def test_posts_route_streams_no_posts(mock_stream_posts, app):
+    mock_stream_posts.return_value = api.ResultStream.of(api.SearchResults(1, []))
+    client = app.test_client()
+    response = await client.get("/posts?username=test-username")
+    assert response.status_code == 200
+    data = str(await response.data)
+    assert "No results found for this query" in data
+
+
+@pytest.mark.asyncio
+@patch("app.cost_limiter")
+@patch("api._build_posts_query")
+@patch("api._get_entities")
+async def test_searches_are_charged_their_cost(
+    get_entities, build_query, cost_limiter, app
+):
+    build_query.return_value = api._search_posts_query(
+        "", "scan", SearchBehavior.MATCH_ALL
+    )
+    get_entities.return_value = api.ResultStream.of(api.SearchResults(0, []))
+    cost_limiter.charge = AsyncMock()
+    client = app.test_client()
+
+    response = await client.get(
+        "/posts?search_content=scan", headers={"X-Forwarded-For": "client"}
+    )
+
+    assert response.status_code == 200
+    cost_limiter.charge.assert_awaited_once_with(
+        "client", querycost.query_cost(build_query.return_value)
+    )
+
+
+@pytest.mark.asyncio
+@patch("app.cost_limiter")
+@patch("api._build_posts_query")
+@patch("api._get_entities")
+async def test_unaffordable_searches_are_rejected(
+    get_entities, build_query, cost_limiter, app
+):
+    build_query.return_value = api._search_posts_query(
+        "", "scan", SearchBehavior.MATCH_ALL
+    )
+    cost_limiter.charge = AsyncMock(side_effect=RateLimitExceeded(3))
+    client = app.test_client()
+
+    response = await client.get("/posts?search_content=scan")
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "3"
+    get_entities.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("api.export_posts")
+async def test_api_posts_route_streams_ndjson(mock_export_posts, app):
+    async def batches():
+        yield [{"cursor": "a", "document": {"_id": bson.ObjectId(), "text": "x"}}]
+        yield [{"cursor": "b", "document": {"text": "y"}}]
+
+    mock_export_posts.return_value = batches()
+    client = app.test_client()
+    after = bson.ObjectId()
+    cursor = api.encode_export_cursor(after)
+    response = await client.get(f"/api/posts?search_content=x&cursor={cursor}")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = (await response.data).decode().splitlines()
+    assert [bson.json_util.loads(line)["cursor"] for line in lines] == ["a", "b"]
+    mock_export_posts.assert_called_once_with(
+        ANY,
+        "",
+        "x",
+        SearchBehavior.MATCH_ALL,
+        False,
+        after,
+        charge=ANY,
+        mode=SearchMode.SUBSTRING,
+    )
+
+
+@pytest.mark.asyncio
+async def test_api_users_route_rejects_bad_cursor(app):
+    client = app.test_client()
+    response = await client.get("/api/users?username=bob&cursor=garbage")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_api_posts_route_requires_a_search(app):
+    client = app.test_client()
+    response = await client.get("/api/posts")
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@patch("meta._features", {meta.POST_TEXT_INDEX})
+@patch("api.search_posts")
+async def test_posts_route_highlights_searched_words(mock_search_posts, app):
+    mock_search_posts.return_value = api.SearchResults(
+        1, [make_post("test-username", "She runs daily", [], None, None)]
+    )
+    client = app.test_client()
+    response = await client.get("/posts?search_content=running&mode=words")
+    assert response.status_code == 200
+    data = str(await response.data)
+    assert "She <mark>runs</mark> daily" in data
+    assert mock_search_posts.call_args.kwargs["mode"] == SearchMode.WORDS
+
+
+@pytest.mark.asyncio
+@patch("api.search_posts")
+async def test_posts_route_links_remaining_comments(mock_search_posts, app):
+    post = make_post("test-username", "test-post-text", [], None, None)
+    post["_id"] = bson.ObjectId()
+    post["comments_total"] = 12
+    mock_search_posts.return_value = api.SearchResults(1, [post])
+    client = app.test_client()
+    response = await client.get("/posts?search_content=test")
+    data = (await response.data).decode()
+    assert f"/posts/{post['_id']}/comments?search_content=test" in data
+    assert "Show all 12 comments" in data
+    # the link loads every comment in place of the preview it is part of
+    assert data.index('class="comments-preview"') < data.index("Show all")
+
+
+@pytest.mark.asyncio
+@patch("api.search_posts")
+async def test_posts_route_links_remaining_echoed_comments(mock_search_posts, app):
+    echo = make_post("echoed-username", "test-echo-text", [], None, None)
+    echo["comments_total"] = 7
+    post = make_post("test-username", "test-post-text", [], echo, None)
+    post["_id"] = bson.ObjectId()
+    mock_search_posts.return_value = api.SearchResults(1, [post])
+    client = app.test_client()
+    response = await client.get("/posts?search_content=test")
+    data = (await response.data).decode()
+    # echoed posts are paged through by the post echoing them
+    assert f"/posts/{post['_id']}/comments?search_content=test" in data
+    assert "echo=true" in data
+    assert "Show all 7 comments" in data
+
+
+@pytest.mark.asyncio
+@patch("api.get_comments")
+async def test_post_comments_route_pages_through_comments(mock_get_comments, app):
+    post_id = bson.ObjectId()
+    comment = {"username": "@commenter", "text": "a test comment"}
+    mock_get_comments.return_value = ([comment] * 2, 5)
+    client = app.test_client()
+    response = await client.get(
+        f"/posts/{post_id}/comments?offset=2&search_content=test"
+    )
+    assert response.status_code == 200
+    data = (await response.data).decode()
+    assert data.count("a <mark>test</mark> comment") == 2
+    assert "offset=4" in data
+    mock_get_comments.assert_called_once_with(ANY, post_id, 2, echo=False)
+
+
+@pytest.mark.asyncio
+@patch("api.get_comments")
+async def test_post_comments_route_pages_through_echoed_comments(
+    mock_get_comments, app
+):
+    post_id = bson.ObjectId()
+    comment = {"username": "@commenter", "text": "an echoed comment"}
+    mock_get_comments.return_value = ([comment] * 2, 5)
+    client = app.test_client()
+    response = await client.get(f"/posts/{post_id}/comments?offset=2&echo=true")
+    data = (await response.data).decode()
+    assert "offset=4" in data and "echo=true" in data
+    mock_get_comments.assert_called_once_with(ANY, post_id, 2, echo=True)
+
+
+@pytest.mark.asyncio
+@patch("api.get_comments")
+async def test_post_comments_route_missing_post(mock_get_comments, app):
+    mock_get_comments.return_value = None
+    client = app.test_client()
+    response = await client.get("/posts/nope/comments")
+    assert "couldn't find what you were looking for" in (await response.data).decode()
+
+
+@pytest.mark.asyncio
+@patch("meta._dataset_version", "1")
+@patch("api.search_posts")
+async def test_posts_route_answers_unchanged_pages_with_304(mock_search_posts, app):
+    mock_search_posts.return_value = api.SearchResults(0, [])
+    client = app.test_client()
+    response = await client.get("/posts?username=test&search_content=a")
+    assert response.status_code == 200
+    assert response.cache_control.public
+    assert response.cache_control.max_age > 0
+    etag, _ = response.get_etag()
+
+    # the same search spelt differently is the same page
+    response = await client.get(
+        "/posts?search_content=a&username=test",
+        headers={"If-None-Match": f'"{etag}"', "X-Forwarded-For": "other"},
+    )
+    assert response.status_code == 304
+    assert mock_search_posts.call_count == 1
+
+    # as sent back by clients of a proxy that compressed the page
+    response = await client.get(
+        "/posts?search_content=a&username=test",
+        headers={"If-None-Match": f'W/"{etag}"', "X-Forwarded-For": "weak"},
+    )
+    assert response.status_code == 304
+    assert mock_search_posts.call_count == 1
+
+    with patch("meta._dataset_version", "2"):
+        response = await client.get(
+            "/posts?search_content=a&username=test",
+            headers={"If-None-Match": f'"{etag}"', "X-Forwarded-For": "another"},
+        )
+    assert response.status_code == 200
+    assert response.get_etag()[0] != etag
+
+
+@pytest.mark.asyncio
+@patch("meta._dataset_version", "1")
+@patch("api.search_posts")
+async def test_posts_route_partial_results_not_cached(mock_search_posts, app):
+    mock_search_posts.return_value = api.SearchResults(0, [], partial=True)
+    client = app.test_client()
+    response = await client.get("/posts?username=test")
+    assert response.cache_control.no_store
+    assert response.get_etag() == (None, None)
+
+
+@pytest.mark.asyncio
+@patch("api.search_users")
+async def test_users_route_not_cached_without_dataset_version(mock_search_users, app):
+    mock_search_users.return_value = api.SearchResults(0, [])
+    client = app.test_client()
+    response = await client.get("/users?username=test")
+    assert "Cache-Control" not in response.headers
+    assert response.get_etag() == (None, None)
@@ -0,0 +1,48 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from bson import ObjectId
+
+import api
+import backend
+from enums import SearchBehavior
+
+
+class ListBackend(backend.SearchBackend):
+    async def search_posts(self, *args, **kwargs) -> api.SearchResults:
+        return api.SearchResults(1, [{"text": "a"}])
+
+    async def search_users(self, *args, **kwargs) -> api.SearchResults:
+        return api.SearchResults(1, [])
+
+    async def get_comments(self, post_id, offset):
+        return None
+
+    async def refresh_meta(self) -> None:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_stream_posts_defaults_to_the_whole_page():
+    stream = await ListBackend().stream_posts(
+        "a", "", 0, SearchBehavior.MATCH_ALL, False
+    )
+
+    assert [result async for result in stream] == [{"text": "a"}]
+    assert await stream.finish() == api.SearchResults(1, [{"text": "a"}])
+
+
+@pytest.mark.asyncio
+@patch("api.get_comments")
+async def test_mongo_backend_looks_comments_up_by_object_id(mock_get_comments):
+    mongo = MagicMock()
+    mongo_backend = backend.create_backend(backend.MONGO, mongo)
+    post_id = ObjectId()
+
+    await mongo_backend.get_comments(str(post_id), 3)
+    mock_get_comments.assert_called_once_with(mongo, post_id, 3, echo=False)
+
+
+def test_create_backend_rejects_unknown_names():
+    with pytest.raises(ValueError):
+        backend.create_backend("postgres", MagicMock())
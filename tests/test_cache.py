@@ -0,0 +1,322 @@
+import asyncio
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
+
+import bson
+import pytest
+from prometheus_client import REGISTRY
+from pymongo.errors import OperationFailure
+
+import api
+import cache
+import metrics
+from enums import SearchBehavior
+
+
+def lookups(outcome: str) -> float:
+    name = f"{metrics.NAMESPACE}_result_cache_lookups_total"
+    return REGISTRY.get_sample_value(name, {"outcome": outcome}) or 0
+
+
+def test_lru_cache_evicts_past_max_bytes():
+    lru = cache.LRUCache(max_bytes=10)
+    lru.set("a", b"1234")
+    lru.set("b", b"1234")
+    lru.get("a")
+    lru.set("c", b"1234")
+
+    assert lru.get("a") == b"1234"
+    assert lru.get("b") is None
+    assert lru.get("c") == b"1234"
+    assert lru.size == 8
+
+
+def test_lru_cache_skips_oversized_values():
+    lru = cache.LRUCache(max_bytes=2)
+    lru.set("a", b"123")
+
+    assert lru.get("a") is None
+    assert lru.size == 0
+
+
+@pytest.mark.asyncio
+async def test_result_cache_counts_hits_and_misses():
+    result_cache = cache.ResultCache(max_bytes=1024, ttl=10)
+    key = result_cache.key("search", 0)
+    misses, local_hits = lookups("miss"), lookups("local_hit")
+
+    assert await result_cache.get(key) is None
+    await result_cache.set(key, {"results": [1, 2]})
+    assert await result_cache.get(key) == {"results": [1, 2]}
+    assert lookups("miss") == misses + 1
+    assert lookups("local_hit") == local_hits + 1
+
+
+@pytest.mark.asyncio
+async def test_result_cache_falls_back_to_redis():
+    result_cache = cache.ResultCache(max_bytes=1024, ttl=10)
+    redis = MagicMock(get=AsyncMock(return_value=None), set=AsyncMock())
+    result_cache._redis = redis
+    key = result_cache.key("search", 0)
+
+    await result_cache.set(key, {"results": [1]})
+    redis.set.assert_awaited_once()
+    redis.get.return_value = redis.set.await_args.args[1]
+
+    result_cache.local.clear()
+    redis_hits, local_hits = lookups("redis_hit"), lookups("local_hit")
+    assert await result_cache.get(key) == {"results": [1]}
+    assert await result_cache.get(key) == {"results": [1]}
+    assert lookups("redis_hit") == redis_hits + 1
+    assert lookups("local_hit") == local_hits + 1
+
+
+@patch("meta._dataset_version", "1")
+def test_result_cache_key_includes_dataset_version():
+    result_cache = cache.ResultCache(max_bytes=1024, ttl=10)
+    key = result_cache.key("search", 2)
+    result_cache.local.set(key, b"cached")
+
+    assert key == "results:1:search:2"
+    with patch("meta._dataset_version", "2"):
+        assert result_cache.key("search", 2) == "results:2:search:2"
+        assert result_cache.local.get(key) is None
+
+
+def test_posts_search_key_is_canonical():
+    def key(username, content, behavior, mentions):
+        return api._posts_search_key(username, content, behavior, mentions)
+
+    assert key("test", "", SearchBehavior.MATCH_ANY, False) == key(
+        "@test", "", SearchBehavior.MATCH_ALL, False
+    )
+    assert key("", "a", SearchBehavior.MATCH_ANY, True) == key(
+        "", "a", SearchBehavior.MATCH_ALL, False
+    )
+    # mentions search for the username as typed
+    assert key("test", "", SearchBehavior.MATCH_ALL, True) != key(
+        "@test", "", SearchBehavior.MATCH_ALL, True
+    )
+    assert key("test", "a", SearchBehavior.MATCH_ANY, False) != key(
+        "test", "a", SearchBehavior.MATCH_ALL, False
+    )
+
+
+@pytest.mark.asyncio
+@patch("cache.result_cache", cache.ResultCache(max_bytes=1024 * 1024, ttl=10))
+@patch("api._get_entities")
+async def test_search_posts_is_cached(get_entities):
+    async def count():
+        return 1, True
+
+    search_key = api._posts_search_key("test", "", SearchBehavior.MATCH_ALL, False)
+    get_entities.return_value = api.ResultStream(
+        [{"text": "cached"}],
+        0,
+        "posts",
+        count(),
+        cache.result_cache.key(search_key, 0),
+    )
+    mongo = MagicMock()
+
+    for _ in range(2):
+        found = await api.search_posts(
+            mongo, "test", "", 0, SearchBehavior.MATCH_ALL, False
+        )
+        assert found == api.SearchResults(1, [{"text": "cached"}])
+
+    get_entities.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_one_run():
+    flights: cache.SingleFlight = cache.SingleFlight()
+    started = 0
+    release = asyncio.Event()
+
+    async def run():
+        nonlocal started
+        started += 1
+        await release.wait()
+        return started
+
+    first = asyncio.ensure_future(flights.do("key", run))
+    second = asyncio.ensure_future(flights.do("key", run))
+    await asyncio.sleep(0)
+
+    # a waiter giving up leaves the run going for the others
+    first.cancel()
+    release.set()
+
+    assert await second == 1
+    assert flights.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_single_flight_is_cancelled_without_waiters():
+    flights: cache.SingleFlight = cache.SingleFlight()
+    run = asyncio.ensure_future(asyncio.Event().wait())
+
+    waiters = [asyncio.ensure_future(flights.do("key", lambda: run)) for _ in range(2)]
+    await asyncio.sleep(0)
+    waiters[0].cancel()
+    await asyncio.sleep(0)
+    assert not run.cancelled()
+
+    waiters[1].cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    assert run.cancelled()
+
+
+@pytest.mark.asyncio
+@patch("cache.result_cache", cache.ResultCache(max_bytes=1024 * 1024, ttl=10))
+@patch("api._get_entities")
+async def test_concurrent_searches_share_one_query(get_entities):
+    async def count():
+        await asyncio.sleep(0)
+        return 1, True
+
+    get_entities.return_value = api.ResultStream(
+        [{"text": "shared"}], 0, "posts", count()
+    )
+    mongo = MagicMock()
+
+    found = await asyncio.gather(
+        *(
+            api.search_posts(mongo, "test", "", 0, SearchBehavior.MATCH_ALL, False)
+            for _ in range(3)
+        )
+    )
+
+    assert found == [api.SearchResults(1, [{"text": "shared"}])] * 3
+    get_entities.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("cache.SEARCH_LEASE_POLL_INTERVAL", 0)
+@patch("api._get_entities")
+async def test_lease_followers_wait_for_the_leader(get_entities):
+    result_cache = cache.ResultCache(max_bytes=1024, ttl=10)
+    lease_hits = lookups("lease_hit")
+    encoded = bson.encode(api.SearchResults(1, [{"text": "leader"}])._asdict())
+    result_cache._redis = MagicMock(
+        # the first read misses, the leader has cached its results by the second
+        get=AsyncMock(side_effect=[None, None, encoded]),
+        set=AsyncMock(return_value=None),
+        exists=AsyncMock(return_value=1),
+    )
+
+    with patch("cache.result_cache", result_cache):
+        found = await api.search_posts(
+            MagicMock(), "test", "", 0, SearchBehavior.MATCH_ALL, False
+        )
+
+    assert found == api.SearchResults(1, [{"text": "leader"}])
+    assert lookups("lease_hit") == lease_hits + 1
+    get_entities.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_leader_releases_its_lease():
+    async def count():
+        return 1, True
+
+    result_cache = cache.ResultCache(max_bytes=1024, ttl=10)
+    result_cache._redis = MagicMock(set=AsyncMock(return_value=True), eval=AsyncMock())
+    token = await result_cache.acquire_lease("results::search:0")
+    assert token is not None
+    stream = api.ResultStream([{"text": "leader"}], 0, "posts", count())
+    stream.lease = ("results::search:0", token)
+
+    with patch("cache.result_cache", result_cache):
+        await stream.collect()
+
+    result_cache._redis.set.assert_awaited_once()
+    assert result_cache._redis.set.call_args.args[1] == token
+    # deleted only if the lease has not lapsed and been taken by another worker
+    result_cache._redis.eval.assert_awaited_once_with(
+        cache.RELEASE_LEASE_SCRIPT, keys=["lease:results::search:0"], args=[token]
+    )
+
+
+@pytest.mark.asyncio
+@patch("api._get_entities", AsyncMock(side_effect=OperationFailure("bad query")))
+async def test_failed_search_releases_its_lease():
+    result_cache = cache.ResultCache(max_bytes=1024, ttl=10)
+    result_cache._redis = MagicMock(
+        get=AsyncMock(return_value=None),
+        set=AsyncMock(return_value=True),
+        eval=AsyncMock(),
+    )
+
+    with patch("cache.result_cache", result_cache), pytest.raises(OperationFailure):
+        await api.search_posts(
+            MagicMock(), "test", "", 0, SearchBehavior.MATCH_ALL, False
+        )
+
+    token = result_cache._redis.set.call_args.args[1]
+    result_cache._redis.eval.assert_awaited_once_with(
+        cache.RELEASE_LEASE_SCRIPT, keys=[ANY], args=[token]
+    )
+
+
+@pytest.mark.asyncio
+async def test_lease_is_not_acquired_when_held():
+    result_cache = cache.ResultCache(max_bytes=1024, ttl=10)
+    result_cache._redis = MagicMock(set=AsyncMock(return_value=None))
+
+    assert await result_cache.acquire_lease("results::search:0") is None
+
+
+@pytest.mark.asyncio
+@patch("cache.result_cache", cache.ResultCache(max_bytes=1024 * 1024, ttl=10))
+@patch("api._get_entities")
+async def test_concurrent_streamed_searches_share_one_query(get_entities):
+    async def count():
+        return 1, True
+
+    get_entities.return_value = api.ResultStream(
+        [{"text": "shared"}], 0, "posts", count()
+    )
+
+    async def search():
+        return await api.stream_posts(
+            MagicMock(), "test", "", 0, SearchBehavior.MATCH_ALL, False
+        )
+
+    leader = await search()
+    follower = asyncio.ensure_future(search())
+    await asyncio.sleep(0)
+    assert not follower.done()
+
+    assert await leader.collect() == api.SearchResults(1, [{"text": "shared"}])
+    assert await (await follower).collect() == api.SearchResults(
+        1, [{"text": "shared"}]
+    )
+    get_entities.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("cache.result_cache", cache.ResultCache(max_bytes=1024 * 1024, ttl=10))
+@patch("api._get_entities")
+async def test_streamed_search_given_up_on_leaves_others_to_search(get_entities):
+    async def count():
+        return 1, True
+
+    def stream(*args):
+        count_f = asyncio.ensure_future(count())
+        return api.ResultStream([{"text": "own"}], 0, "posts", count_f)
+
+    get_entities.side_effect = stream
+
+    async def search():
+        return await api.stream_posts(
+            MagicMock(), "test", "", 0, SearchBehavior.MATCH_ALL, False
+        )
+
+    leader = await search()
+    follower = asyncio.ensure_future(search())
+    await asyncio.sleep(0)
+    leader._abandon()
+
+    assert await (await follower).collect() == api.SearchResults(1, [{"text": "own"}])
+    assert get_entities.await_count == 2
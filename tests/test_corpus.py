@@ -0,0 +1,18 @@
+from tests.utils.corpus import make_corpus
+
+
+def test_corpus_is_reproducible():
+    assert make_corpus(1, 20, 100) == make_corpus(1, 20, 100)
+    assert make_corpus(1, 20, 100) != make_corpus(2, 20, 100)
+
+
+def test_corpus_shape():
+    users, posts = make_corpus(1, 20, 500)
+    usernames = {user["username"] for user in users}
+
+    assert len(users) == 20 and len(posts) == 500
+    assert all(post["username"] in usernames for post in posts)
+    assert any(post["echo"] for post in posts)
+    assert any(post["media"] for post in posts)
+    assert any(post["comments"] for post in posts)
+    assert all(post["echo"]["echo"] is None for post in posts if post["echo"])
@@ -0,0 +1,144 @@
+import asyncio
+import re
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import cache
+import counts
+
+
+def make_collection(total_count: int) -> MagicMock:
+    async def count_documents(query, limit=None, **options):
+        return min(total_count, limit) if limit else total_count
+
+    collection = MagicMock()
+    collection.name = "posts"
+    collection.count_documents = AsyncMock(side_effect=count_documents)
+    return collection
+
+
+def test_query_key_is_canonical():
+    regex = re.compile(".*a.*", re.IGNORECASE)
+
+    assert counts.query_key("posts", {"a": regex, "b": 1}) == counts.query_key(
+        "posts", {"b": 1, "a": regex}
+    )
+    assert counts.query_key("posts", {"a": 1}) != counts.query_key("users", {"a": 1})
+
+
+@patch("time.monotonic")
+def test_count_cache_expires(monotonic):
+    cache = counts.CountCache(ttl=10, max_entries=10)
+    monotonic.return_value = 100
+    cache.set("key", 5, True)
+
+    monotonic.return_value = 109
+    assert cache.get("key") == (5, True)
+
+    monotonic.return_value = 111
+    assert cache.get("key") is None
+
+
+def test_count_cache_evicts_least_recently_used():
+    cache = counts.CountCache(ttl=10, max_entries=2)
+    cache.set("a", 1, True)
+    cache.set("b", 2, True)
+    cache.get("a")
+    cache.set("c", 3, True)
+
+    assert cache.get("a") == (1, True)
+    assert cache.get("b") is None
+    assert cache.get("c") == (3, True)
+
+
+@patch("meta.dataset_version")
+def test_count_cache_is_cleared_with_a_new_dataset_version(dataset_version):
+    cache = counts.CountCache(ttl=10, max_entries=10)
+    dataset_version.return_value = "1"
+    cache.set("key", 5, True)
+    assert cache.get("key") == (5, True)
+
+    dataset_version.return_value = "2"
+    assert cache.get("key") is None
+
+
+@pytest.mark.asyncio
+@patch("counts.cache", counts.CountCache(ttl=10, max_entries=10))
+async def test_count_is_only_run_once():
+    collection = make_collection(5)
+
+    assert await counts.count(collection, {"q": 1}) == (5, True)
+    assert await counts.count(collection, {"q": 1}) == (5, True)
+    collection.count_documents.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("counts.COUNT_LIMIT", 100)
+@patch("counts.cache", counts.CountCache(ttl=10, max_entries=10))
+async def test_bounded_count_is_filled_in_the_background():
+    collection = make_collection(250)
+
+    assert await counts.count(collection, {"q": 2}) == (100, False)
+
+    await asyncio.gather(*counts._pending.values())
+    assert await counts.count(collection, {"q": 2}) == (250, True)
+    assert collection.count_documents.await_count == 2
+
+
+@pytest.mark.asyncio
+@patch("counts.COUNT_LIMIT", 100)
+@patch("counts.EXACT_COUNT_CONCURRENCY", 1)
+@patch("counts.cache", counts.CountCache(ttl=10, max_entries=10))
+@patch("cache.result_cache", cache.ResultCache(max_bytes=1024, ttl=10))
+async def test_exact_counts_wait_for_a_free_slot():
+    collection = make_collection(250)
+
+    assert await counts.count(collection, {"q": 3}) == (100, False)
+    assert await counts.count(collection, {"q": 4}) == (100, False)
+    assert list(counts._pending) == [counts.query_key("posts", {"q": 3})]
+
+    await asyncio.gather(*counts._pending.values())
+    assert await counts.count(collection, {"q": 4}) == (100, False)
+    await asyncio.gather(*counts._pending.values())
+    assert await counts.count(collection, {"q": 4}) == (250, True)
+
+
+@pytest.mark.asyncio
+@patch("counts.COUNT_LIMIT", 100)
+@patch("counts.cache", counts.CountCache(ttl=10, max_entries=10))
+@patch("cache.result_cache", cache.ResultCache(max_bytes=1024, ttl=10))
+async def test_exact_count_is_shared_between_workers():
+    collection = make_collection(250)
+    key = counts.query_key("posts", {"q": 5})
+    await cache.result_cache.set(counts._shared_key(key), {"count": 250})
+
+    assert await counts.count(collection, {"q": 5}) == (250, True)
+    assert not counts._pending
+    collection.count_documents.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+@patch("counts.COUNT_LIMIT", 100)
+@patch("counts.cache", counts.CountCache(ttl=10, max_entries=10))
+async def test_exact_count_is_left_to_the_worker_counting_it():
+    result_cache = cache.ResultCache(max_bytes=1024, ttl=10)
+    result_cache._redis = MagicMock(
+        get=AsyncMock(return_value=None), set=AsyncMock(return_value=None)
+    )
+    collection = make_collection(250)
+
+    with patch("cache.result_cache", result_cache):
+        assert await counts.count(collection, {"q": 6}) == (100, False)
+        await asyncio.gather(*counts._pending.values())
+
+    collection.count_documents.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_stored_count():
+    collection = MagicMock()
+    collection.find_one = AsyncMock(side_effect=[{"_id": "#tag", "count": 7}, None])
+
+    assert await counts.stored_count(collection, "#tag") == (7, True)
+    assert await counts.stored_count(collection, "#unused") == (0, True)
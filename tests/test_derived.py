@@ -0,0 +1,110 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pymongo import UpdateOne
+
+import api
+import derived
+import meta
+from enums import SearchBehavior
+from tests.utils.mongo import FakeCursor
+from tests.utils.posts import make_comment, make_post
+
+
+def test_post_participants():
+    echo = make_post("@echoed", "", [make_comment("@echo_commenter", "")], None, None)
+    post = make_post(
+        "@author",
+        "",
+        [make_comment("@commenter", ""), make_comment("@author", "")],
+        echo,
+        None,
+    )
+
+    # comments of the echoed post are not matched by username searches
+    assert derived.post_participants(post) == ["@author", "@commenter", "@echoed"]
+
+
+def test_post_mentions_are_case_folded():
+    echo = make_post("@echoed", "echoing @Someone", [], None, None)
+    post = make_post(
+        "@author",
+        "hi @Someone and @other, #tag",
+        [],
+        echo,
+        {"title": "@titled", "link": "", "image": "", "excerpt": ""},
+    )
+
+    assert derived.post_mentions(post) == ["@other", "@someone", "@titled"]
+
+
+def test_post_hashtags_are_case_folded():
+    echo = make_post("@echoed", "echoing #Tag", [], None, None)
+    post = make_post("@author", "#tag and #Other, not@#", [], echo, None)
+
+    assert derived.post_hashtags(post) == ["#other", "#tag"]
+    assert derived.is_hashtag("#tag")
+    assert not derived.is_hashtag("#tag and more")
+
+
+def test_backfill_hashtags_counts_posts_per_hashtag():
+    posts = MagicMock()
+    posts.find.return_value = FakeCursor([])
+    tags = MagicMock()
+    tags.name = "hashtags"
+
+    derived.backfill_hashtags(posts, tags)
+
+    posts.create_index.assert_called_once_with([("hashtags", 1), ("_id", 1)])
+    pipeline = posts.aggregate.call_args.args[0]
+    assert pipeline[-1] == {"$out": "hashtags"}
+
+
+def test_backfill_writes_in_batches():
+    posts = [{"_id": i, "username": f"@{i}"} for i in range(3)]
+    collection = MagicMock()
+    collection.find.return_value = FakeCursor(posts)
+
+    updated = derived.backfill(
+        collection, lambda doc: {"n": doc["_id"]}, {"username": 1}, batch_size=2
+    )
+
+    assert updated == 3
+    assert [call.args[0] for call in collection.bulk_write.call_args_list] == [
+        [
+            UpdateOne({"_id": 0}, {"$set": {"n": 0}}),
+            UpdateOne({"_id": 1}, {"$set": {"n": 1}}),
+        ],
+        [UpdateOne({"_id": 2}, {"$set": {"n": 2}})],
+    ]
+
+
+def test_queries_use_participants_and_mentions():
+    content_regex = api.get_match_any_regex("content")
+
+    with patch("meta._features", {meta.POST_PARTICIPANTS}):
+        query = api._search_posts_with_mentions_query(
+            "Someone", "content", SearchBehavior.MATCH_ALL
+        )
+
+    assert query == {
+        "$and": [
+            {"$or": [{field: content_regex} for field in api.POST_CONTENT_FIELDS]},
+            {"$or": [{"participants": "@Someone"}, {"mentions": "@someone"}]},
+        ],
+    }
+
+
+@pytest.mark.asyncio
+@patch("meta._features", {meta.POST_HASHTAGS})
+@patch("counts.stored_count")
+async def test_hashtag_searches_use_index_and_stored_counts(stored_count):
+    stored_count.return_value = (42, True)
+    query = api._search_posts_query("", "#Tag", SearchBehavior.MATCH_ALL)
+    mongo = MagicMock()
+
+    stream = await api._get_entities(mongo, "posts", query, 0)
+
+    assert query == {"hashtags": "#tag"}
+    assert (await stream.collect()).page_count == 3
+    stored_count.assert_called_once_with(mongo.db["hashtags"], "#tag")
@@ -0,0 +1,20 @@
+from werkzeug.datastructures import MultiDict
+
+import httpcache
+
+
+def test_canonical_args_ignores_order():
+    assert httpcache.canonical_args(
+        MultiDict([("username", "a"), ("page", "1")])
+    ) == httpcache.canonical_args(MultiDict([("page", "1"), ("username", "a")]))
+
+
+def test_etag_changes_with_each_input():
+    args = MultiDict([("username", "a")])
+    tag = httpcache.etag("1", "r", "/posts", args)
+
+    assert tag == httpcache.etag("1", "r", "/posts", MultiDict([("username", "a")]))
+    assert tag != httpcache.etag("2", "r", "/posts", args)
+    assert tag != httpcache.etag("1", "s", "/posts", args)
+    assert tag != httpcache.etag("1", "r", "/users", args)
+    assert tag != httpcache.etag("1", "r", "/posts", MultiDict([("username", "b")]))
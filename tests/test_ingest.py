@@ -0,0 +1,101 @@
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import ingest
+from api_types import Post
+from tests.utils.posts import make_post
+
+
+def make_line(doc: dict) -> bytes:
+    return json.dumps(doc).encode() + b"\n"
+
+
+def test_validate_accepts_posts():
+    echo = make_post("@echoed", "echo", [], None, None)
+    post = make_post("@author", "text", [], echo, None)
+
+    assert ingest.validate(post, Post) is None
+
+
+@pytest.mark.parametrize(
+    "change,error",
+    [
+        ({"impressions": "3"}, "impressions should be a int"),
+        ({"impressions": True}, "impressions should be a int"),
+        ({"media": {"link": ""}}, "media.title is missing"),
+        ({"comments": [{"username": "@a"}]}, "comments.0.date is missing"),
+        ({"echo": None, "image": 3}, "image should be a str"),
+    ],
+)
+def test_validate_reports_the_first_problem(change, error):
+    post = {**make_post("@author", "text", [], None, None), **change}
+
+    assert ingest.validate(post, Post) == error
+
+
+def test_parse_chunk_completes_valid_documents():
+    post = make_post("@author", "hi @Someone #Tag", [], None, None)
+    lines = [make_line(post), b"\n", b"{not json\n", make_line({"username": "@a"})]
+
+    documents, invalid = ingest.parse_chunk("posts", lines, 11)
+
+    assert [line_number for line_number, _ in invalid] == [13, 14]
+    (document,) = documents
+    assert document["_id"] == ingest.document_id("posts", post)
+    assert document["participants"] == ["@author"]
+    assert document["mentions"] == ["@someone"]
+    assert document["hashtags"] == ["#tag"]
+
+
+def test_document_ids_are_stable():
+    user = {"name": "A", "username": "@a", "avatar": ""}
+
+    assert ingest.document_id("users", user) == ingest.document_id(
+        "users", {**user, "avatar": "new"}
+    )
+
+
+def test_insert_skips_documents_already_loaded():
+    collection = MagicMock()
+    collection.insert_many.side_effect = BulkWriteError(
+        {"writeErrors": [{"code": ingest.DUPLICATE_KEY_ERROR}], "nInserted": 4}
+    )
+
+    assert ingest.insert(collection, [{}] * 5) == 4
+
+    collection.insert_many.side_effect = BulkWriteError(
+        {"writeErrors": [{"code": 2}], "nInserted": 4}
+    )
+    with pytest.raises(BulkWriteError):
+        ingest.insert(collection, [{}] * 5)
+
+
+def test_load_file_resumes_from_checkpoint(tmp_path):
+    path = tmp_path / "users.ndjson.gz"
+    users = [{"name": f"{i}", "username": f"@{i}", "avatar": ""} for i in range(7)]
+    with gzip.open(path, "wb") as f:
+        f.writelines(make_line(user) for user in users)
+
+    db = MagicMock()
+    db["meta"].find_one.return_value = {"lines": 2}
+    collection = MagicMock()
+    collection.insert_many.side_effect = lambda docs, ordered: MagicMock(
+        inserted_ids=[doc["_id"] for doc in docs]
+    )
+
+    with patch("ingest._worker_collection", collection), ThreadPoolExecutor(2) as pool:
+        progress = ingest.load_file(db, "users", str(path), pool, 2, chunk_size=2)
+
+    inserted = [
+        doc["username"]
+        for call in collection.insert_many.call_args_list
+        for doc in call.args[0]
+    ]
+    assert inserted == ["@2", "@3", "@4", "@5", "@6"]
+    assert (progress.lines, progress.inserted) == (7, 5)
+    assert db["meta"].update_one.call_args.args[1] == {"$set": {"lines": 7}}
@@ -0,0 +1,56 @@
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from prometheus_client import REGISTRY
+from quart_rate_limiter.store import MemoryStore
+
+import metrics
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(f"{metrics.NAMESPACE}_{name}", labels) or 0
+
+
+@pytest.mark.asyncio
+async def test_timed_store_records_round_trips():
+    store = metrics.TimedStore(MemoryStore())
+    before = sample("rate_limit_store_seconds_count", operation="set")
+
+    await store.set("key", datetime(2021, 1, 6))
+
+    assert await store.get("key", datetime(2021, 1, 1)) == datetime(2021, 1, 6)
+    assert sample("rate_limit_store_seconds_count", operation="set") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_slow_queries_are_explained():
+    collection = MagicMock()
+    collection.name = "slow"
+    collection.database.command = AsyncMock(
+        return_value={
+            "executionStats": {"totalDocsExamined": 50, "totalKeysExamined": 0}
+        }
+    )
+    find: dict = {"filter": {"text": "query"}, "sort": {"_id": 1}, "limit": 20}
+
+    with patch("metrics.SLOW_QUERY_SECONDS", 1):
+        metrics.check_slow_query(collection, find, 0.5)
+        collection.database.command.assert_not_called()
+
+        await metrics._explain(collection, find, 2)
+
+    (command,), _ = collection.database.command.call_args
+    assert command["explain"] == {"find": "slow", **find}
+    assert command["verbosity"] == "executionStats"
+    assert command["maxTimeMS"] == metrics.SEARCH_TIMEOUT_MS
+    assert sample("slow_query_docs_examined_sum", collection="slow") == 50
+
+
+@pytest.mark.asyncio
+async def test_metrics_route(app):
+    client = app.test_client()
+    response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert "parler_view_phase_seconds" in (await response.get_data()).decode()
@@ -0,0 +1,65 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+import api
+import prerender
+
+
+LOG_LINES = [
+    '1.2.3.4 - - [09/Jan/2021:10:00:00 +0000] "GET /posts?username=a&mentions=true'
+    ' HTTP/1.1" 200 512 "-" "Mozilla/5.0"',
+    '1.2.3.5 - - [09/Jan/2021:10:00:01 +0000] "GET /posts/?mentions=true&username=a'
+    ' HTTP/1.1" 304 0 "-" "Mozilla/5.0"',
+    '1.2.3.6 - - [09/Jan/2021:10:00:02 +0000] "GET /users?username=b HTTP/1.1" 200'
+    ' 512 "-" "Mozilla/5.0"',
+    '1.2.3.7 - - [09/Jan/2021:10:00:03 +0000] "GET /posts?username=a&page=2'
+    ' HTTP/1.1" 200 512 "-" "Mozilla/5.0"',
+    '1.2.3.8 - - [09/Jan/2021:10:00:04 +0000] "GET /posts HTTP/1.1" 200 512 "-" "-"',
+    '1.2.3.9 - - [09/Jan/2021:10:00:05 +0000] "GET /users?username=c HTTP/1.1" 429'
+    ' 512 "-" "Mozilla/5.0"',
+]
+
+
+def test_top_searches_counts_first_pages_in_canonical_form():
+    assert prerender.top_searches(LOG_LINES, 5) == [
+        "/posts?mentions=true&username=a",
+        "/users?username=b",
+    ]
+    assert prerender.top_searches(LOG_LINES, 1) == ["/posts?mentions=true&username=a"]
+
+
+@pytest.mark.asyncio
+@patch("meta._dataset_version", "1")
+@patch("api.search_posts")
+async def test_prerender_writes_pages_the_app_serves(mock_search_posts, app, tmp_path):
+    mock_search_posts.return_value = api.SearchResults(0, [])
+    directory = str(tmp_path)
+    stale = tmp_path / "stale.html"
+    stale.write_text("old")
+
+    assert await prerender.prerender(app, ["/posts?username=a"], directory) == 1
+    assert not stale.exists()
+    (name,) = os.listdir(directory)
+    (tmp_path / name).write_text("prerendered")
+
+    with patch("httpcache.PRERENDER_DIR", directory):
+        response = await app.test_client().get(
+            "/posts?username=a", headers={"X-Forwarded-For": "other"}
+        )
+    assert (await response.get_data()) == b"prerendered"
+    assert response.get_etag() == (name[: -len(".html")], False)
+    assert mock_search_posts.call_count == 1
+
+    # already rendered for this version
+    assert await prerender.prerender(app, ["/posts?username=a"], directory) == 0
+
+
+@pytest.mark.asyncio
+@patch("meta._dataset_version", "1")
+@patch("api.search_posts")
+async def test_prerender_skips_partial_results(mock_search_posts, app, tmp_path):
+    mock_search_posts.return_value = api.SearchResults(0, [], partial=True)
+    assert await prerender.prerender(app, ["/posts?username=a"], str(tmp_path)) == 0
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,64 @@
+import re
+
+import api
+import querycost
+from enums import SearchBehavior, SearchMode
+from querycost import (
+    COLLECTION_SCAN_COST,
+    INDEX_SCAN_COST,
+    INDEX_SEEK_COST,
+    TEXT_SEARCH_COST,
+)
+
+
+def test_no_query_is_free():
+    assert querycost.query_cost(None) == 0
+
+
+def test_content_search_scans_every_field():
+    query = api._search_posts_query("", "bong", SearchBehavior.MATCH_ALL)
+
+    assert querycost.query_cost(query) == 4 * COLLECTION_SCAN_COST
+
+
+def test_trigram_candidates_narrow_the_scan():
+    query = api._search_posts_query("", "bong", SearchBehavior.MATCH_ALL, [1, 2])
+
+    assert querycost.query_cost(query) == INDEX_SEEK_COST
+
+
+def test_match_any_pays_for_every_branch():
+    match_all = api._search_posts_with_mentions_query(
+        "@user", "bong", SearchBehavior.MATCH_ALL
+    )
+    match_any = api._search_posts_with_mentions_query(
+        "@user", "bong", SearchBehavior.MATCH_ANY
+    )
+
+    assert querycost.query_cost(match_any) > querycost.query_cost(match_all)
+
+
+def test_indexed_regexes():
+    assert querycost.query_cost({"username_lower": {"$regex": "^@bo"}}) == (
+        INDEX_SEEK_COST
+    )
+    assert querycost.query_cost({"name_lower": {"$regex": "bo"}}) == INDEX_SCAN_COST
+    assert querycost.query_cost({"name_lower": re.compile("^bo", re.I)}) == (
+        INDEX_SCAN_COST
+    )
+
+
+def test_indexed_condition_bounds_its_neighbours():
+    regex = api.get_match_any_regex("@bo")
+
+    assert querycost.query_cost(
+        {"username_lower": {"$regex": "^@bo"}, "username": regex}
+    ) == (INDEX_SEEK_COST)
+
+
+def test_words_search_uses_the_text_index():
+    query = api._search_posts_query(
+        "", "bong", SearchBehavior.MATCH_ALL, mode=SearchMode.WORDS
+    )
+
+    assert querycost.query_cost(query) == TEXT_SEARCH_COST
@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+import pytest
+from quart_rate_limiter import RateLimitExceeded
+from quart_rate_limiter.store import MemoryStore
+
+import ratelimit
+
+
+@pytest.mark.asyncio
+async def test_cheap_requests_fit_in_the_allowance():
+    store = MemoryStore()
+    limiter = ratelimit.CostLimiter(lambda: store, 10, timedelta(seconds=10))
+
+    for _ in range(10):
+        await limiter.charge("client", 1)
+
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await limiter.charge("client", 1)
+    assert exc_info.value.retry_after == 1
+
+
+@pytest.mark.asyncio
+async def test_expensive_requests_are_capped_at_the_limit():
+    store = MemoryStore()
+    limiter = ratelimit.CostLimiter(lambda: store, 10, timedelta(seconds=10))
+
+    await limiter.charge("client", 1000)
+    with pytest.raises(RateLimitExceeded) as exc_info:
+        await limiter.charge("client", 5)
+    assert exc_info.value.retry_after == 5
+
+    # other clients are unaffected
+    await limiter.charge("other", 10)
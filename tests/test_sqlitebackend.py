@@ -0,0 +1,212 @@
+import json
+import sqlite3
+
+import pytest
+
+import api
+import meta
+import sqlitebackend
+from enums import SearchBehavior
+from tests.utils.posts import make_comment, make_post
+from tests.utils.users import make_user
+
+
+POSTS = [
+    make_post("@alice", "Bong hits", [], None, None),
+    make_post("@bob", "hello @Alice", [], None, None),
+    make_post(
+        "@carol",
+        "unrelated",
+        [make_comment("@alice", "first"), make_comment("@dave", "a BONG")]
+        + [make_comment("@erin", f"comment {i}") for i in range(6)],
+        None,
+        None,
+    ),
+    make_post("@dave", "50% off", [], None, None),
+]
+
+USERS = [make_user("@alice", "Alice Bong"), make_user("@bob", "Bob")]
+
+
+def write_dump(path, documents: list) -> str:
+    path.write_text("".join(json.dumps(doc) + "\n" for doc in documents) + "{bad\n")
+    return str(path)
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    db_path = str(tmp_path / "parler.sqlite3")
+    posts_dump = write_dump(tmp_path / "posts.ndjson", POSTS)
+    users_dump = write_dump(tmp_path / "users.ndjson", USERS)
+
+    assert sqlitebackend.build(db_path, "posts", [posts_dump], chunk_size=2) == 4
+    # loading a dump again inserts nothing
+    assert sqlitebackend.build(db_path, "posts", [posts_dump]) == 0
+    assert sqlitebackend.build(db_path, "users", [users_dump]) == 2
+
+    backend = sqlitebackend.SQLiteBackend(db_path, 2)
+    yield backend
+    backend._pool.close()
+
+
+def usernames(found: api.SearchResults) -> list:
+    return [result["username"] for result in found.results]
+
+
+@pytest.mark.asyncio
+async def test_search_posts_by_content(sqlite_backend):
+    found = await sqlite_backend.search_posts(
+        "", "bong", 0, SearchBehavior.MATCH_ALL, False
+    )
+    assert usernames(found) == ["@alice"]
+    assert found.page_count == 1 and found.page_count_exact
+
+    # terms too short for the trigram index, with LIKE wildcards in them
+    found = await sqlite_backend.search_posts(
+        "", "0%", 0, SearchBehavior.MATCH_ALL, False
+    )
+    assert usernames(found) == ["@dave"]
+
+
+@pytest.mark.asyncio
+async def test_search_posts_by_username(sqlite_backend):
+    found = await sqlite_backend.search_posts(
+        "alice", "", 0, SearchBehavior.MATCH_ALL, False
+    )
+    assert usernames(found) == ["@alice", "@carol"]
+
+    found = await sqlite_backend.search_posts(
+        "alice", "", 0, SearchBehavior.MATCH_ALL, True
+    )
+    assert usernames(found) == ["@alice", "@bob", "@carol"]
+
+    found = await sqlite_backend.search_posts(
+        "alice", "hits", 0, SearchBehavior.MATCH_ALL, True
+    )
+    assert usernames(found) == ["@alice"]
+
+    found = await sqlite_backend.search_posts(
+        "dave", "hello", 0, SearchBehavior.MATCH_ANY, False
+    )
+    assert usernames(found) == ["@bob", "@carol", "@dave"]
+
+
+@pytest.mark.asyncio
+async def test_search_posts_shows_matching_comments(sqlite_backend):
+    charges = []
+
+    async def charge(cost):
+        charges.append(cost)
+
+    found = await sqlite_backend.search_posts(
+        "alice", "bong", 0, SearchBehavior.MATCH_ANY, False, charge=charge
+    )
+    carol = found.results[-1]
+
+    assert carol["comments"] == [
+        {"username": "@alice", "text": "first"},
+        {"username": "@dave", "text": "a BONG"},
+    ]
+    assert carol["comments_total"] == 8
+    assert charges == [2.0]
+
+
+def test_echoed_comments_are_picked_like_the_post_comments():
+    echo = make_post(
+        "@erin",
+        "echoed",
+        [make_comment("@frank", f"comment {i}") for i in range(8)]
+        + [make_comment("@frank", "a BONG")],
+        None,
+        None,
+    )
+    row = (5, json.dumps(make_post("@dave", "echoing", [], echo, None)))
+
+    post = sqlitebackend._post_result(row, "", "bong", False)
+
+    assert post["echo"]["comments"] == [{"username": "@frank", "text": "a BONG"}]
+    assert post["echo"]["comments_total"] == 9
+
+
+def test_read_echoed_comments():
+    echo = make_post("@erin", "echoed", [make_comment("@frank", "hi")], None, None)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, document TEXT)")
+    conn.execute(
+        "INSERT INTO posts VALUES (1, ?)",
+        (json.dumps(make_post("@dave", "echoing", [], echo, None)),),
+    )
+    conn.execute(
+        "INSERT INTO posts VALUES (2, ?)",
+        (json.dumps(make_post("@dave", "not echoing", [], None, None)),),
+    )
+
+    assert sqlitebackend._read_comments(conn, 1, 0, 10, True) == (
+        [{"username": "@frank", "text": "hi"}],
+        1,
+    )
+    assert sqlitebackend._read_comments(conn, 1, 0, 10, False) == ([], 0)
+    assert sqlitebackend._read_comments(conn, 2, 0, 10, True) == ([], 0)
+
+
+def test_comment_mentions_match_whole_handles():
+    comment = make_comment("@erin", "cc @Alice")
+
+    assert sqlitebackend._comment_matches(comment, "alice", "", True)
+    assert not sqlitebackend._comment_matches(comment, "ali", "", True)
+    assert not sqlitebackend._comment_matches(comment, "alice", "", False)
+
+
+@pytest.mark.asyncio
+async def test_search_posts_pages_by_cursor(sqlite_backend):
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(api, "PAGE_LIMIT", 1)
+        first = await sqlite_backend.search_posts(
+            "alice", "", 0, SearchBehavior.MATCH_ALL, True
+        )
+        cursor = api.encode_cursor(1, after=first.results[0]["_id"])
+        second = await sqlite_backend.search_posts(
+            "alice", "", 1, SearchBehavior.MATCH_ALL, True, cursor
+        )
+        cursor = api.encode_cursor(0, before=second.results[0]["_id"])
+        back = await sqlite_backend.search_posts(
+            "alice", "", 0, SearchBehavior.MATCH_ALL, True, cursor
+        )
+
+    assert first.page_count == 4
+    assert usernames(first) == ["@alice"]
+    assert usernames(second) == ["@bob"]
+    assert back.results == first.results
+
+
+@pytest.mark.asyncio
+async def test_search_users(sqlite_backend):
+    assert usernames(await sqlite_backend.search_users("BONG", 0)) == ["@alice"]
+    assert usernames(await sqlite_backend.search_users("b", 0)) == ["@alice", "@bob"]
+    assert (await sqlite_backend.search_users(" ", 0)).results == []
+
+
+@pytest.mark.asyncio
+async def test_get_comments(sqlite_backend):
+    found = await sqlite_backend.search_posts(
+        "carol", "", 0, SearchBehavior.MATCH_ALL, False
+    )
+    post_id = str(found.results[0]["_id"])
+
+    comments, total = await sqlite_backend.get_comments(post_id, 6)
+    assert comments == [
+        {"username": "@erin", "text": "comment 4"},
+        {"username": "@erin", "text": "comment 5"},
+    ]
+    assert total == 8
+    assert await sqlite_backend.get_comments("999", 0) is None
+    assert await sqlite_backend.get_comments("nope", 0) is None
+
+
+@pytest.mark.asyncio
+async def test_refresh_meta_loads_dataset_version(sqlite_backend):
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr("meta._dataset_version", "")
+        m.setattr("meta._features", set())
+        await sqlite_backend.refresh_meta()
+        assert meta.dataset_version() != ""
@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from quart import Quart
+
+import streaming
+
+
+async def collect(chunks) -> list[bytes]:
+    return [chunk async for chunk in streaming._coalesce(chunks)]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_joins_chunks_between_waits():
+    waited = asyncio.Event()
+
+    async def chunks():
+        yield "<head>"
+        yield "<form>"
+        await waited.wait()
+        yield "<post>"
+
+    async def release():
+        await asyncio.sleep(0.01)
+        waited.set()
+
+    _, written = await asyncio.gather(release(), collect(chunks()))
+
+    assert written == [b"<head><form>", b"<post>"]
+
+
+@pytest.mark.asyncio
+async def test_coalesce_raises_rendering_errors():
+    async def chunks():
+        yield "<head>"
+        raise ValueError("broken template")
+
+    with pytest.raises(ValueError):
+        await collect(chunks())
+
+
+@pytest.mark.asyncio
+async def test_ndjson_closes_the_batches_when_the_client_leaves():
+    closed = asyncio.Event()
+
+    async def batches():
+        try:
+            yield [{"a": 1}]
+            yield [{"a": 2}]
+        finally:
+            closed.set()
+
+    async with Quart(__name__).app_context():
+        response = streaming.stream_ndjson(batches())
+        async with response.response as body:
+            async for chunk in body:
+                assert chunk == b'{"a": 1}\n'
+                break
+
+    assert closed.is_set()
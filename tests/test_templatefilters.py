@@ -0,0 +1,66 @@
+import pytest
+
+import api
+import templatefilters
+
+
+@pytest.mark.asyncio
+async def test_highlights_without_links(app):
+    regex = api.get_highlighter_regex("post")
+
+    async with app.test_request_context("/posts"):
+        assert (
+            templatefilters.with_links_and_highlights("a post, two posts", regex)
+            == "a <mark>post</mark>, two <mark>post</mark>s"
+        )
+
+
+@pytest.mark.asyncio
+async def test_links_without_highlights(app):
+    async with app.test_request_context("/posts"):
+        assert templatefilters.with_links_and_highlights(
+            "hi @someone #tag @Private"
+        ) == templatefilters.with_search_links("hi @someone #tag @Private")
+
+
+@pytest.mark.asyncio
+async def test_highlight_inside_link_leaves_href_alone(app):
+    regex = api.get_highlighter_regex("tag")
+
+    async with app.test_request_context("/posts"):
+        assert templatefilters.with_links_and_highlights("#tag", regex) == (
+            '<a href="/posts?search_content=%23tag">#<mark>tag</mark></a>'
+        )
+
+
+@pytest.mark.asyncio
+async def test_highlight_across_link_is_split(app):
+    regex = api.get_highlighter_regex("see #ta")
+
+    async with app.test_request_context("/posts"):
+        assert templatefilters.with_links_and_highlights("see #tag", regex) == (
+            "<mark>see </mark>"
+            '<a href="/posts?search_content=%23tag"><mark>#ta</mark>g</a>'
+        )
+
+
+@pytest.mark.asyncio
+async def test_highlight_out_of_link_is_split(app):
+    regex = api.get_highlighter_regex("g and")
+
+    async with app.test_request_context("/posts"):
+        assert templatefilters.with_links_and_highlights("#tag and", regex) == (
+            '<a href="/posts?search_content=%23tag">#ta<mark>g</mark></a>'
+            "<mark> and</mark>"
+        )
+
+
+@pytest.mark.asyncio
+async def test_search_urls_are_memoized(app):
+    templatefilters._cached_search_url.cache_clear()
+
+    async with app.test_request_context("/posts"):
+        templatefilters.with_links_and_highlights("#tag and #tag and #other")
+
+    info = templatefilters._cached_search_url.cache_info()
+    assert (info.hits, info.misses) == (1, 2)
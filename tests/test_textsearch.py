@@ -0,0 +1,42 @@
+import pytest
+
+import textsearch
+from templatefilters import with_highlighted_term, with_links_and_highlights
+
+
+def test_searched_words_skip_negated_terms():
+    assert textsearch.searched_words('parler "free speech" -twitter') == [
+        "parler",
+        "free",
+        "speech",
+    ]
+
+
+@pytest.mark.parametrize(
+    "search,text,expected",
+    [
+        (
+            "running",
+            "He runs, ran and keeps running",
+            "He <mark>runs</mark>, ran and keeps <mark>running</mark>",
+        ),
+        ("Studies", "one study", "one <mark>study</mark>"),
+        ("cat -dog", "cat and dog", "<mark>cat</mark> and dog"),
+        ("cat", "concatenate", "concatenate"),
+    ],
+)
+def test_word_highlighter_matches_stems(search, text, expected):
+    highlighter = textsearch.WordHighlighter(search)
+
+    assert with_highlighted_term(text, highlighter) == expected
+
+
+@pytest.mark.asyncio
+async def test_word_highlighter_works_with_links(app):
+    highlighter = textsearch.WordHighlighter("voting")
+
+    async with app.test_request_context("/posts"):
+        highlighted = with_links_and_highlights("@voter votes", highlighter)
+
+    assert highlighted.endswith(" <mark>votes</mark>")
+    assert "<mark>voter</mark>" not in highlighted
@@ -0,0 +1,151 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+import api
+import trigrams
+from constants import POST_CONTENT_FIELDS
+from tests.utils.mongo import FakeCursor
+from tests.utils.posts import make_post
+
+
+def make_postings(chunks: list[dict]) -> MagicMock:
+    counts: dict[str, int] = {}
+    for chunk in chunks:
+        counts[chunk["trigram"]] = counts.get(chunk["trigram"], 0) + chunk["count"]
+
+    def aggregate(pipeline):
+        wanted = pipeline[0]["$match"]["trigram"]["$in"]
+        stats = [
+            {"_id": gram, "count": count}
+            for gram, count in counts.items()
+            if gram in wanted
+        ]
+        return MagicMock(to_list=AsyncMock(return_value=stats))
+
+    def find(query, projection):
+        return FakeCursor([c for c in chunks if c["trigram"] == query["trigram"]])
+
+    postings = MagicMock()
+    postings.aggregate.side_effect = aggregate
+    postings.find.side_effect = find
+    return postings
+
+
+def test_trigrams_are_case_folded():
+    assert trigrams.trigrams("AbCd") == {"abc", "bcd"}
+
+
+def test_trigrams_keep_whitespace():
+    assert trigrams.trigrams(" bong ") == {" bo", "bon", "ong", "ng "}
+
+
+def test_trigrams_of_short_string_is_empty():
+    assert trigrams.trigrams("ab") == set()
+
+
+def test_field_values_descends_into_arrays():
+    doc = {
+        "text": "post",
+        "media": {"title": "title"},
+        "comment": [{"text": "one"}, {"text": "two"}, {"username": "@x"}],
+        "echo": None,
+    }
+
+    assert list(trigrams.field_values(doc, "text")) == ["post"]
+    assert list(trigrams.field_values(doc, "media.title")) == ["title"]
+    assert list(trigrams.field_values(doc, "comment.text")) == ["one", "two"]
+    assert list(trigrams.field_values(doc, "echo.text")) == []
+
+
+@pytest.mark.parametrize("term", [" bong ", "BONG", "ong b", "#tag", "Ünï"])
+def test_document_trigrams_cover_every_regex_match(term):
+    posts = [
+        make_post("@a", "a bong here", [], None, None),
+        make_post("@b", "no match", [], None, None),
+        make_post("@c", "", [], None, {"title": "#TAG ünïcode", "link": ""}),
+        make_post("@d", "", [], make_post("@e", "echoed BONG b", [], None, None), None),
+    ]
+    regex = api.get_match_any_regex(term)
+
+    for post in posts:
+        matches = any(
+            regex.match(value)
+            for field in POST_CONTENT_FIELDS
+            for value in trigrams.field_values(post, field)
+        )
+        if matches:
+            assert trigrams.trigrams(term) <= trigrams.document_trigrams(
+                post, POST_CONTENT_FIELDS
+            )
+
+
+@pytest.mark.asyncio
+async def test_find_candidates_intersects_postings():
+    postings = make_postings(
+        [
+            {"trigram": "bon", "ids": [1, 2], "count": 2},
+            {"trigram": "bon", "ids": [3], "count": 1},
+            {"trigram": "ong", "ids": [2, 3, 4], "count": 3},
+        ]
+    )
+
+    assert await trigrams.find_candidates(postings, "bong", 100) == [2, 3]
+
+
+@pytest.mark.asyncio
+async def test_find_candidates_missing_trigram_has_no_candidates():
+    postings = make_postings([{"trigram": "bon", "ids": [1], "count": 1}])
+
+    assert await trigrams.find_candidates(postings, "bong", 100) == []
+
+
+@pytest.mark.asyncio
+async def test_find_candidates_gives_up_on_common_trigrams():
+    postings = make_postings(
+        [
+            {"trigram": "bon", "ids": [1, 2, 3], "count": 3},
+            {"trigram": "ong", "ids": [1, 2, 3], "count": 3},
+        ]
+    )
+
+    assert await trigrams.find_candidates(postings, "bong", 2) is None
+
+
+@pytest.mark.asyncio
+async def test_find_candidates_skips_postings_of_common_trigrams():
+    postings = make_postings(
+        [
+            {"trigram": "bon", "ids": [2], "count": 1},
+            {"trigram": "ong", "ids": list(range(20)), "count": 20},
+            {"trigram": " bo", "ids": list(range(200)), "count": 200},
+        ]
+    )
+
+    assert await trigrams.find_candidates(postings, " bong", 100) == [2]
+    assert [call.args[0] for call in postings.find.call_args_list] == [
+        {"trigram": "bon"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_find_candidates_short_term_is_not_indexed():
+    assert await trigrams.find_candidates(make_postings([]), "ab", 100) is None
+
+
+def test_content_query_with_candidates():
+    content_regex = api.get_match_any_regex("bong")
+
+    assert api._posts_by_content_query("bong", [1, 2]) == {
+        "$and": [
+            {"_id": {"$in": [1, 2]}},
+            {
+                "$or": [
+                    {"text": content_regex},
+                    {"media.title": content_regex},
+                    {"comment.text": content_regex},
+                    {"echo.text": content_regex},
+                ],
+            },
+        ],
+    }
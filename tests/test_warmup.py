@@ -0,0 +1,71 @@
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+import api
+import warmup
+
+
+def test_precompile_templates(app):
+    app.jinja_env.cache.clear()
+
+    compiled = warmup.precompile_templates(app)
+
+    assert compiled == len(app.jinja_env.list_templates()) > 0
+    assert len(app.jinja_env.cache) == compiled
+
+
+@pytest.mark.asyncio
+async def test_prime_pool_runs_commands_concurrently():
+    db = MagicMock()
+    db.command = AsyncMock()
+
+    await warmup.prime_pool(db, 3)
+
+    assert db.command.await_count == 3
+
+
+@pytest.mark.asyncio
+@patch("api.search_posts")
+async def test_warm_up_replays_searches_then_reports_ready(mock_search_posts, app):
+    mock_search_posts.return_value = api.SearchResults(0, [])
+    db = MagicMock()
+    db.command = AsyncMock()
+
+    with patch("warmup._ready", False):
+        client = app.test_client()
+        assert (await client.get("/ready")).status_code == 503
+
+        await warmup.warm_up(app, db, 1, ["/posts?search_content=a"] * 2)
+
+        assert (await client.get("/ready")).status_code == 200
+    assert mock_search_posts.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_warm_up_failures_still_report_ready(app):
+    db = MagicMock()
+    db.command = AsyncMock(side_effect=Exception("no mongo"))
+
+    with patch("warmup._ready", False):
+        await warmup.warm_up(app, db, 1, [])
+
+        assert warmup.is_ready()
+
+
+@pytest.mark.asyncio
+async def test_ready_waits_for_every_worker(app, tmp_path):
+    db = MagicMock()
+    db.command = AsyncMock()
+
+    with patch("warmup._ready", False), patch("warmup.READY_DIR", str(tmp_path)):
+        with patch("warmup.WORKERS", 2):
+            await warmup.warm_up(app, db, 1, [])
+            assert not warmup.is_ready()
+
+            # another worker of the same run
+            (tmp_path / f"{warmup._marker_prefix()}1").touch()
+            assert warmup.is_ready()
+
+            warmup.clear_ready()
+            assert not warmup.is_ready()
@@ -0,0 +1,146 @@
+import random
+import string
+from typing import Optional
+
+from bson import ObjectId
+
+from api_types import Post, PostComment, PostMedia, User
+from tests.utils.posts import make_post
+from tests.utils.users import make_user
+
+
+# vocabulary weighted towards short, common words like real posts
+WORDS = (
+    "the a to and of is in it that you for this on be are not they we have with "
+    "was all what just like so do if but people can now about get our will one "
+    "more their from when who there out up no how time need want know going "
+    "right vote election country freedom news truth media patriot america "
+    "president law state government police fight stop free speech trump biden "
+    "god family money video watch share follow read back today never ever"
+).split()
+
+HASHTAGS = (
+    "#maga #stopthesteal #trump2020 #kag #wwg1wga #patriots #freedom #news "
+    "#electionfraud #parler #twexit #usa #biden #covid #truth #america"
+).split()
+
+# share of posts made up of nothing but media
+MEDIA_ONLY_RATE = 0.2
+MEDIA_RATE = 0.25
+ECHO_RATE = 0.15
+HASHTAG_RATE = 0.05
+MENTION_RATE = 0.04
+# median number of words in a post or comment
+MEDIAN_POST_WORDS = 25
+MEDIAN_COMMENT_WORDS = 12
+MAX_COMMENTS = 200
+
+
+def _username(rng: random.Random) -> str:
+    length = rng.randint(4, 15)
+    alphabet = string.ascii_letters + string.digits + "_"
+    return "@" + "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def _name(rng: random.Random) -> str:
+    return " ".join(w.capitalize() for w in rng.sample(WORDS, rng.randint(1, 3)))
+
+
+def _word_count(rng: random.Random, median: int) -> int:
+    # text lengths are long tailed, most posts are short and a few are essays
+    return max(1, int(rng.lognormvariate(0, 0.9) * median))
+
+
+def _comment_count(rng: random.Random) -> int:
+    # most posts get no comments, a handful get hundreds
+    if rng.random() < 0.6:
+        return 0
+    return min(MAX_COMMENTS, int(rng.paretovariate(1.2)))
+
+
+class CorpusGenerator:
+    """
+    Builds a reproducible archive of users and posts.
+
+    Authors and mentioned users are drawn with Zipf-like popularity, so a few
+    accounts turn up across much of the archive like they do in the real one.
+    """
+
+    def __init__(self, seed: int, user_count: int):
+        self.rng = random.Random(seed)
+        self.users = [
+            make_user(_username(self.rng), _name(self.rng)) for _ in range(user_count)
+        ]
+        self._weights = [1 / rank for rank in range(1, user_count + 1)]
+        self.posts: list[Post] = []
+
+    def _user(self) -> str:
+        return self.rng.choices(self.users, self._weights)[0]["username"]
+
+    def _object_id(self) -> ObjectId:
+        return ObjectId(bytes(self.rng.getrandbits(8) for _ in range(12)))
+
+    def text(self, median_words: int) -> str:
+        words = []
+        for _ in range(_word_count(self.rng, median_words)):
+            roll = self.rng.random()
+            if roll < HASHTAG_RATE:
+                words.append(self.rng.choice(HASHTAGS))
+            elif roll < HASHTAG_RATE + MENTION_RATE:
+                words.append(self._user())
+            else:
+                words.append(self.rng.choice(WORDS))
+        return " ".join(words)
+
+    def comment(self) -> PostComment:
+        return {
+            "username": self._user(),
+            "date": "",
+            "text": self.text(MEDIAN_COMMENT_WORDS),
+            "replies": 0,
+            "echos": 0,
+            "upvotes": self.rng.randint(0, 50),
+        }
+
+    def media(self) -> PostMedia:
+        return {
+            "link": f"https://example.com/{self.rng.getrandbits(32):x}",
+            "title": self.text(8),
+            "image": "",
+            "excerpt": self.text(20),
+        }
+
+    def post(self) -> Post:
+        media: Optional[PostMedia] = None
+        text = ""
+        roll = self.rng.random()
+        if roll < MEDIA_ONLY_RATE:
+            media = self.media()
+        else:
+            text = self.text(MEDIAN_POST_WORDS)
+            if roll < MEDIA_ONLY_RATE + MEDIA_RATE:
+                media = self.media()
+
+        echo = None
+        if self.posts and self.rng.random() < ECHO_RATE:
+            echoed = dict(self.rng.choice(self.posts))
+            echoed.pop("_id")
+            echoed["echo"] = None
+            echo = echoed
+
+        comments = [self.comment() for _ in range(_comment_count(self.rng))]
+        post = make_post(self._user(), text, comments, echo, media)  # type: ignore
+        post["_id"] = self._object_id()  # type: ignore
+        return post
+
+    def generate(self, post_count: int) -> list[Post]:
+        for _ in range(post_count):
+            self.posts.append(self.post())
+        return self.posts
+
+
+def make_corpus(
+    seed: int, user_count: int, post_count: int
+) -> tuple[list[User], list[Post]]:
+    generator = CorpusGenerator(seed, user_count)
+    return generator.users, generator.generate(post_count)
@@ -0,0 +1,44 @@
+class FakeCursor:
+    """Stands in for a Motor or PyMongo cursor over a fixed list of documents."""
+
+    def __init__(self, docs: list):
+        self.docs = docs
+        self.position = 0
+        self.closed = False
+
+    def sort(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def skip(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def limit(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def batch_size(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def max_time_ms(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def comment(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    async def to_list(self, length=None) -> list:
+        end = len(self.docs) if length is None else self.position + length
+        docs = self.docs[self.position : end]
+        self.position += len(docs)
+        return docs
+
+    async def close(self) -> None:
+        self.closed = True
+
+    def __iter__(self):
+        return iter(self.docs)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
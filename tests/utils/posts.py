@@ -3,6 +3,17 @@ from typing import Optional
 from api_types import Echo, Post, PostComment, PostMedia
 
 
+def make_comment(username: str, text: str) -> PostComment:
+    return {
+        "username": username,
+        "date": "",
+        "text": text,
+        "replies": 0,
+        "echos": 0,
+        "upvotes": 0,
+    }
+
+
 def make_post(
     username: str,
     text: str,